@@ -0,0 +1,125 @@
+"""
+DRF authentication backed by a cache of user snapshots.
+
+A warm token or session request is authenticated from the `auth` cache
+alone: no authtoken/users JOIN and no user query. The user is a real User
+instance built from the snapshot, with every other field deferred, so code
+that needs more (e.g. `request.user.first_name`) still loads it on access.
+Snapshots are dropped whenever the user is saved or deleted and tokens when
+they are deleted (see accounts.signals); AUTH_CACHE_TIMEOUT bounds staleness
+either way.
+"""
+import hashlib
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+from django.utils.crypto import constant_time_compare
+from django.utils.translation import gettext_lazy as _
+from rest_framework.authentication import SessionAuthentication, TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import User
+
+# Everything the API's permission and role checks and UserSerializer read
+SNAPSHOT_FIELDS = ('id', 'username', 'email', 'user_type', 'is_active', 'is_email_verified', 'created_at')
+
+class AuthCache:
+    """token -> user id and user id -> snapshot entries in the `auth` cache"""
+    
+    def __init__(self, cache):
+        self.cache = cache
+        self.fields = [f.attname for f in User._meta.concrete_fields if f.attname in SNAPSHOT_FIELDS]
+    
+    @staticmethod
+    def token_key(key):
+        # Raw tokens never leave the database
+        return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+    
+    @staticmethod
+    def user_key(user_id):
+        return f'auth:user:{user_id}'
+    
+    def token_user_id(self, key):
+        """User id for a token key, or None when the token does not exist"""
+        cache_key = self.token_key(key)
+        user_id = self.cache.get(cache_key)
+        if user_id is None:
+            user_id = Token.objects.filter(key=key).values_list('user_id', flat=True).first()
+            if user_id is not None:
+                self.cache.set(cache_key, user_id)
+        return user_id
+    
+    def get_user(self, user_id):
+        """(user, session auth hash) from the snapshot, or (None, None) for unknown ids"""
+        cache_key = self.user_key(user_id)
+        snapshot = self.cache.get(cache_key)
+        if snapshot is None:
+            user = User.objects.filter(pk=user_id).first()
+            if user is None:
+                return None, None
+            snapshot = {field: getattr(user, field) for field in self.fields}
+            snapshot['session_auth_hash'] = user.get_session_auth_hash()
+            self.cache.set(cache_key, snapshot)
+        user = User.from_db(DEFAULT_DB_ALIAS, self.fields, [snapshot[field] for field in self.fields])
+        return user, snapshot['session_auth_hash']
+    
+    def forget_user(self, user_id):
+        self.cache.delete(self.user_key(user_id))
+    
+    def forget_token(self, key):
+        self.cache.delete(self.token_key(key))
+
+@lru_cache(maxsize=None)
+def get_auth_cache():
+    return AuthCache(caches[settings.AUTH_CACHE_ALIAS])
+
+@receiver(setting_changed)
+def _reset_auth_cache(setting, **kwargs):
+    if setting in ('AUTH_CACHE_ALIAS', 'CACHES'):
+        get_auth_cache.cache_clear()
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication answered from the auth cache"""
+    
+    def authenticate_credentials(self, key):
+        auth_cache = get_auth_cache()
+        user_id = auth_cache.token_user_id(key)
+        if user_id is None:
+            raise AuthenticationFailed(_('Invalid token.'))
+        
+        user, _session_hash = auth_cache.get_user(user_id)
+        if user is None or not user.is_active:
+            raise AuthenticationFailed(_('User inactive or deleted.'))
+        
+        token = Token.from_db(DEFAULT_DB_ALIAS, ['key', 'user_id'], [key, user_id])
+        token.user = user
+        return user, token
+
+class CachedSessionAuthentication(SessionAuthentication):
+    """
+    SessionAuthentication that reads the user id and auth hash from the
+    session and the user from the auth cache, instead of letting
+    AuthenticationMiddleware load the user from the database.
+    """
+    
+    def authenticate(self, request):
+        session = request._request.session
+        user_id = session.get(SESSION_KEY)
+        if user_id is None or session.get(BACKEND_SESSION_KEY) not in settings.AUTHENTICATION_BACKENDS:
+            return None
+        
+        user, session_hash = get_auth_cache().get_user(User._meta.pk.to_python(user_id))
+        # Same checks as django.contrib.auth.get_user: a password change ends other sessions
+        if user is None or not user.is_active:
+            return None
+        if not constant_time_compare(session.get(HASH_SESSION_KEY, ''), session_hash):
+            return None
+        
+        self.enforce_csrf(request)
+        return user, None
@@ -0,0 +1,189 @@
+import heapq
+import logging
+import queue
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+def serialize_message(message):
+    """JSON-safe representation of an email, for queues that cross processes"""
+    return {
+        'subject': message.subject,
+        'body': message.body,
+        'from_email': message.from_email,
+        'to': list(message.to),
+        'alternatives': [list(alternative) for alternative in getattr(message, 'alternatives', [])],
+    }
+
+def deserialize_message(data, connection=None):
+    message = EmailMultiAlternatives(
+        data['subject'],
+        data['body'],
+        data['from_email'],
+        data['to'],
+        connection=connection,
+    )
+    for content, mimetype in data['alternatives']:
+        message.attach_alternative(content, mimetype)
+    return message
+
+def retry_delay(attempt):
+    """Exponential backoff: base, 2*base, 4*base, ... seconds"""
+    return settings.EMAIL_QUEUE_RETRY_BACKOFF * (2 ** attempt)
+
+class ThreadPoolEmailQueue:
+    """
+    In-process email queue; needs no broker.
+    
+    Worker threads drain the queue in batches and send each batch over one
+    SMTP connection. Failed messages are retried with exponential backoff, and
+    a dedupe key suppresses repeat sends inside EMAIL_QUEUE_DEDUPE_SECONDS.
+    """
+    
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._delayed = []
+        self._delayed_lock = threading.Lock()
+        self._recent = {}
+        self._recent_lock = threading.Lock()
+        self._pending = 0
+        self._idle = threading.Condition()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+    
+    def enqueue(self, message, dedupe_key=None):
+        if dedupe_key and not self._claim(dedupe_key):
+            return False
+        with self._idle:
+            self._pending += 1
+        self._queue.put((message, 0))
+        self._ensure_workers()
+        return True
+    
+    def _claim(self, dedupe_key):
+        now = time.monotonic()
+        with self._recent_lock:
+            for key in [k for k, expires in self._recent.items() if expires <= now]:
+                del self._recent[key]
+            if dedupe_key in self._recent:
+                return False
+            self._recent[dedupe_key] = now + settings.EMAIL_QUEUE_DEDUPE_SECONDS
+            return True
+    
+    def _ensure_workers(self):
+        with self._workers_lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            while len(self._workers) < settings.EMAIL_QUEUE_WORKERS:
+                worker = threading.Thread(target=self._run, name='email-queue', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+    
+    def _release_due(self):
+        now = time.monotonic()
+        with self._delayed_lock:
+            while self._delayed and self._delayed[0][0] <= now:
+                _, _, item = heapq.heappop(self._delayed)
+                self._queue.put(item)
+    
+    def _run(self):
+        while True:
+            self._release_due()
+            try:
+                batch = [self._queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(batch) < settings.EMAIL_QUEUE_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send_batch(batch)
+    
+    def _send_batch(self, batch):
+        done = 0
+        try:
+            connection = get_connection(fail_silently=False)
+            connection.open()
+        except Exception:
+            logger.exception('Could not open email connection')
+            for message, attempt in batch:
+                done += self._retry_or_drop(message, attempt)
+            self._mark_done(done)
+            return
+        
+        try:
+            for message, attempt in batch:
+                try:
+                    message.connection = connection
+                    message.send(fail_silently=False)
+                    done += 1
+                except Exception:
+                    logger.warning('Email to %s failed (attempt %d)', message.to, attempt + 1, exc_info=True)
+                    done += self._retry_or_drop(message, attempt)
+        finally:
+            try:
+                connection.close()
+            except Exception:
+                pass
+            self._mark_done(done)
+    
+    def _retry_or_drop(self, message, attempt):
+        if attempt + 1 > settings.EMAIL_QUEUE_MAX_RETRIES:
+            logger.error('Giving up on email to %s after %d attempts', message.to, attempt + 1)
+            return 1
+        with self._delayed_lock:
+            heapq.heappush(
+                self._delayed,
+                (time.monotonic() + retry_delay(attempt), id(message), (message, attempt + 1))
+            )
+        return 0
+    
+    def _mark_done(self, count):
+        with self._idle:
+            self._pending -= count
+            if self._pending <= 0:
+                self._idle.notify_all()
+    
+    def join(self, timeout=None):
+        """Block until every queued message has been sent or given up on"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending <= 0, timeout=timeout)
+
+class CeleryEmailQueue:
+    """
+    Send through Celery workers (broker at CELERY_BROKER_URL).
+    
+    Deduplication uses the shared Django cache; retries and backoff are handled
+    by the task.
+    """
+    
+    def enqueue(self, message, dedupe_key=None):
+        from .tasks import send_email
+        
+        if dedupe_key and not cache.add(f'email-dedupe:{dedupe_key}', 1, settings.EMAIL_QUEUE_DEDUPE_SECONDS):
+            return False
+        send_email.delay(serialize_message(message))
+        return True
+
+@lru_cache(maxsize=None)
+def get_email_queue():
+    """Return the configured email queue instance"""
+    return import_string(settings.EMAIL_QUEUE_BACKEND)()
+
+@receiver(setting_changed)
+def _reset_email_queue(setting, **kwargs):
+    if setting == 'EMAIL_QUEUE_BACKEND':
+        get_email_queue.cache_clear()
+
+def enqueue_email(message, dedupe_key=None):
+    """Queue an email for background delivery; False when deduplicated"""
+    return get_email_queue().enqueue(message, dedupe_key=dedupe_key)
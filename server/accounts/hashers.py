@@ -0,0 +1,117 @@
+"""
+Password hashers whose work factors come from settings, run on a bounded
+pool of threads.
+
+hashlib's PBKDF2 and scrypt (and argon2-cffi) release the GIL, so the pool's
+threads hash on as many cores while request threads wait. Bounding the pool
+keeps a burst of logins from taking every core away from the rest of the API,
+and bounding its queue turns overload into an immediate HashingBusy (503)
+instead of a backlog of logins that time out anyway.
+
+Django rehashes a password on the next successful login whenever the preferred
+hasher (first in PASSWORD_HASHERS) or its work factor changes, so retuning the
+settings upgrades stored hashes as users log in.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+_pool_thread = threading.local()
+
+class HashingBusy(Exception):
+    """More hashes are queued than PASSWORD_HASHING_MAX_PENDING allows"""
+
+class HashingPool:
+    """At most `workers` hashes run at once and `max_pending` more may wait"""
+    
+    def __init__(self, workers, max_pending):
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix='password-hashing',
+            initializer=self._mark_pool_thread
+        )
+        self.slots = threading.BoundedSemaphore(workers + max_pending)
+    
+    @staticmethod
+    def _mark_pool_thread():
+        _pool_thread.active = True
+    
+    def run(self, fn, *args, **kwargs):
+        # Hashers call encode() from verify(); nested calls run in place
+        if getattr(_pool_thread, 'active', False):
+            return fn(*args, **kwargs)
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy('Too many password checks in progress.')
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+@lru_cache(maxsize=None)
+def get_hashing_pool():
+    return HashingPool(settings.PASSWORD_HASHING_WORKERS, settings.PASSWORD_HASHING_MAX_PENDING)
+
+@receiver(setting_changed)
+def _reset_hashing_pool(setting, **kwargs):
+    if setting in ('PASSWORD_HASHING_WORKERS', 'PASSWORD_HASHING_MAX_PENDING'):
+        get_hashing_pool.cache_clear()
+
+class PooledHasherMixin:
+    """Runs encode() and verify() on the hashing pool"""
+    
+    def encode(self, *args, **kwargs):
+        return get_hashing_pool().run(super().encode, *args, **kwargs)
+    
+    def verify(self, *args, **kwargs):
+        return get_hashing_pool().run(super().verify, *args, **kwargs)
+
+class PBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    """pbkdf2_sha256 with PASSWORD_PBKDF2_ITERATIONS"""
+    
+    @property
+    def iterations(self):
+        return settings.PASSWORD_PBKDF2_ITERATIONS
+
+class ScryptPasswordHasher(PooledHasherMixin, hashers.ScryptPasswordHasher):
+    """scrypt with PASSWORD_SCRYPT_WORK_FACTOR (N), _BLOCK_SIZE (r) and _PARALLELISM (p)"""
+    
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_SCRYPT_WORK_FACTOR
+    
+    @property
+    def block_size(self):
+        return settings.PASSWORD_SCRYPT_BLOCK_SIZE
+    
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_SCRYPT_PARALLELISM
+    
+    @property
+    def maxmem(self):
+        # A ceiling, not an allocation: OpenSSL's default of 32MB rejects
+        # N * r above 2**18, and verifying must also cope with older, costlier hashes
+        return settings.PASSWORD_SCRYPT_MAXMEM
+
+class Argon2PasswordHasher(PooledHasherMixin, hashers.Argon2PasswordHasher):
+    """argon2id with PASSWORD_ARGON2_TIME_COST, _MEMORY_COST (KiB) and _PARALLELISM; needs argon2-cffi"""
+    
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_ARGON2_TIME_COST
+    
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_ARGON2_MEMORY_COST
+    
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_ARGON2_PARALLELISM
@@ -0,0 +1,123 @@
+import os
+import threading
+import time
+import uuid
+from importlib import import_module
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client
+
+from accounts.models import User
+
+PASSWORD = 'benchmark-password-1234'
+
+class Command(BaseCommand):
+    help = 'Measure password hashing and login throughput (logins/sec per core) with the current settings'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=2.0,
+            help='How long to verify passwords with each hasher (default: 2)',
+        )
+        parser.add_argument(
+            '--logins',
+            type=int,
+            default=100,
+            help='Logins through POST /api/auth/login/; 0 skips this part (default: 100)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Threads sending logins (default: CPU count)',
+        )
+    
+    def handle(self, *args, seconds=2.0, logins=100, concurrency=1, **options):
+        cores = os.cpu_count() or 1
+        self.stdout.write(
+            f'{cores} core(s), {settings.PASSWORD_HASHING_WORKERS} hashing thread(s) per process'
+        )
+        
+        # A verified password costs one hash, so this is the login ceiling per core
+        for hasher in get_hashers():
+            try:
+                encoded = hasher.encode(PASSWORD, hasher.salt())
+            except ValueError as e:
+                self.stdout.write(f'  {hasher.algorithm:<20} unavailable ({e})')
+                continue
+            count, start = 0, time.perf_counter()
+            while time.perf_counter() - start < seconds:
+                hasher.verify(PASSWORD, encoded)
+                count += 1
+            rate = count / (time.perf_counter() - start)
+            self.stdout.write(f'  {hasher.algorithm:<20} {rate:8.1f} verifications/sec on one core')
+        
+        if logins > 0:
+            self._benchmark_logins(logins, concurrency, cores)
+    
+    def _benchmark_logins(self, logins, concurrency, cores):
+        # One user per thread, so logins do not all wait on one row
+        tag = uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(
+                username=f'benchmark-{tag}-{i}@example.invalid',
+                email=f'benchmark-{tag}-{i}@example.invalid',
+                password=PASSWORD,
+                user_type='client',
+                is_email_verified=True
+            )
+            for i in range(concurrency)
+        ]
+        # Any name ALLOWED_HOSTS accepts ('*' and '.example.com' patterns included)
+        host = next((name.lstrip('.') for name in settings.ALLOWED_HOSTS if name != '*'), 'localhost')
+        session_keys, failures = [], []
+        lock = threading.Lock()
+        
+        def send(user, count):
+            client = Client(SERVER_NAME=host)
+            try:
+                for _ in range(count):
+                    response = client.post(
+                        '/api/auth/login/',
+                        {'email': user.email, 'password': PASSWORD, 'user_type': 'client'},
+                        content_type='application/json'
+                    )
+                    with lock:
+                        if response.status_code != 200:
+                            failures.append(response.status_code)
+                        if settings.SESSION_COOKIE_NAME in client.cookies:
+                            session_keys.append(client.cookies[settings.SESSION_COOKIE_NAME].value)
+                    client.cookies.clear()
+            finally:
+                connections.close_all()
+        
+        shares = [logins // concurrency + (i < logins % concurrency) for i in range(concurrency)]
+        threads = [threading.Thread(target=send, args=(user, share)) for user, share in zip(users, shares)]
+        start = time.perf_counter()
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+        finally:
+            store = import_module(settings.SESSION_ENGINE).SessionStore
+            for key in session_keys:
+                store(session_key=key).delete()
+            User.objects.filter(pk__in=[user.pk for user in users]).delete()
+        
+        rate = logins / elapsed
+        used = min(cores, concurrency, settings.PASSWORD_HASHING_WORKERS)
+        self.stdout.write(self.style.SUCCESS(
+            f'{logins} login(s) over {concurrency} thread(s) in {elapsed:.2f}s: '
+            f'{rate:.1f} logins/sec, {rate / used:.1f} per core'
+        ))
+        if failures:
+            self.stdout.write(self.style.WARNING(
+                f'{len(failures)} login(s) failed: ' + ', '.join(sorted({str(code) for code in failures}))
+            ))
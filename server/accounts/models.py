@@ -1,7 +1,10 @@
+from django.contrib.auth.hashers import check_password, make_password
 from django.contrib.auth.models import AbstractUser
 from django.db import models
 import uuid
 
+from .hashers import HashingBusy
+
 class User(AbstractUser):
     USER_TYPE_CHOICES = [
         ('operations', 'Operations User'),
@@ -22,5 +25,20 @@ class User(AbstractUser):
     def __str__(self):
         return f"{self.email} ({self.user_type})"
     
+    def check_password(self, raw_password):
+        """
+        Verify `raw_password`, upgrading an outdated hash. The upgrade is best
+        effort: when the hashing pool is full it is left to the next login.
+        """
+        def setter(raw_password):
+            try:
+                self.password = make_password(raw_password)
+            except HashingBusy:
+                return
+            self._password = None
+            self.save(update_fields=['password'])
+        
+        return check_password(raw_password, self.password, setter)
+    
     class Meta:
         db_table = 'users'
\ No newline at end of file
@@ -0,0 +1,45 @@
+"""
+cached_db sessions kept in the `auth` cache.
+
+Django's cached_db engine caches a session for its whole expiry age, so with
+a per-process cache a logout on one worker would leave the session valid on
+the others for weeks. Here cache entries live no longer than the auth
+cache's TIMEOUT, the same bound user snapshots and tokens have.
+"""
+from django.conf import settings
+from django.contrib.sessions.backends import cached_db
+from django.core.cache import caches
+
+class SessionStore(cached_db.SessionStore):
+    cache_key_prefix = 'accounts.sessions'
+    
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self._cache = caches[settings.AUTH_CACHE_ALIAS]
+    
+    def _cache_timeout(self, expiry=None):
+        age = self.get_expiry_age(expiry=expiry)
+        if self._cache.default_timeout is None:
+            return age
+        return min(age, self._cache.default_timeout)
+    
+    def load(self):
+        try:
+            data = self._cache.get(self.cache_key)
+        except Exception:
+            # Invalid cache keys raise on some backends; see cached_db
+            data = None
+        
+        if data is None:
+            s = self._get_session_from_db()
+            if s:
+                data = self.decode(s.session_data)
+                self._cache.set(self.cache_key, data, self._cache_timeout(expiry=s.expire_date))
+            else:
+                data = {}
+        return data
+    
+    def save(self, must_create=False):
+        # DBStore.save, skipping cached_db's cache write with the full expiry age
+        super(cached_db.SessionStore, self).save(must_create)
+        self._cache.set(self.cache_key, self._session, self._cache_timeout())
@@ -0,0 +1,25 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .authentication import get_auth_cache
+from .models import User
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def _user_changed(sender, instance, update_fields=None, **kwargs):
+    # Password changes, deactivation, role changes and deletes; dropped after
+    # commit so a concurrent request cannot re-cache the old row. Saves through
+    # queryset.update() send no signal and wait out AUTH_CACHE_TIMEOUT.
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        # Sent on every login and not part of the snapshot
+        return
+    user_id = instance.pk
+    transaction.on_commit(lambda: get_auth_cache().forget_user(user_id))
+
+@receiver(post_delete, sender=Token)
+def _token_deleted(sender, instance, **kwargs):
+    # Logout deletes the token
+    key = instance.key
+    transaction.on_commit(lambda: get_auth_cache().forget_token(key))
@@ -0,0 +1,39 @@
+from celery import shared_task
+from django.conf import settings
+from django.core.mail import get_connection
+
+from .email_queue import deserialize_message
+
+_connection = None
+
+def _get_connection():
+    """One SMTP connection per worker process, reused across tasks"""
+    global _connection
+    if _connection is None:
+        _connection = get_connection(fail_silently=False)
+        _connection.open()
+    return _connection
+
+def _drop_connection():
+    global _connection
+    if _connection is not None:
+        try:
+            _connection.close()
+        except Exception:
+            pass
+        _connection = None
+
+@shared_task(
+    autoretry_for=(Exception,),
+    retry_backoff=settings.EMAIL_QUEUE_RETRY_BACKOFF,
+    retry_jitter=True,
+    max_retries=settings.EMAIL_QUEUE_MAX_RETRIES,
+)
+def send_email(data):
+    """Send a serialized email over the worker's pooled SMTP connection"""
+    try:
+        deserialize_message(data, connection=_get_connection()).send(fail_silently=False)
+    except Exception:
+        # The connection may be broken; the retry opens a fresh one
+        _drop_connection()
+        raise
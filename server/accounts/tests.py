@@ -0,0 +1,224 @@
+import email
+import re
+import socketserver
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.mail import EmailMultiAlternatives
+from django.test import Client, TestCase, override_settings
+from rest_framework.test import APIClient
+
+from .email_queue import enqueue_email, get_email_queue
+from .hashers import HashingBusy, HashingPool
+from .models import User
+from .utils import decrypt_verification_token, send_verification_email
+
+class FakeSMTPHandler(socketserver.StreamRequestHandler):
+    """Just enough SMTP for smtplib: accepts every message, or refuses the server's `failures` next ones"""
+    
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+        self.reply('220 localhost fake SMTP')
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode().strip()
+            verb = command.upper()
+            if verb.startswith(('EHLO', 'HELO')):
+                self.reply('250 localhost')
+            elif verb.startswith('MAIL FROM'):
+                recipients = []
+                self.reply('250 OK')
+            elif verb.startswith('RCPT TO'):
+                recipients.append(command.split(':', 1)[1].strip().strip('<>'))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                for line in iter(self.rfile.readline, b''):
+                    if line.rstrip(b'\r\n') == b'.':
+                        break
+                    data.append(line[1:] if line.startswith(b'..') else line)
+                with server.lock:
+                    refused = server.failures > 0
+                    if refused:
+                        server.failures -= 1
+                    else:
+                        server.messages.append((recipients, email.message_from_bytes(b''.join(data))))
+                self.reply('451 Try again later' if refused else '250 Queued')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('250 OK')
+    
+    def reply(self, text):
+        self.wfile.write(text.encode() + b'\r\n')
+
+class FakeSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeSMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.failures = 0
+        self.messages = []
+
+class VerificationEmailTests(TestCase):
+    """Registration queues its email; the thread-pool queue delivers it to a local SMTP server"""
+    
+    def setUp(self):
+        self.smtp = FakeSMTPServer()
+        threading.Thread(target=self.smtp.serve_forever, daemon=True).start()
+        self.addCleanup(self.smtp.server_close)
+        self.addCleanup(self.smtp.shutdown)
+        # A fresh queue per test, sending through the fake server
+        overrides = override_settings(
+            EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+            EMAIL_HOST='127.0.0.1',
+            EMAIL_PORT=self.smtp.server_address[1],
+            EMAIL_USE_TLS=False,
+            EMAIL_HOST_USER='',
+            EMAIL_HOST_PASSWORD='',
+            EMAIL_QUEUE_BACKEND='accounts.email_queue.ThreadPoolEmailQueue',
+            EMAIL_QUEUE_WORKERS=1,
+            EMAIL_QUEUE_RETRY_BACKOFF=0,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.queue = get_email_queue()
+    
+    def message(self, to):
+        return EmailMultiAlternatives('Subject', 'Body', 'noreply@example.com', [to])
+    
+    def test_registration_sends_the_verification_email(self):
+        response = APIClient().post('/api/auth/register/', {
+            'email': 'new@example.com',
+            'password': 'a-long-password-1234',
+            'password_confirm': 'a-long-password-1234',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(self.queue.join(timeout=10))
+        
+        [(recipients, message)] = self.smtp.messages
+        self.assertEqual(recipients, ['new@example.com'])
+        plain = next(part for part in message.walk() if part.get_content_type() == 'text/plain')
+        token = re.search(r'/verify/([\w=-]+)', plain.get_payload(decode=True).decode()).group(1)
+        user = User.objects.get(email='new@example.com')
+        self.assertEqual(decrypt_verification_token(token), user.email_verification_token)
+    
+    def test_repeat_sends_are_deduplicated(self):
+        user = User.objects.create_user(username='dupe@example.com', email='dupe@example.com', password=None)
+        self.assertTrue(send_verification_email(user, 'token-1'))
+        self.assertFalse(send_verification_email(user, 'token-1'))
+        self.assertTrue(self.queue.join(timeout=10))
+        self.assertEqual(len(self.smtp.messages), 1)
+    
+    def test_queued_messages_share_one_connection(self):
+        # Queue everything before the worker starts, so it all lands in one batch
+        with mock.patch.object(self.queue, '_ensure_workers'):
+            for i in range(5):
+                enqueue_email(self.message(f'user{i}@example.com'))
+        self.queue._ensure_workers()
+        self.assertTrue(self.queue.join(timeout=10))
+        self.assertEqual(len(self.smtp.messages), 5)
+        self.assertEqual(self.smtp.connections, 1)
+    
+    def test_refused_message_is_retried(self):
+        self.smtp.failures = 2
+        with self.assertLogs('accounts.email_queue', 'WARNING') as logs:
+            enqueue_email(self.message('retry@example.com'))
+            self.assertTrue(self.queue.join(timeout=10))
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual([recipients for recipients, _ in self.smtp.messages], [['retry@example.com']])
+        self.assertEqual(self.smtp.connections, 3)
+
+class AuthCacheTests(TestCase):
+    """A per-worker auth cache forgets what other workers revoked within AUTH_CACHE_TIMEOUT"""
+    
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = User.objects.create_user(
+            username='cached@example.com', email='cached@example.com', password='pass-12345', is_email_verified=True
+        )
+    
+    def test_session_ended_by_another_worker_expires_here(self):
+        client = Client()
+        client.force_login(self.user)
+        self.assertEqual(client.get('/api/auth/profile/').status_code, 200)
+        
+        # Another worker logs out: the row is gone, this worker's cached copy is not
+        Session.objects.all().delete()
+        self.assertEqual(client.get('/api/auth/profile/').status_code, 200)
+        
+        later = time.time() + settings.CACHES['auth']['TIMEOUT'] + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(client.get('/api/auth/profile/').status_code, 403)
+
+class HashingBusyTests(TestCase):
+    """A full hashing pool sheds registrations and logins with 503 instead of failing them"""
+    
+    def test_registration_is_retried_later(self):
+        with mock.patch.object(HashingPool, 'run', side_effect=HashingBusy):
+            response = APIClient().post('/api/auth/register/', {
+                'email': 'busy@example.com',
+                'password': 'a-long-password-1234',
+                'password_confirm': 'a-long-password-1234',
+            }, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+        self.assertFalse(User.objects.filter(email='busy@example.com').exists())
+    
+    def test_login_is_retried_later(self):
+        User.objects.create_user(
+            username='busy@example.com', email='busy@example.com', password='pass-12345', is_email_verified=True
+        )
+        with mock.patch.object(HashingPool, 'run', side_effect=HashingBusy):
+            response = APIClient().post('/api/auth/login/', {
+                'email': 'busy@example.com', 'password': 'pass-12345', 'user_type': 'client'
+            }, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+    
+    def test_login_succeeds_when_only_the_rehash_is_shed(self):
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=1000):
+            user = User.objects.create_user(
+                username='busy@example.com', email='busy@example.com', password='pass-12345', is_email_verified=True
+            )
+        outdated = user.password
+        
+        verifying = []
+        
+        def verify_then_busy(fn, *args, **kwargs):
+            # PBKDF2's verify() calls encode(); only a top-level encode is the rehash
+            if fn.__name__ == 'encode' and not verifying:
+                raise HashingBusy
+            verifying.append(fn)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                verifying.pop()
+        
+        with override_settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            with mock.patch.object(HashingPool, 'run', side_effect=verify_then_busy):
+                response = APIClient().post('/api/auth/login/', {
+                    'email': 'busy@example.com', 'password': 'pass-12345', 'user_type': 'client'
+                }, format='json')
+            self.assertEqual(response.status_code, 200)
+            user.refresh_from_db()
+            self.assertEqual(user.password, outdated)
+            
+            # Upgraded once the pool has room
+            self.assertTrue(user.check_password('pass-12345'))
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith('pbkdf2_sha256$2000$'))
@@ -1,10 +1,10 @@
 import secrets
-import base64
-from cryptography.fernet import Fernet
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMultiAlternatives
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
+from secure_file_sharing import crypto
+from .email_queue import enqueue_email
 
 def generate_verification_token(user):
     """Generate a secure verification token"""
@@ -13,15 +13,8 @@ def generate_verification_token(user):
 def generate_encrypted_url(token):
     """Generate encrypted URL for email verification"""
     try:
-        # Create Fernet instance with the encryption key
-        key = base64.urlsafe_b64encode(settings.ENCRYPTION_KEY.encode()[:32].ljust(32, b'0'))
-        fernet = Fernet(key)
-        
-        # Encrypt the token
-        encrypted_token = fernet.encrypt(token.encode())
-        
-        # Encode to base64 for URL safety
-        url_safe_token = base64.urlsafe_b64encode(encrypted_token).decode()
+        # Encrypt the token (already URL-safe)
+        url_safe_token = crypto.encrypt(token.encode())
         
         # Generate the full URL
         base_url = getattr(settings, 'FRONTEND_URL', 'http://localhost:5173')
@@ -35,15 +28,8 @@ def generate_encrypted_url(token):
 def decrypt_verification_token(encrypted_token):
     """Decrypt verification token from URL"""
     try:
-        # Create Fernet instance with the encryption key
-        key = base64.urlsafe_b64encode(settings.ENCRYPTION_KEY.encode()[:32].ljust(32, b'0'))
-        fernet = Fernet(key)
-        
-        # Decode from base64
-        encrypted_data = base64.urlsafe_b64decode(encrypted_token.encode())
-        
         # Decrypt the token
-        decrypted_token = fernet.decrypt(encrypted_data).decode()
+        decrypted_token = crypto.decrypt(encrypted_token).decode()
         
         return decrypted_token
     except Exception as e:
@@ -51,7 +37,7 @@ def decrypt_verification_token(encrypted_token):
         return None
 
 def send_verification_email(user, token):
-    """Send verification email to user"""
+    """Queue the verification email for background delivery"""
     try:
         encrypted_url = generate_encrypted_url(token)
         
@@ -93,16 +79,17 @@ def send_verification_email(user, token):
         SecureShare Team
         """
         
-        send_mail(
+        message = EmailMultiAlternatives(
             subject,
             plain_message,
             settings.DEFAULT_FROM_EMAIL,
             [user.email],
-            html_message=html_message,
-            fail_silently=False,
         )
+        message.attach_alternative(html_message, 'text/html')
         
-        return True
+        # Hand off to the email queue so SMTP latency stays out of the request;
+        # repeat sends of the same token are deduplicated
+        return enqueue_email(message, dedupe_key=f"verification:{user.pk}:{token}")
     except Exception as e:
         print(f"Email sending error: {e}")
-        return False
\ No newline at end of file
+        return False
@@ -3,8 +3,9 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
-from django.contrib.auth import login
+from django.contrib.auth import login, logout
 from django.shortcuts import get_object_or_404
+from .hashers import HashingBusy
 from .models import User
 from .serializers import UserRegistrationSerializer, UserLoginSerializer, UserSerializer
 from .utils import generate_encrypted_url, decrypt_verification_token
@@ -17,7 +18,14 @@ def register(request):
     """
     serializer = UserRegistrationSerializer(data=request.data)
     if serializer.is_valid():
-        user = serializer.save()
+        try:
+            user = serializer.save()
+        except HashingBusy:
+            # Hashing the new password found the pool full, as login_user can
+            return Response({
+                'success': False,
+                'message': 'Too many registrations in progress. Please retry shortly.'
+            }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
         
         # Generate encrypted URL for verification
         encrypted_url = generate_encrypted_url(user.email_verification_token)
@@ -41,7 +49,15 @@ def login_user(request):
     Login user (both operations and client)
     """
     serializer = UserLoginSerializer(data=request.data)
-    if serializer.is_valid():
+    try:
+        valid = serializer.is_valid()
+    except HashingBusy:
+        # Every hashing thread is busy and the queue is full; shed load early
+        return Response({
+            'success': False,
+            'message': 'Too many logins in progress. Please retry shortly.'
+        }, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+    if valid:
         user = serializer.validated_data['user']
         
         # Create or get token
@@ -91,7 +107,7 @@ def verify_email(request, token):
             'success': True,
             'message': 'Email verified successfully. You can now login.'
         }, status=status.HTTP_200_OK)
-        
+    
     except Exception as e:
         return Response({
             'success': False,
@@ -101,10 +117,11 @@ def verify_email(request, token):
 @api_view(['POST'])
 def logout_user(request):
     """
-    Logout user and delete token
+    Logout user, delete token and end the session
     """
     try:
         request.user.auth_token.delete()
+        logout(request)
         return Response({
             'success': True,
             'message': 'Logout successful.'
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import UploadedFile, DownloadLink
+from .models import UploadedFile, DownloadBatch, DownloadLink, FileBlob, DocumentMetadata
 
 @admin.register(UploadedFile)
 class UploadedFileAdmin(admin.ModelAdmin):
@@ -21,4 +21,32 @@ class DownloadLinkAdmin(admin.ModelAdmin):
     ordering = ('-created_at',)
     
     def get_queryset(self, request):
-        return super().get_queryset(request).select_related('file', 'user')
\ No newline at end of file
+        return super().get_queryset(request).select_related('file__uploaded_by', 'user')
+
+@admin.register(DownloadBatch)
+class DownloadBatchAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'created_at', 'expires_at', 'is_used', 'used_at')
+    list_filter = ('created_at', 'expires_at', 'is_used')
+    search_fields = ('user__email',)
+    readonly_fields = ('id', 'created_at')
+    ordering = ('-created_at',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user')
+
+@admin.register(FileBlob)
+class FileBlobAdmin(admin.ModelAdmin):
+    list_display = ('sha256', 'size', 'encoding', 'ref_count', 'created_at')
+    search_fields = ('sha256',)
+    readonly_fields = ('sha256', 'file', 'size', 'encoding', 'ref_count', 'created_at')
+    ordering = ('-created_at',)
+
+@admin.register(DocumentMetadata)
+class DocumentMetadataAdmin(admin.ModelAdmin):
+    list_display = ('upload', 'title', 'author', 'page_count', 'status', 'indexed_at')
+    list_filter = ('status',)
+    readonly_fields = ('upload', 'title', 'author', 'page_count', 'status', 'error', 'indexed_at')
+    ordering = ('-indexed_at',)
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('upload__uploaded_by')
@@ -1,5 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.db.models.signals import post_migrate
 
 class FilesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'files'
\ No newline at end of file
+    name = 'files'
+    
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .search import install_search_index
+        
+        # The full-text index is a raw table outside the model layer
+        post_migrate.connect(install_search_index, sender=self)
+        
+        if settings.DOWNLOAD_LINK_MODE == 'stateless':
+            from .nonces import get_nonce_store
+            
+            # Refuse to start with a nonce store the other workers can't see
+            get_nonce_store()
@@ -0,0 +1,88 @@
+import io
+import os
+import zipfile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .delivery import AccountedStream
+from .storage import iter_content
+
+class _ZipSink(io.RawIOBase):
+    """
+    Write-only, unseekable buffer for zipfile.
+    
+    zipfile falls back to data descriptors on unseekable output, so the archive
+    can be emitted front to back; the buffer is drained after every write and
+    never holds more than one chunk.
+    """
+    
+    def __init__(self):
+        self._buffer = bytearray()
+    
+    def writable(self):
+        return True
+    
+    def write(self, data):
+        self._buffer += data
+        return len(data)
+    
+    def drain(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+def _unique_name(name, taken):
+    stem, ext = os.path.splitext(name)
+    candidate, n = name, 1
+    while candidate in taken:
+        n += 1
+        candidate = f'{stem} ({n}){ext}'
+    taken.add(candidate)
+    return candidate
+
+def iter_zip(files, chunk_size):
+    """
+    Yield a ZIP archive of `files` with constant memory. Entries are stored
+    uncompressed: PPTX/DOCX/XLSX are already ZIP containers.
+    """
+    sink = _ZipSink()
+    taken = set()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for file_obj in files:
+            info = zipfile.ZipInfo(
+                _unique_name(file_obj.name, taken),
+                date_time=timezone.localtime(file_obj.uploaded_at).timetuple()[:6]
+            )
+            info.file_size = file_obj.file_size
+            with archive.open(info, 'w') as dest:
+                for chunk in iter_content(
+                    file_obj.file, file_obj.content_encoding, 0, file_obj.file_size, chunk_size, file_obj.content_cipher
+                ):
+                    dest.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    # Central directory
+    yield sink.drain()
+
+def zip_response(files, on_close):
+    """
+    Stream `files` as a ZIP attachment; see iter_zip. `on_close(complete)`
+    runs once the response is closed, with whether the whole archive was sent.
+    """
+    complete = False
+    
+    def stream():
+        nonlocal complete
+        for chunk in iter_zip(files, settings.FILE_DOWNLOAD_CHUNK_SIZE):
+            if chunk:
+                yield chunk
+        complete = True
+    
+    body = AccountedStream(stream(), lambda: on_close(complete))
+    response = StreamingHttpResponse(body, content_type='application/zip')
+    filename = f"files-{timezone.localtime().strftime('%Y%m%d-%H%M%S')}.zip"
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
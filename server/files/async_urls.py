@@ -0,0 +1,9 @@
+from django.urls import path
+from . import async_views
+
+urlpatterns = [
+    path('list/', async_views.list_files, name='async_list_files'),
+    path('download/<uuid:file_id>/', async_views.generate_download_link, name='async_generate_download_link'),
+    path('secure-download/<str:token>/', async_views.secure_download, name='async_secure_download'),
+    path('detail/<uuid:file_id>/', async_views.file_detail, name='async_file_detail'),
+]
@@ -0,0 +1,231 @@
+"""
+Async variants of the read and download endpoints, for ASGI deployments.
+
+They mirror the responses of the sync views in files.views but use the async
+ORM and stream file bodies from worker threads, so a slow client or disk read
+does not pin a thread for the whole request.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse
+from django.utils import timezone
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .audit import get_audit_writer
+from .cache import get_file_cache
+from .delivery import get_delivery_backend
+from .filters import filter_files
+from .models import UploadedFile, DownloadLink
+from .nonces import StatelessDownloadLink
+from .pagination import FileCursorPagination
+from .serializers import UploadedFileSerializer, DownloadLinkSerializer
+from .utils import (
+    generate_secure_download_token, generate_stateless_download_token, decode_download_token,
+    collection_etag, conditional_response, set_validators
+)
+
+def _authenticate(request):
+    """
+    Run the configured DRF authenticators (session + token) against a plain
+    request; SessionAuthentication rejects a session without a valid CSRF token.
+    """
+    drf_request = Request(
+        request,
+        # The CSRF check reads POST data, so the body must be parseable as in an APIView
+        parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    user = drf_request.user
+    return user if user.is_authenticated else None
+
+def _error(message, status_code):
+    return JsonResponse({'success': False, 'message': message}, status=status_code)
+
+def async_api_view(http_method_names):
+    """
+    Async counterpart of @api_view + @permission_classes([IsAuthenticated]).
+    
+    Django's require_http_methods and csrf_exempt only wrap sync views before
+    5.0, so both are done here. Like @api_view the view is CSRF exempt:
+    SessionAuthentication enforces CSRF itself for session-authenticated
+    requests, and token-authenticated ones don't need it.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in http_method_names:
+                return HttpResponseNotAllowed(http_method_names)
+            try:
+                user = await sync_to_async(_authenticate)(request)
+            except exceptions.APIException as exc:
+                return _error(str(exc.detail), exc.status_code)
+            if user is None:
+                return _error('Authentication credentials were not provided.', status.HTTP_401_UNAUTHORIZED)
+            request.user = user
+            return await view(request, *args, **kwargs)
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+@async_api_view(['GET'])
+async def list_files(request):
+    """
+    List uploaded files - Available to all authenticated users
+    """
+    fields = [f for f in request.GET.get('fields', '').split(',') if f]
+    unknown = set(fields) - set(UploadedFileSerializer.Meta.fields)
+    if unknown:
+        return _error(f"Unknown fields: {', '.join(sorted(unknown))}.", status.HTTP_400_BAD_REQUEST)
+    
+    version, last_modified = await get_file_cache().acollection_version()
+    etag = collection_etag(version, request)
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    
+    async def build():
+        paginator = FileCursorPagination()
+        files = filter_files(UploadedFile.objects.active().for_listing(), request.GET)
+        page = await paginator.apaginate_queryset(files, request)
+        return {
+            'success': True,
+            'files': UploadedFileSerializer(page, many=True, fields=fields).data,
+            'page_count': len(page),
+            'next_cursor': paginator.get_next_cursor(),
+            'next': paginator.get_next_link()
+        }
+    
+    try:
+        payload, hit = await get_file_cache().aget_or_build('list', request, build, revision=version)
+    except exceptions.ValidationError as exc:
+        return JsonResponse({'success': False, 'errors': exc.detail}, status=status.HTTP_400_BAD_REQUEST)
+    
+    response = JsonResponse(payload, status=status.HTTP_200_OK)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    response['Cache-Control'] = 'private, no-cache'
+    return set_validators(response, etag, last_modified)
+
+@async_api_view(['GET'])
+async def file_detail(request, file_id):
+    """
+    Get file details
+    """
+    updated_at = await UploadedFile.objects.filter(id=file_id, is_active=True).values_list(
+        'updated_at', flat=True
+    ).afirst()
+    if updated_at is None:
+        return _error('Not found.', status.HTTP_404_NOT_FOUND)
+    
+    etag = collection_etag(updated_at.timestamp(), request)
+    not_modified = conditional_response(request, etag, updated_at)
+    if not_modified is not None:
+        return not_modified
+    
+    async def build():
+        file_obj = await UploadedFile.objects.for_listing().aget(id=file_id, is_active=True)
+        return {
+            'success': True,
+            'file': UploadedFileSerializer(file_obj).data
+        }
+    
+    try:
+        payload, hit = await get_file_cache().aget_or_build('detail', request, build, revision=updated_at.timestamp())
+    except UploadedFile.DoesNotExist:
+        return _error('Not found.', status.HTTP_404_NOT_FOUND)
+    
+    response = JsonResponse(payload, status=status.HTTP_200_OK)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    response['Cache-Control'] = 'private, no-cache'
+    return set_validators(response, etag, updated_at)
+
+@async_api_view(['POST'])
+async def generate_download_link(request, file_id):
+    """
+    Generate secure download link - Only for client users
+    """
+    if request.user.user_type != 'client':
+        return _error('Only client users can download files.', status.HTTP_403_FORBIDDEN)
+    
+    try:
+        file_obj = await UploadedFile.objects.aget(id=file_id, is_active=True)
+    except UploadedFile.DoesNotExist:
+        return _error('Not found.', status.HTTP_404_NOT_FOUND)
+    
+    expires_at = timezone.now() + timedelta(hours=settings.DOWNLOAD_LINK_TTL_HOURS)
+    
+    if settings.DOWNLOAD_LINK_MODE == 'stateless':
+        encrypted_token = generate_stateless_download_token(file_obj, request.user, expires_at)
+        download_link = DownloadLink(
+            file=file_obj,
+            user=request.user,
+            encrypted_token=encrypted_token,
+            token_key=DownloadLink.lookup_key(encrypted_token),
+            expires_at=expires_at
+        )
+        get_audit_writer().record_issued(download_link)
+    else:
+        encrypted_token = generate_secure_download_token(file_obj, request.user)
+        download_link = await DownloadLink.objects.acreate(
+            file=file_obj,
+            user=request.user,
+            encrypted_token=encrypted_token,
+            token_key=DownloadLink.lookup_key(encrypted_token),
+            expires_at=expires_at
+        )
+    
+    serializer = DownloadLinkSerializer(download_link, context={'request': request})
+    
+    return JsonResponse({
+        'success': True,
+        'message': 'Download link generated successfully.',
+        'download_link': serializer.data['download_link']
+    }, status=status.HTTP_200_OK)
+
+@async_api_view(['GET'])
+async def secure_download(request, token):
+    """
+    Secure file download using encrypted token - Only accessible by client users
+    """
+    if request.user.user_type != 'client':
+        return _error('Access denied. Only client users can access download links.', status.HTTP_403_FORBIDDEN)
+    
+    try:
+        token_data = decode_download_token(token)
+        file_id, user_id = token_data['file_id'], token_data['user_id']
+        
+        if str(request.user.id) != user_id:
+            return _error('Access denied. Invalid user for this download link.', status.HTTP_403_FORBIDDEN)
+        
+        if 'nonce' in token_data:
+            # Stateless token: no DownloadLink lookup on the hot path
+            download_link = StatelessDownloadLink(
+                token,
+                file=await UploadedFile.objects.select_related('blob').aget(id=file_id, is_active=True),
+                expires_at=datetime.fromtimestamp(token_data['exp'], tz=dt_timezone.utc),
+                nonce=token_data['nonce']
+            )
+        else:
+            download_link = await DownloadLink.objects.select_related('file', 'file__blob').aget_by_token(
+                token,
+                user=request.user,
+                file__id=file_id
+            )
+        
+        if timezone.now() > download_link.expires_at:
+            return _error('Download link has expired.', status.HTTP_410_GONE)
+        
+        if await sync_to_async(lambda: download_link.is_used)():
+            return _error('Download link has already been used.', status.HTTP_410_GONE)
+        
+        # The backend may touch the database (proxy hand-off accounting), so it
+        # runs in a thread; the streamed body itself is an async iterator
+        return await sync_to_async(get_delivery_backend().serve)(
+            request, download_link, download_link.file, asynchronous=True
+        )
+    except Exception:
+        return _error('Invalid or expired download token.', status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,99 @@
+import atexit
+import logging
+import queue
+import threading
+from collections import defaultdict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+class DownloadAuditWriter:
+    """
+    Write DownloadLink audit rows for stateless links off the request path.
+    
+    Issued links and consumptions are queued and flushed by a background
+    thread in batches: one bulk_create for new rows and one UPDATE per
+    second of consumption times.
+    """
+    
+    def __init__(self, batch_size, flush_interval):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        atexit.register(self.flush)
+    
+    def record_issued(self, download_link):
+        self._put(('issued', download_link))
+    
+    def record_consumed(self, token_key):
+        # Whole seconds, so a burst of consumptions shares one UPDATE per second
+        self._put(('consumed', (token_key, timezone.now().replace(microsecond=0))))
+    
+    def _put(self, item):
+        self._queue.put(item)
+        self._ensure_thread()
+    
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='download-audit', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self.flush(initial=[first])
+            # The writer thread holds its own connection; don't keep it open between batches
+            connection.close()
+    
+    def flush(self, initial=None):
+        """Write everything queued so far; safe to call from any thread"""
+        items = list(initial or [])
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if not items:
+            return
+        
+        with self._flush_lock:
+            for start in range(0, len(items), self.batch_size):
+                self._write(items[start:start + self.batch_size])
+    
+    def _write(self, items):
+        from .models import DownloadLink
+        
+        issued = [link for kind, link in items if kind == 'issued']
+        consumed = [entry for kind, entry in items if kind == 'consumed']
+        try:
+            if issued:
+                DownloadLink.objects.bulk_create(issued, ignore_conflicts=True)
+            by_time = defaultdict(list)
+            for token_key, when in consumed:
+                by_time[when].append(token_key)
+            for when, token_keys in by_time.items():
+                DownloadLink.objects.filter(token_key__in=token_keys, is_used=False).update(
+                    is_used=True, used_at=when
+                )
+        except Exception:
+            logger.exception('Failed to write %d download audit record(s)', len(items))
+
+@lru_cache(maxsize=None)
+def get_audit_writer():
+    return DownloadAuditWriter(
+        batch_size=settings.DOWNLOAD_AUDIT_BATCH_SIZE,
+        flush_interval=settings.DOWNLOAD_AUDIT_FLUSH_SECONDS
+    )
@@ -0,0 +1,147 @@
+import hashlib
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+
+class FileCache:
+    """
+    Versioned cache for serialized file list pages and file details.
+    
+    Every key embeds a generation number; any change to an UploadedFile bumps
+    it (see files.signals), which orphans all cached payloads at once instead
+    of deleting them key by key. Entries are per user and per absolute URL,
+    since payloads carry absolute `next` links.
+    
+    With a shared cache the generation also versions list ETags, with the
+    time of the last bump as Last-Modified, so conditional list requests cost
+    no database query. A per-process cache only sees its own worker's bumps,
+    so there the version is read from the database instead
+    (UploadedFileQuerySet.collection_version) and every worker agrees.
+    
+    Hit/miss counters are kept per process.
+    """
+    version_key = 'files:version'
+    modified_key = 'files:modified'
+    
+    def __init__(self):
+        self.cache = caches[settings.FILE_CACHE_ALIAS]
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _initial_version():
+        # Seeded from the clock so a version key lost to eviction or a
+        # restart never comes back with a number that was already used
+        return time.time_ns() // 1000
+    
+    @property
+    def shared(self):
+        return not isinstance(self.cache, LocMemCache)
+    
+    def version(self):
+        return self._generation()[0]
+    
+    def collection_version(self):
+        """(version, last_modified) of the file collection, for list ETags"""
+        if not self.shared:
+            from .models import UploadedFile
+            return UploadedFile.objects.collection_version()
+        return self._generation()
+    
+    def _generation(self):
+        state = self.cache.get_many([self.version_key, self.modified_key])
+        if self.version_key not in state:
+            # A new generation may hide changes this process missed
+            if self.cache.add(self.version_key, self._initial_version()):
+                self.cache.set(self.modified_key, timezone.now())
+            state = self.cache.get_many([self.version_key, self.modified_key])
+        return state.get(self.version_key), state.get(self.modified_key)
+    
+    async def acollection_version(self):
+        if not self.shared:
+            from .models import UploadedFile
+            return await UploadedFile.objects.acollection_version()
+        return await self._ageneration()
+    
+    async def _ageneration(self):
+        state = await self.cache.aget_many([self.version_key, self.modified_key])
+        if self.version_key not in state:
+            if await self.cache.aadd(self.version_key, self._initial_version()):
+                await self.cache.aset(self.modified_key, timezone.now())
+            state = await self.cache.aget_many([self.version_key, self.modified_key])
+        return state.get(self.version_key), state.get(self.modified_key)
+    
+    def bump(self):
+        """Invalidate every cached list page and detail payload"""
+        try:
+            self.cache.incr(self.version_key)
+        except ValueError:
+            self.cache.set(self.version_key, self._initial_version())
+        self.cache.set(self.modified_key, timezone.now())
+    
+    def key(self, kind, request, version):
+        url = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()
+        return f'files:{kind}:{version}:{request.user.pk}:{url}'
+    
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+    
+    def get_or_build(self, kind, request, build, revision=''):
+        """
+        Return (payload, hit). `build` produces the payload on a miss; if it
+        raises, nothing is cached. `revision` (e.g. the ETag version) is folded
+        into the key so the payload always matches it, even when a per-process
+        cache missed an invalidation.
+        """
+        key = self.key(kind, request, f'{self.version()}:{revision}')
+        payload = self.cache.get(key)
+        self._count(payload is not None)
+        if payload is None:
+            payload = build()
+            self.cache.set(key, payload)
+            return payload, False
+        return payload, True
+    
+    async def aget_or_build(self, kind, request, build, revision=''):
+        """Async get_or_build; `build` is a coroutine function"""
+        version, _ = await self._ageneration()
+        key = self.key(kind, request, f'{version}:{revision}')
+        payload = await self.cache.aget(key)
+        self._count(payload is not None)
+        if payload is None:
+            payload = await build()
+            await self.cache.aset(key, payload)
+            return payload, False
+        return payload, True
+    
+    def stats(self):
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / total, 4) if total else None,
+        }
+
+@lru_cache(maxsize=None)
+def get_file_cache():
+    """Return the process-wide file cache"""
+    return FileCache()
+
+@receiver(setting_changed)
+def _reset_file_cache(setting, **kwargs):
+    if setting in ('FILE_CACHE_ALIAS', 'CACHES'):
+        get_file_cache.cache_clear()
@@ -0,0 +1,87 @@
+"""
+Codecs for storage-side compression of file content (see files.storage).
+
+gzip is always available; zstd needs the optional zstandard package. Like
+files.extraction this module needs no Django setup, so indexing workers can
+decompress the documents they fetch.
+"""
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Bytes from the start of a file compressed to judge whether the rest is worth it
+PROBE_SIZE = 64 * 1024
+
+class GzipCodec:
+    name = 'gzip'
+    level = 6
+    
+    def compressor(self):
+        return zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    
+    def decompressor(self):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+class ZstdCodec:
+    name = 'zstd'
+    level = 3
+    
+    def compressor(self):
+        return zstandard.ZstdCompressor(level=self.level).compressobj()
+    
+    def decompressor(self):
+        return zstandard.ZstdDecompressor().decompressobj()
+
+CODECS = {'gzip': GzipCodec()}
+if zstandard is not None:
+    CODECS['zstd'] = ZstdCodec()
+
+def get_codec(name):
+    """The codec called `name`; zstd falls back to gzip when zstandard is missing"""
+    if name == 'zstd' and 'zstd' not in CODECS:
+        name = 'gzip'
+    return CODECS.get(name)
+
+def worth_compressing(codec, sample, min_saving):
+    """Whether compressing `sample` (the start of the file) saves at least `min_saving` (0-1)"""
+    if not sample:
+        return False
+    compressor = codec.compressor()
+    compressed = len(compressor.compress(sample)) + len(compressor.flush())
+    return compressed <= len(sample) * (1 - min_saving)
+
+def compress_chunks(codec, chunks):
+    """Yield the compressed stream of `chunks`"""
+    compressor = codec.compressor()
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def decompress_chunks(encoding, chunks):
+    """Yield the content of a stream of compressed `chunks`"""
+    decompressor = CODECS[encoding].decompressor()
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    flush = getattr(decompressor, 'flush', None)
+    if flush is not None:
+        data = flush()
+        if data:
+            yield data
+
+def slice_chunks(chunks, start, length):
+    """Yield `length` bytes from offset `start` of a stream of chunks"""
+    position, end = 0, start + length
+    for chunk in chunks:
+        chunk_end = position + len(chunk)
+        if chunk_end > start:
+            yield chunk[max(start - position, 0):min(end - position, len(chunk))]
+        position = chunk_end
+        if position >= end:
+            return
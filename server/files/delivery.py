@@ -0,0 +1,443 @@
+import mimetypes
+import os
+import secrets
+from functools import lru_cache
+from urllib.parse import quote, unquote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse, Http404
+from django.utils.http import content_disposition_header, http_date
+from django.utils.module_loading import import_string
+from rest_framework import status
+
+from .storage import iter_content, iter_encoded
+from .utils import (
+    accepts_encoding, conditional_response, file_etag, if_range_matches, iter_file_range, parse_range_header
+)
+
+class ThreadedStream:
+    """
+    Async iterator that drives a blocking one (disk reads, byte accounting)
+    from the request's sync thread, so the body never blocks the event loop
+    and database connections it opens are closed with the request's own.
+
+    close() is passed through for StreamingHttpResponse to call (Django runs
+    it in that same thread), also when the body was never read.
+    """
+
+    def __init__(self, iterator):
+        self._iterator = iterator
+        self._next = sync_to_async(next, thread_sensitive=True)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await self._next(self._iterator, None)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        self._iterator.close()
+
+class AccountedStream:
+    """
+    Iterator over `chunks` that calls `on_close` once, when iteration ends or
+    the response is closed - also when it is closed before the body was read,
+    which would skip the `finally` of a generator that never started.
+    """
+
+    def __init__(self, chunks, on_close):
+        self._chunks = chunks
+        self._on_close = on_close
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+
+    def close(self):
+        on_close, self._on_close = self._on_close, None
+        if on_close is not None:
+            try:
+                self._chunks.close()
+            finally:
+                on_close()
+
+class DeliveryBackend:
+    """
+    Base class for secure download delivery.
+
+    The view validates the token and the DownloadLink; the backend decides how
+    the bytes reach the client. Range handling and link accounting are shared
+    so every backend resumes and consumes links the same way.
+
+    Compressed content (FileBlob.encoding) is sent compressed, with
+    Content-Encoding, to clients that accept it and ask for the whole file.
+    Other requests get it decompressed. Encrypted content (FileBlob.encryption)
+    is decrypted segment by segment. Only StreamingDelivery can decompress or
+    decrypt: the other backends hand such requests to it.
+
+    Links record the byte ranges they delivered and are consumed once those
+    cover the file. A request that would complete the coverage claims the
+    link first, so concurrent downloads cannot each get a full copy.
+    """
+    # Whether build_response can decompress and decrypt stored content
+    decodes_content = False
+
+    def serve(self, request, download_link, file_obj, asynchronous=False):
+        """
+        Build the download response. With `asynchronous=True` streamed bodies
+        are async iterators, for ASGI views.
+        """
+        try:
+            # One stat (or HEAD request) answers both existence and size
+            stored_size = file_obj.file.storage.size(file_obj.file.name)
+        except FileNotFoundError:
+            raise Http404("File not found")
+
+        # Ranges always address the decompressed content; the compressed
+        # representation is what is stored, less the encryption overhead
+        encoding, cipher = file_obj.content_encoding, file_obj.content_cipher
+        encoded_size = cipher.plaintext_size(stored_size) if cipher else stored_size
+        file_size = file_obj.file_size if encoding else encoded_size
+        send_encoded = (
+            encoding
+            and 'HTTP_RANGE' not in request.META
+            and accepts_encoding(request.META.get('HTTP_ACCEPT_ENCODING'), encoding)
+        )
+
+        # Blobs are stored without an extension, so prefer the recorded type
+        content_type = file_obj.file_type or mimetypes.guess_type(file_obj.name)[0]
+        if not content_type:
+            content_type = 'application/octet-stream'
+
+        etag = file_etag(file_obj, encoding if send_encoded else '')
+
+        # The client already holds these bytes; nothing is served or credited
+        not_modified = conditional_response(request, etag, file_obj.uploaded_at)
+        if not_modified is not None:
+            if encoding:
+                not_modified['Vary'] = 'Accept-Encoding'
+            return not_modified
+
+        # Honour Range only while the If-Range validator still matches
+        ranges = None
+        if if_range_matches(request.META.get('HTTP_IF_RANGE'), etag, file_obj.uploaded_at):
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), file_size)
+
+        if ranges == []:
+            response = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            response['Content-Range'] = f'bytes */{file_size}'
+            return response
+
+        if download_link.completes(ranges, file_size) and not download_link.claim():
+            return JsonResponse({
+                'success': False,
+                'message': 'Download link has already been used.'
+            }, status=status.HTTP_410_GONE)
+
+        if send_encoded:
+            response = self.build_encoded_response(
+                download_link, file_obj, file_size, encoded_size, content_type, asynchronous
+            )
+            response['Content-Encoding'] = encoding
+        else:
+            backend = self if self.decodes_content or not (encoding or cipher) else StreamingDelivery()
+            response = backend.build_response(
+                download_link, file_obj, file_size, ranges, content_type, asynchronous
+            )
+        if encoding:
+            response['Vary'] = 'Accept-Encoding'
+        response['Content-Disposition'] = content_disposition_header(True, file_obj.name)
+        response['Accept-Ranges'] = 'bytes'
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(file_obj.uploaded_at.timestamp())
+        return response
+
+    def build_response(self, download_link, file_obj, file_size, ranges, content_type, asynchronous=False):
+        raise NotImplementedError
+
+    def build_encoded_response(self, download_link, file_obj, file_size, encoded_size, content_type, asynchronous=False):
+        """
+        Stream the `encoded_size` compressed bytes (decrypted when encrypted).
+        A cut-short compressed stream maps to no content range, so only a
+        complete transfer is credited, as the whole file.
+        """
+        chunk_size = settings.FILE_DOWNLOAD_CHUNK_SIZE
+        cipher = file_obj.content_cipher
+
+        served = 0
+
+        def stream():
+            nonlocal served
+            for chunk in iter_encoded(file_obj.file, cipher, 0, encoded_size, chunk_size, encoded_size):
+                served += len(chunk)
+                yield chunk
+
+        def on_close():
+            download_link.record_served([(0, file_size - 1)] if served >= encoded_size else [], file_size)
+
+        body = AccountedStream(stream(), on_close)
+        if asynchronous:
+            body = ThreadedStream(body)
+        response = StreamingHttpResponse(body, content_type=content_type)
+        response['Content-Length'] = encoded_size
+        return response
+
+    def record_handoff(self, download_link, file_size, ranges):
+        """Credit the ranges a hand-off authorises, for backends that do not serve them"""
+        download_link.record_served(ranges or [(0, file_size - 1)], file_size)
+
+class StreamingDelivery(DeliveryBackend):
+    """Stream the file through the Python worker in fixed-size blocks"""
+    decodes_content = True
+
+    def build_response(self, download_link, file_obj, file_size, ranges, content_type, asynchronous=False):
+        chunk_size = settings.FILE_DOWNLOAD_CHUNK_SIZE
+
+        if not ranges:
+            parts = [(None, 0, file_size)]
+            response_status = status.HTTP_200_OK
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            parts = [(None, start, end - start + 1)]
+            response_status = status.HTTP_206_PARTIAL_CONTENT
+        else:
+            boundary = secrets.token_hex(16)
+            parts = []
+            for start, end in ranges:
+                header = (
+                    f'--{boundary}\r\n'
+                    f'Content-Type: {content_type}\r\n'
+                    f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+                ).encode()
+                parts.append((header, start, end - start + 1))
+            trailer = f'\r\n--{boundary}--\r\n'.encode()
+            response_status = status.HTTP_206_PARTIAL_CONTENT
+
+        # Delivered ranges are credited when the stream finishes, so
+        # interrupted transfers can be resumed
+        served = []
+
+        def stream():
+            encoding, cipher = file_obj.content_encoding, file_obj.content_cipher
+            # Without an encoding the content is the stored representation, whose size is known
+            size = None if encoding else file_size
+            for index, (header, start, length) in enumerate(parts):
+                if header:
+                    yield (b'\r\n' if index else b'') + header
+                served.append([start, start - 1])
+                for chunk in iter_content(file_obj.file, encoding, start, length, chunk_size, cipher, size):
+                    served[-1][1] += len(chunk)
+                    yield chunk
+            if len(parts) > 1:
+                yield trailer
+
+        body = AccountedStream(stream(), lambda: download_link.record_served(served, file_size))
+        if asynchronous:
+            body = ThreadedStream(body)
+
+        if len(parts) > 1:
+            content_length = sum(length + len(header) for header, _, length in parts)
+            content_length += 2 * (len(parts) - 1) + len(trailer)
+            response = StreamingHttpResponse(
+                body,
+                status=response_status,
+                content_type=f'multipart/byteranges; boundary={boundary}'
+            )
+        else:
+            _, start, length = parts[0]
+            content_length = length
+            response = StreamingHttpResponse(body, status=response_status, content_type=content_type)
+            if ranges:
+                response['Content-Range'] = f'bytes {start}-{start + length - 1}/{file_size}'
+
+        response['Content-Length'] = content_length
+        return response
+
+class ProxyDelivery(DeliveryBackend):
+    """
+    Hand the transfer to the front proxy through an internal redirect header.
+
+    The proxy serves the bytes (and any Range) itself, so the link is credited
+    with the bytes it was authorised to send at hand-off time.
+    """
+    header_name = None
+
+    def build_response(self, download_link, file_obj, file_size, ranges, content_type, asynchronous=False):
+        self.record_handoff(download_link, file_size, ranges)
+
+        response = HttpResponse(content_type=content_type)
+        response[self.header_name] = self.internal_location(file_obj)
+        return response
+
+    def internal_location(self, file_obj):
+        raise NotImplementedError
+
+class XAccelRedirectDelivery(ProxyDelivery):
+    """nginx: X-Accel-Redirect to an `internal` location mapped onto MEDIA_ROOT"""
+    header_name = 'X-Accel-Redirect'
+
+    def internal_location(self, file_obj):
+        return settings.FILE_DELIVERY_ACCEL_PREFIX + quote(file_obj.file.name)
+
+class XSendfileDelivery(ProxyDelivery):
+    """Apache mod_xsendfile / lighttpd: X-Sendfile with the absolute path"""
+    header_name = 'X-Sendfile'
+
+    def internal_location(self, file_obj):
+        # Local storage only; the path is resolved on this machine
+        return file_obj.file.path
+
+class RedirectDelivery(DeliveryBackend):
+    """
+    Redirect to a short-lived presigned URL so the object store serves the
+    bytes (and any Range) directly. Needs a storage with presigned_url(),
+    i.e. files.s3.S3Storage. Like the proxy backends, the link is credited
+    with the bytes it authorised at hand-off time.
+    """
+
+    def build_response(self, download_link, file_obj, file_size, ranges, content_type, asynchronous=False):
+        storage = file_obj.file.storage
+        if not hasattr(storage, 'presigned_url'):
+            raise ImproperlyConfigured('RedirectDelivery needs a storage with presigned URLs (files.s3.S3Storage).')
+        self.record_handoff(download_link, file_size, ranges)
+
+        response = HttpResponseRedirect(storage.presigned_url(file_obj.file.name, file_obj.name, content_type))
+        # The URL carries credentials; keep it out of shared caches
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+    def build_encoded_response(self, download_link, file_obj, file_size, encoded_size, content_type, asynchronous=False):
+        """The object store sends the compressed object with the Content-Encoding signed into the URL"""
+        if file_obj.content_cipher is not None:
+            # The bucket only holds the encrypted bytes
+            return super().build_encoded_response(
+                download_link, file_obj, file_size, encoded_size, content_type, asynchronous
+            )
+        storage = file_obj.file.storage
+        if not hasattr(storage, 'presigned_url'):
+            raise ImproperlyConfigured('RedirectDelivery needs a storage with presigned URLs (files.s3.S3Storage).')
+        self.record_handoff(download_link, file_size, None)
+
+        response = HttpResponseRedirect(storage.presigned_url(
+            file_obj.file.name, file_obj.name, content_type, content_encoding=file_obj.content_encoding
+        ))
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+@lru_cache(maxsize=None)
+def get_delivery_backend():
+    """Return the configured delivery backend instance"""
+    return import_string(settings.FILE_DELIVERY_BACKEND)()
+
+@receiver(setting_changed)
+def _reset_delivery_backend(setting, **kwargs):
+    if setting == 'FILE_DELIVERY_BACKEND':
+        get_delivery_backend.cache_clear()
+
+class ProxyEmulationMiddleware:
+    """
+    Local stand-in for the front proxy.
+
+    Resolves X-Accel-Redirect / X-Sendfile headers the way nginx or Apache
+    would, Range and If-Range included, so the proxy delivery backends can be
+    exercised with runserver or the test client. Never enable this in
+    production.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if 'X-Accel-Redirect' in response:
+            location = response['X-Accel-Redirect']
+            prefix = settings.FILE_DELIVERY_ACCEL_PREFIX
+            if not location.startswith(prefix):
+                return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+            name = location[len(prefix):]
+            path = os.path.join(settings.MEDIA_ROOT, unquote(name))
+        elif 'X-Sendfile' in response:
+            path = response['X-Sendfile']
+        else:
+            return response
+
+        media_root = os.path.realpath(settings.MEDIA_ROOT)
+        path = os.path.realpath(path)
+        if not path.startswith(media_root + os.sep) or not os.path.isfile(path):
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+
+        # Like nginx, If-Range must equal the ETag or Last-Modified exactly
+        ranges = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range.strip() in (response.get('ETag'), response.get('Last-Modified')):
+            ranges = parse_range_header(request.META.get('HTTP_RANGE'), os.path.getsize(path))
+
+        if ranges == []:
+            proxied = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+            proxied['Content-Range'] = f'bytes */{os.path.getsize(path)}'
+            return proxied
+        if ranges:
+            proxied = self.partial_response(path, ranges, response['Content-Type'])
+        else:
+            proxied = FileResponse(open(path, 'rb'), content_type=response['Content-Type'])
+            proxied.block_size = settings.FILE_DOWNLOAD_CHUNK_SIZE
+        for header in ('Content-Disposition', 'Accept-Ranges', 'ETag', 'Last-Modified'):
+            if header in response:
+                proxied[header] = response[header]
+        return proxied
+
+    @staticmethod
+    def partial_response(path, ranges, content_type):
+        """206 response with the inclusive (start, end) `ranges` of the file at `path`"""
+        size = os.path.getsize(path)
+        chunk_size = settings.FILE_DOWNLOAD_CHUNK_SIZE
+        boundary = secrets.token_hex(16)
+
+        def part_header(start, end):
+            return (
+                f'--{boundary}\r\n'
+                f'Content-Type: {content_type}\r\n'
+                f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+            ).encode()
+
+        trailer = f'\r\n--{boundary}--\r\n'.encode()
+
+        def stream():
+            with open(path, 'rb') as f:
+                for index, (start, end) in enumerate(ranges):
+                    if len(ranges) > 1:
+                        yield (b'\r\n' if index else b'') + part_header(start, end)
+                    yield from iter_file_range(f, start, end - start + 1, chunk_size)
+                if len(ranges) > 1:
+                    yield trailer
+
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(stream(), status=status.HTTP_206_PARTIAL_CONTENT, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = end - start + 1
+        else:
+            response = StreamingHttpResponse(
+                stream(),
+                status=status.HTTP_206_PARTIAL_CONTENT,
+                content_type=f'multipart/byteranges; boundary={boundary}'
+            )
+            response['Content-Length'] = (
+                sum(end - start + 1 + len(part_header(start, end)) for start, end in ranges)
+                + 2 * (len(ranges) - 1) + len(trailer)
+            )
+        return response
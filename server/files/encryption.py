@@ -0,0 +1,129 @@
+"""
+Segmented authenticated encryption of stored content (AES-256-GCM).
+
+Every blob has its own data key. Its content is cut into segments of
+`segment_size` bytes and each segment is sealed on its own, so a byte range
+is read by decrypting only the segments it overlaps. The nonce of a segment
+is the blob's random prefix, the segment index and a final-segment flag:
+segments cannot be reordered or dropped, and a truncated file fails to
+decrypt. Data keys are wrapped by the master key in
+secure_file_sharing.crypto; like files.compression this module needs no
+Django setup, so indexing workers can decrypt the documents they fetch.
+"""
+import io
+import os
+import struct
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+FORMAT_VERSION = 1
+KEY_SIZE = 32
+NONCE_PREFIX_SIZE = 7
+TAG_SIZE = 16
+_PARAMS = struct.Struct('>BI')
+
+class SegmentCipher:
+    """Data key, nonce prefix and segment size of one encrypted blob"""
+    
+    def __init__(self, key, nonce_prefix, segment_size):
+        self.key = key
+        self.nonce_prefix = nonce_prefix
+        self.segment_size = segment_size
+        self.sealed_size = segment_size + TAG_SIZE
+        self._aead = AESGCM(key)
+    
+    @classmethod
+    def generate(cls, segment_size):
+        return cls(os.urandom(KEY_SIZE), os.urandom(NONCE_PREFIX_SIZE), segment_size)
+    
+    @classmethod
+    def from_bytes(cls, data):
+        version, segment_size = _PARAMS.unpack_from(data)
+        if version != FORMAT_VERSION:
+            raise ValueError(f'Unknown encryption format {version}')
+        nonce_prefix = data[_PARAMS.size:_PARAMS.size + NONCE_PREFIX_SIZE]
+        return cls(data[_PARAMS.size + NONCE_PREFIX_SIZE:], nonce_prefix, segment_size)
+    
+    def to_bytes(self):
+        """Serialized parameters, to be wrapped by the master key"""
+        return _PARAMS.pack(FORMAT_VERSION, self.segment_size) + self.nonce_prefix + self.key
+    
+    def _nonce(self, index, last):
+        return self.nonce_prefix + struct.pack('>IB', index, last)
+    
+    def stored_size(self, size):
+        """Size of `size` bytes once encrypted"""
+        return size + self.segment_count(size, sealed=False) * TAG_SIZE
+    
+    def plaintext_size(self, stored_size):
+        """Size of the content of a `stored_size` byte encrypted file"""
+        return stored_size - self.segment_count(stored_size) * TAG_SIZE
+    
+    def segment_count(self, size, sealed=True):
+        """Segments in `size` encrypted bytes (or plaintext bytes, with sealed=False); never 0"""
+        step = self.sealed_size if sealed else self.segment_size
+        return max(1, -(-size // step))
+    
+    def segment_span(self, start, length, stored_size):
+        """(first segment, stored offset, stored length) covering `length` plaintext bytes from `start`"""
+        first = start // self.segment_size
+        last = (start + length - 1) // self.segment_size
+        offset = first * self.sealed_size
+        return first, offset, min((last + 1) * self.sealed_size, stored_size) - offset
+    
+    def encrypt_chunks(self, chunks):
+        """Yield the sealed segments of a stream of plaintext `chunks`"""
+        for index, segment, last in _segments(chunks, self.segment_size):
+            yield self._aead.encrypt(self._nonce(index, last), segment, None)
+    
+    def decrypt_chunks(self, chunks, first_index=0, last_index=None):
+        """
+        Yield the plaintext of a stream of sealed segments starting at segment
+        `first_index`. `last_index` is the file's final segment; when None the
+        stream is taken to run to the end of the file. Raises
+        cryptography.exceptions.InvalidTag on tampered or truncated content.
+        """
+        for index, segment, last in _segments(chunks, self.sealed_size, first_index):
+            last = index == last_index or (last and last_index is None)
+            yield self._aead.decrypt(self._nonce(index, last), segment, None)
+
+def _segments(chunks, size, first_index=0):
+    """
+    Cut a stream of chunks into (index, segment, is_last) of `size` bytes;
+    one segment is held back so the last one is known. An empty stream is
+    one empty segment.
+    """
+    buffer = bytearray()
+    index, held = first_index, None
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= size:
+            if held is not None:
+                yield index, held, False
+                index += 1
+            held = bytes(buffer[:size])
+            del buffer[:size]
+    if buffer:
+        if held is not None:
+            yield index, held, False
+            index += 1
+        held = bytes(buffer)
+    yield index, held or b'', True
+
+class EncryptingReader(io.RawIOBase):
+    """Readable stream of the encrypted form of `source`, produced as it is read"""
+    
+    def __init__(self, source, cipher):
+        self._segments = cipher.encrypt_chunks(iter(lambda: source.read(cipher.segment_size), b''))
+        self._buffer = b''
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, b):
+        if not self._buffer:
+            self._buffer = next(self._segments, b'')
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
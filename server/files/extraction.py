@@ -0,0 +1,135 @@
+"""
+Title, author, page/slide/sheet count and body text of PPTX/DOCX/XLSX files.
+
+This module only uses the standard library and touches neither Django nor the
+database, so extract_document can run in worker processes (see files.indexing).
+"""
+import re
+import zipfile
+from xml.etree.ElementTree import ParseError, XMLPullParser
+
+CORE_PROPERTIES = 'docProps/core.xml'
+APP_PROPERTIES = 'docProps/app.xml'
+
+DC = '{http://purl.org/dc/elements/1.1/}'
+EXTENDED = '{http://schemas.openxmlformats.org/officeDocument/2006/extended-properties}'
+WORD = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+DRAWING = '{http://schemas.openxmlformats.org/drawingml/2006/main}'
+SHEET = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+# Text element and block element (ends a line) per document kind
+TEXT_TAGS = {
+    'docx': (WORD + 't', WORD + 'p'),
+    'pptx': (DRAWING + 't', DRAWING + 'p'),
+    'xlsx': (SHEET + 't', SHEET + 'si'),
+}
+
+KIND_BY_TYPE = {
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation': 'pptx',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+}
+
+SLIDE_PART = re.compile(r'ppt/slides/slide(\d+)\.xml')
+WORKSHEET_PART = re.compile(r'xl/worksheets/sheet(\d+)\.xml')
+
+READ_SIZE = 64 * 1024
+
+class ExtractionError(Exception):
+    pass
+
+class Budget:
+    """Bounds the XML inflated per document, whatever the ZIP headers claim"""
+    
+    def __init__(self, limit):
+        self.remaining = limit
+    
+    def take(self, size):
+        self.remaining -= size
+        if self.remaining < 0:
+            raise ExtractionError('Document expands beyond the extraction limit.')
+
+def iter_elements(archive, name, tags, budget):
+    parser = XMLPullParser(events=('end',))
+    with archive.open(name) as part:
+        while True:
+            data = part.read(READ_SIZE)
+            if not data:
+                break
+            budget.take(len(data))
+            parser.feed(data)
+            for _, element in parser.read_events():
+                if element.tag in tags:
+                    yield element
+    parser.close()
+
+def _read_properties(archive, names, budget):
+    properties = {}
+    wanted = {DC + 'title': 'title', DC + 'creator': 'author', EXTENDED + 'Pages': 'pages'}
+    for name in (CORE_PROPERTIES, APP_PROPERTIES):
+        if name in names:
+            for element in iter_elements(archive, name, wanted, budget):
+                properties[wanted[element.tag]] = (element.text or '').strip()
+    return properties
+
+def text_parts(kind, names):
+    if kind == 'docx':
+        return ['word/document.xml']
+    if kind == 'pptx':
+        return sorted(
+            (name for name in names if SLIDE_PART.fullmatch(name)),
+            key=lambda name: int(SLIDE_PART.fullmatch(name).group(1))
+        )
+    # Cell text is stored once in the shared string table
+    return ['xl/sharedStrings.xml']
+
+def _extract_text(archive, kind, names, max_chars, budget):
+    text_tag, block_tag = TEXT_TAGS[kind]
+    pieces, length = [], 0
+    for name in text_parts(kind, names):
+        if name not in names:
+            continue
+        for element in iter_elements(archive, name, (text_tag, block_tag), budget):
+            if element.tag == text_tag:
+                piece = element.text or ''
+            else:
+                piece = '\n'
+                # Drop finished blocks so large parts parse in constant memory
+                element.clear()
+            pieces.append(piece)
+            length += len(piece)
+            if length >= max_chars:
+                return ''.join(pieces)[:max_chars]
+    return ''.join(pieces)
+
+def _count_pages(kind, names, properties):
+    if kind == 'pptx':
+        return sum(1 for name in names if SLIDE_PART.fullmatch(name))
+    if kind == 'xlsx':
+        return sum(1 for name in names if WORKSHEET_PART.fullmatch(name))
+    # Word stores the page count its last layout produced, if any
+    pages = properties.get('pages', '')
+    return int(pages) if pages.isdigit() else None
+
+def extract_document(path, file_type, max_chars, max_xml_bytes):
+    """
+    Return {'title', 'author', 'page_count', 'text'} for the document at
+    `path`. `page_count` is pages, slides or sheets depending on the type; body
+    text is cut at `max_chars`. Raises ExtractionError for unreadable files.
+    """
+    kind = KIND_BY_TYPE.get(file_type)
+    if kind is None:
+        raise ExtractionError(f'Unsupported file type: {file_type}')
+    budget = Budget(max_xml_bytes)
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+            properties = _read_properties(archive, names, budget)
+            return {
+                'title': properties.get('title', '')[:255],
+                'author': properties.get('author', '')[:255],
+                'page_count': _count_pages(kind, names, properties),
+                'text': _extract_text(archive, kind, names, max_chars, budget),
+            }
+    except (zipfile.BadZipFile, ParseError, NotImplementedError, RuntimeError, EOFError) as e:
+        raise ExtractionError(f'Could not read document: {e}') from e
@@ -0,0 +1,48 @@
+from datetime import datetime, time
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+
+def parse_datetime_param(name, value):
+    """Accept an ISO datetime or a plain date (midnight, server time zone)"""
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            parsed_date = parse_date(value)
+            if parsed_date is not None:
+                parsed = datetime.combine(parsed_date, time.min)
+    except ValueError:
+        parsed = None
+    
+    if parsed is None:
+        raise ValidationError({name: 'Use an ISO 8601 date or datetime.'})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+def filter_files(queryset, params):
+    """
+    Apply the list_files query parameters:
+    
+    - file_type: exact MIME type
+    - uploader: uploader email
+    - uploaded_after / uploaded_before: ISO date or datetime bounds
+    - name: case-insensitive name prefix
+    """
+    if params.get('file_type'):
+        queryset = queryset.filter(file_type=params['file_type'])
+    
+    if params.get('uploader'):
+        queryset = queryset.filter(uploaded_by__email__iexact=params['uploader'])
+    
+    if params.get('uploaded_after'):
+        queryset = queryset.filter(uploaded_at__gte=parse_datetime_param('uploaded_after', params['uploaded_after']))
+    
+    if params.get('uploaded_before'):
+        queryset = queryset.filter(uploaded_at__lt=parse_datetime_param('uploaded_before', params['uploaded_before']))
+    
+    if params.get('name'):
+        queryset = queryset.filter(name__istartswith=params['name'])
+    
+    return queryset
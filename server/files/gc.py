@@ -0,0 +1,132 @@
+"""
+Garbage collection for download links, soft-deleted files and stored content
+that nothing references any more.
+
+Every pass works in batches of FILE_GC_BATCH_SIZE rows, each in its own short
+transaction, so no write lock is held for longer than one batch.
+"""
+import posixpath
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DownloadBatch, DownloadLink, FileBlob, UploadedFile
+
+def purge_download_links(now, batch_size):
+    """
+    Delete links and ZIP grants that expired, or were consumed, more than
+    DOWNLOAD_LINK_RETENTION_DAYS ago
+    """
+    cutoff = now - timedelta(days=settings.DOWNLOAD_LINK_RETENTION_DAYS)
+    rows = 0
+    for model in (DownloadLink, DownloadBatch):
+        stale = model.objects.filter(Q(expires_at__lt=cutoff) | Q(is_used=True, used_at__lt=cutoff))
+        while True:
+            ids = list(stale.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            deleted, _ = model.objects.filter(pk__in=ids).delete()
+            rows += deleted
+    return rows
+
+def purge_deleted_files(now, batch_size):
+    """
+    Hard-delete files soft-deleted more than FILE_DELETED_RETENTION_DAYS ago,
+    with their download links, releasing their blobs. Returns (rows, bytes).
+    """
+    cutoff = now - timedelta(days=settings.FILE_DELETED_RETENTION_DAYS)
+    expired = UploadedFile.objects.filter(is_active=False).filter(
+        # Rows soft-deleted before deleted_at existed fall back to updated_at
+        Q(deleted_at__lt=cutoff) | Q(deleted_at__isnull=True, updated_at__lt=cutoff)
+    )
+    rows = reclaimed = 0
+    while True:
+        with transaction.atomic():
+            batch = list(expired.values_list('pk', 'blob_id', 'blob__size', 'file', 'file_size')[:batch_size])
+            if not batch:
+                break
+            # Cascades to download links; the post_delete receiver releases
+            # blobs and removes legacy files
+            UploadedFile.objects.filter(pk__in=[pk for pk, _, _, _, _ in batch]).delete()
+            
+            blob_sizes = {blob_id: size for _, blob_id, size, _, _ in batch if blob_id}
+            kept = set(FileBlob.objects.filter(pk__in=blob_sizes).values_list('pk', flat=True))
+            reclaimed += sum(size for blob_id, size in blob_sizes.items() if blob_id not in kept)
+            # Legacy rows own their file outright
+            reclaimed += sum(size for _, blob_id, _, name, size in batch if not blob_id and name)
+            rows += len(batch)
+    return rows, reclaimed
+
+def purge_unreferenced_blobs(now, batch_size):
+    """
+    Delete blobs no UploadedFile points at (e.g. left by a crashed upload).
+    Returns (rows, bytes).
+    """
+    cutoff = now - timedelta(hours=settings.FILE_GC_ORPHAN_GRACE_HOURS)
+    unreferenced = FileBlob.objects.filter(uploads__isnull=True, created_at__lt=cutoff)
+    rows = reclaimed = 0
+    while True:
+        with transaction.atomic():
+            ids = list(unreferenced.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return rows, reclaimed
+            reclaimed += FileBlob.delete_with_content(FileBlob.objects.filter(pk__in=ids, uploads__isnull=True))
+            rows += len(ids)
+
+def _walk(storage, directory):
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield posixpath.join(directory, name)
+    for name in directories:
+        yield from _walk(storage, posixpath.join(directory, name))
+
+def remove_orphaned_files(now, batch_size):
+    """
+    Delete stored files under blobs/ and uploads/ that no row references.
+    Files younger than FILE_GC_ORPHAN_GRACE_HOURS are kept, since uploads
+    write their content before the row is committed. Returns (files, bytes).
+    """
+    cutoff = now - timedelta(hours=settings.FILE_GC_ORPHAN_GRACE_HOURS)
+    storage = FileBlob._meta.get_field('file').storage
+    removed = reclaimed = 0
+    
+    def sweep(names):
+        nonlocal removed, reclaimed
+        referenced = set(FileBlob.objects.filter(file__in=names).values_list('file', flat=True))
+        referenced.update(UploadedFile.objects.filter(file__in=names).values_list('file', flat=True))
+        for name in names:
+            if name in referenced or storage.get_modified_time(name) >= cutoff:
+                continue
+            size = storage.size(name)
+            storage.delete(name)
+            removed += 1
+            reclaimed += size
+    
+    for directory in ('blobs', 'uploads'):
+        names = []
+        for name in _walk(storage, directory):
+            names.append(name)
+            if len(names) >= batch_size:
+                sweep(names)
+                names = []
+        if names:
+            sweep(names)
+    return removed, reclaimed
+
+def collect_garbage(batch_size=None, orphans=True):
+    """Run every pass and return a report of rows and bytes reclaimed"""
+    batch_size = batch_size or settings.FILE_GC_BATCH_SIZE
+    now = timezone.now()
+    
+    report = {'download_links': purge_download_links(now, batch_size)}
+    report['files'], files_bytes = purge_deleted_files(now, batch_size)
+    report['blobs'], blobs_bytes = purge_unreferenced_blobs(now, batch_size)
+    report['orphaned_files'], orphan_bytes = remove_orphaned_files(now, batch_size) if orphans else (0, 0)
+    report['bytes_reclaimed'] = files_bytes + blobs_bytes + orphan_bytes
+    return report
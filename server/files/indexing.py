@@ -0,0 +1,215 @@
+"""
+Background metadata extraction, search indexing and preview rendering for
+uploaded documents.
+
+Parsing is CPU-bound, so it runs in worker processes; only the (small)
+results come back to be written to document_metadata and the search index.
+Previews are written straight into the preview cache by the workers.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .jobs import run_document_job
+from .models import DocumentMetadata, UploadedFile
+from .previews import get_preview_cache, preview_key
+from .search import get_search_index
+from .storage import local_path
+
+logger = logging.getLogger(__name__)
+
+def prepare_jobs(file_ids):
+    """Create pending metadata rows for `file_ids` and return their document jobs"""
+    uploads = list(
+        UploadedFile.objects.filter(pk__in=file_ids, is_active=True)
+        .select_related('blob')
+        .only('id', 'file', 'file_type', 'blob__sha256', 'blob__encoding', 'blob__encryption')
+    )
+    DocumentMetadata.objects.bulk_create(
+        [DocumentMetadata(upload=upload) for upload in uploads],
+        ignore_conflicts=True
+    )
+    preview_cache = get_preview_cache()
+    jobs = []
+    for upload in uploads:
+        key = preview_key(upload)
+        path = local_path(upload.file)
+        cipher = upload.content_cipher
+        jobs.append({
+            'upload_id': upload.pk,
+            'path': path,
+            # Remote content is fetched by the worker; presigned URLs stay valid
+            # for AWS_QUERYSTRING_EXPIRE seconds, failures are retried by index_documents
+            'url': None if path else upload.file.storage.url(upload.file.name),
+            'file_type': upload.file_type,
+            # Compressed content is decompressed by the worker (files.compression)
+            'encoding': upload.content_encoding,
+            # Encrypted content is decrypted by the worker with its unwrapped data key.
+            # Jobs stay on this host: CeleryIndexQueue workers build their own.
+            'cipher': cipher.to_bytes() if cipher else None,
+            'max_chars': settings.FILE_INDEX_MAX_TEXT,
+            'max_xml_bytes': settings.FILE_INDEX_MAX_XML_BYTES,
+            # Duplicate content already has its previews. Workers write plaintext, so
+            # encrypted content is left to PreviewCache, which seals it on first view
+            'preview': None if cipher or preview_cache.has(key) else {
+                'thumbnail_path': str(preview_cache.path(key, 'png')),
+                'html_path': str(preview_cache.path(key, 'html')),
+                'size': settings.FILE_PREVIEW_SIZE,
+            },
+        })
+    return jobs
+
+def store_results(results):
+    """Save run_document_job results and index the extracted text"""
+    by_upload = {upload_id: (result, error) for upload_id, result, error, _ in results}
+    get_preview_cache().added(sum(preview_bytes for _, _, _, preview_bytes in results))
+    now = timezone.now()
+    with transaction.atomic():
+        # Files deleted while they were being parsed have lost their row
+        rows = list(
+            DocumentMetadata.objects.select_for_update()
+            .filter(upload_id__in=by_upload)
+            .select_related('upload')
+        )
+        indexed = []
+        for metadata in rows:
+            result, error = by_upload[metadata.upload_id]
+            metadata.indexed_at = now
+            if result is None:
+                metadata.status, metadata.error = 'failed', error
+                continue
+            metadata.status, metadata.error = 'indexed', ''
+            metadata.title = result['title']
+            metadata.author = result['author']
+            metadata.page_count = result['page_count']
+            indexed.append((metadata.pk, metadata.upload.name, result['title'], result['author'], result['text']))
+        DocumentMetadata.objects.bulk_update(rows, ['title', 'author', 'page_count', 'status', 'error', 'indexed_at'])
+        search_index = get_search_index()
+        if indexed and search_index is not None:
+            search_index.index(indexed)
+    return len(indexed)
+
+def index_documents(file_ids, workers=1):
+    """Extract and index `file_ids` now, in a temporary pool when `workers` > 1"""
+    jobs = prepare_jobs(file_ids)
+    if workers > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            results = list(pool.map(run_document_job, jobs))
+    else:
+        results = [run_document_job(job) for job in jobs]
+    return store_results(results)
+
+class ProcessPoolIndexQueue:
+    """
+    In-process indexing queue; needs no broker.
+    
+    Documents are parsed in a pool of FILE_INDEX_WORKERS spawned processes,
+    and one writer thread saves results in batches, so request threads only
+    pay for a single SELECT/INSERT when they enqueue.
+    """
+    
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+        self._results = queue.Queue()
+        self._writer = None
+        self._pending = 0
+        self._idle = threading.Condition()
+    
+    def enqueue(self, file_ids):
+        jobs = prepare_jobs(file_ids)
+        if not jobs:
+            return
+        with self._idle:
+            self._pending += len(jobs)
+        pool = self._ensure_started()
+        for job in jobs:
+            future = pool.submit(run_document_job, job)
+            future.add_done_callback(lambda future, upload_id=job['upload_id']: self._results.put((upload_id, future)))
+    
+    def _ensure_started(self):
+        with self._lock:
+            if self._pool is None:
+                # Spawned workers do not inherit the server's threads or connections;
+                # they only import files.jobs, which needs no Django setup
+                self._pool = ProcessPoolExecutor(
+                    max_workers=settings.FILE_INDEX_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._run, name='index-writer', daemon=True)
+                self._writer.start()
+            return self._pool
+    
+    def _run(self):
+        while True:
+            batch = [self._results.get()]
+            while len(batch) < settings.FILE_INDEX_BATCH_SIZE:
+                try:
+                    batch.append(self._results.get_nowait())
+                except queue.Empty:
+                    break
+            results = []
+            for upload_id, future in batch:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    # The worker process died (e.g. killed for memory)
+                    results.append((upload_id, None, f'Extraction failed: {e.__class__.__name__}', 0))
+            try:
+                close_old_connections()
+                store_results(results)
+            except Exception:
+                logger.exception('Could not store metadata for %d document(s)', len(results))
+            finally:
+                with self._idle:
+                    self._pending -= len(batch)
+                    if self._pending <= 0:
+                        self._idle.notify_all()
+    
+    def join(self, timeout=None):
+        """Block until every queued document has been stored"""
+        with self._idle:
+            return self._idle.wait_for(lambda: self._pending <= 0, timeout=timeout)
+
+class CeleryIndexQueue:
+    """Index in Celery workers (broker at CELERY_BROKER_URL)"""
+    
+    def enqueue(self, file_ids):
+        from .tasks import index_documents as index_documents_task
+        
+        index_documents_task.delay([str(file_id) for file_id in file_ids])
+
+@lru_cache(maxsize=None)
+def get_index_queue():
+    """Return the configured indexing queue instance"""
+    return import_string(settings.FILE_INDEX_QUEUE_BACKEND)()
+
+@receiver(setting_changed)
+def _reset_index_queue(setting, **kwargs):
+    if setting == 'FILE_INDEX_QUEUE_BACKEND':
+        get_index_queue.cache_clear()
+
+def schedule_indexing(file_ids):
+    """Queue `file_ids` for extraction once the current transaction commits"""
+    file_ids = list(file_ids)
+    
+    def enqueue():
+        try:
+            get_index_queue().enqueue(file_ids)
+        except Exception:
+            # The upload itself succeeded; `index_documents` can catch up later
+            logger.exception('Could not queue %d document(s) for indexing', len(file_ids))
+    
+    if file_ids:
+        transaction.on_commit(enqueue)
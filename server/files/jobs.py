@@ -0,0 +1,80 @@
+"""
+Process-pool entry point for document jobs (see files.indexing).
+
+Jobs are plain dicts and the work needs no Django setup, so spawned worker
+processes only import this module, files.compression, files.encryption,
+files.extraction and files.rendering.
+"""
+import tempfile
+import urllib.request
+from contextlib import contextmanager
+
+from .compression import decompress_chunks
+from .encryption import SegmentCipher
+from .extraction import extract_document
+from .rendering import render_preview
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
+@contextmanager
+def _document_path(job):
+    """
+    The job's local `path`, or its remote `url` downloaded to a temporary
+    file. Content stored encrypted (`cipher`) or with an `encoding` is
+    decrypted and decompressed into a temporary file either way.
+    """
+    encoding, cipher = job.get('encoding'), job.get('cipher')
+    if job.get('path') and not encoding and not cipher:
+        yield job['path']
+        return
+    with tempfile.NamedTemporaryFile(prefix='document-', suffix='.tmp') as copy:
+        if job.get('path'):
+            source = open(job['path'], 'rb')
+        else:
+            source = urllib.request.urlopen(job['url'], timeout=DOWNLOAD_TIMEOUT)
+        with source:
+            chunks = iter(lambda: source.read(DOWNLOAD_CHUNK_SIZE), b'')
+            if cipher:
+                chunks = SegmentCipher.from_bytes(cipher).decrypt_chunks(chunks)
+            for data in decompress_chunks(encoding, chunks) if encoding else chunks:
+                copy.write(data)
+        copy.flush()
+        yield copy.name
+
+def run_document_job(job):
+    """
+    Extract metadata for a job and, when it has a `preview` target, render
+    its previews. Returns (upload_id, result, error, preview_bytes) rather
+    than raising; a preview failure does not fail the extraction.
+    """
+    try:
+        with _document_path(job) as path:
+            return _run(job, path)
+    except Exception as e:
+        # The remote copy could not be fetched (e.g. its presigned URL expired)
+        return job['upload_id'], None, str(e)[:255] or e.__class__.__name__, 0
+
+def _run(job, path):
+    try:
+        result = extract_document(path, job['file_type'], job['max_chars'], job['max_xml_bytes'])
+        error = ''
+    except Exception as e:
+        result, error = None, str(e)[:255] or e.__class__.__name__
+    
+    preview_bytes = 0
+    preview = job.get('preview')
+    if preview:
+        try:
+            preview_bytes = render_preview(
+                path,
+                job['file_type'],
+                preview['thumbnail_path'],
+                preview['html_path'],
+                preview['size'],
+                job['max_xml_bytes']
+            )
+        except Exception:
+            # Rendered again on first request
+            pass
+    return job['upload_id'], result, error, preview_bytes
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from files.models import DownloadLink
+
+BATCH_SIZE = 1000
+
+class Command(BaseCommand):
+    help = 'Fill in token_key for download links created before the column existed'
+    
+    def handle(self, *args, **options):
+        # Ids first: SQLite cannot update a table while a cursor iterates it
+        ids = list(DownloadLink.objects.filter(token_key__isnull=True).values_list('pk', flat=True))
+        for offset in range(0, len(ids), BATCH_SIZE):
+            links = list(
+                DownloadLink.objects.filter(pk__in=ids[offset:offset + BATCH_SIZE], token_key__isnull=True)
+                .only('pk', 'encrypted_token')
+            )
+            for link in links:
+                link.token_key = DownloadLink.lookup_key(link.encrypted_token)
+            DownloadLink.objects.bulk_update(links, ['token_key'])
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {len(ids)} token key(s).'))
@@ -0,0 +1,168 @@
+import asyncio
+import os
+import statistics
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+
+from accounts.models import User
+from files.models import UploadedFile
+from files.utils import content_sha256
+
+CONCURRENCY_LEVELS = [10, 50, 100, 250, 500]
+
+class Command(BaseCommand):
+    help = (
+        'Compare the sync (WSGI) and async (ASGI) list, detail and download endpoints: '
+        'requests/sec and latency at each of a sweep of concurrency levels'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests',
+            type=int,
+            default=500,
+            help='Requests per endpoint, interface and level; raised to the level if lower (default: 500)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            nargs='+',
+            default=CONCURRENCY_LEVELS,
+            help='Concurrent clients: threads (WSGI) or tasks (ASGI), one run per level '
+                 f'(default: {" ".join(map(str, CONCURRENCY_LEVELS))})',
+        )
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=1024,
+            help='Size of the downloaded file in KB (default: 1024)',
+        )
+    
+    def handle(self, *args, requests=500, concurrency=CONCURRENCY_LEVELS, size=1024, **options):
+        if requests < 1 or min(concurrency) < 1:
+            raise CommandError('--requests and --concurrency must be positive.')
+        
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(
+            username=f'benchmark-{tag}@example.invalid',
+            email=f'benchmark-{tag}@example.invalid',
+            password=None,
+            user_type='client',
+            is_email_verified=True
+        )
+        content = ContentFile(os.urandom(size * 1024), name='benchmark.bin')
+        file_obj = UploadedFile.create_from_content(
+            content, content_sha256(content),
+            name='benchmark.bin', file_type='application/octet-stream', file_size=content.size, uploaded_by=user
+        )
+        # Any name ALLOWED_HOSTS accepts ('*' and '.example.com' patterns included)
+        self.host = next((name.lstrip('.') for name in settings.ALLOWED_HOSTS if name != '*'), 'localhost')
+        try:
+            # The async endpoints are only mounted by the ASGI URLconf
+            with override_settings(ROOT_URLCONF='secure_file_sharing.asgi_urls'):
+                client = Client(SERVER_NAME=self.host)
+                client.force_login(user)
+                self.cookies = client.cookies
+                for level in concurrency:
+                    count = max(requests, level)
+                    self.stdout.write(f'Concurrency {level}: {count} request(s) per endpoint, {size} KB download')
+                    for endpoint in ('list', 'detail', 'download'):
+                        for interface, prefix in (('WSGI', '/api/files/'), ('ASGI', '/api/async/files/')):
+                            paths = self._paths(client, endpoint, prefix, file_obj, count)
+                            if interface == 'WSGI':
+                                latencies, failures, elapsed = self._run_wsgi(paths, level)
+                            else:
+                                latencies, failures, elapsed = asyncio.run(self._run_asgi(paths, level))
+                            self._report(f'{endpoint} {interface}', latencies, failures, elapsed)
+        finally:
+            file_obj.delete()
+            user.delete()
+    
+    def _paths(self, client, endpoint, prefix, file_obj, count):
+        if endpoint == 'list':
+            return [f'{prefix}list/'] * count
+        if endpoint == 'detail':
+            return [f'{prefix}detail/{file_obj.id}/'] * count
+        # Download links are one-time, so every request gets its own
+        paths = []
+        for _ in range(count):
+            response = client.post(f'/api/files/download/{file_obj.id}/')
+            if response.status_code != 200:
+                raise CommandError(f'Could not create a download link ({response.status_code}).')
+            paths.append(prefix + response.json()['download_link'].partition('/api/files/')[2])
+        return paths
+    
+    def _run_wsgi(self, paths, concurrency):
+        latencies, failures = [], []
+        lock = threading.Lock()
+        pending = iter(paths)
+        
+        def send():
+            client = Client(SERVER_NAME=self.host)
+            client.cookies = self.cookies
+            try:
+                while True:
+                    with lock:
+                        path = next(pending, None)
+                    if path is None:
+                        return
+                    start = time.perf_counter()
+                    response = client.get(path)
+                    if response.streaming:
+                        for _ in response.streaming_content:
+                            pass
+                    response.close()
+                    with lock:
+                        latencies.append(time.perf_counter() - start)
+                        if response.status_code != 200:
+                            failures.append(response.status_code)
+            finally:
+                connections.close_all()
+        
+        threads = [threading.Thread(target=send) for _ in range(concurrency)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return latencies, failures, time.perf_counter() - start
+    
+    async def _run_asgi(self, paths, concurrency):
+        latencies, failures = [], []
+        pending = iter(paths)
+        
+        async def send():
+            client = AsyncClient(SERVER_NAME=self.host)
+            client.cookies = self.cookies
+            for path in pending:
+                start = time.perf_counter()
+                response = await client.get(path)
+                if response.streaming:
+                    async for _ in response.streaming_content:
+                        pass
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    failures.append(response.status_code)
+        
+        start = time.perf_counter()
+        await asyncio.gather(*(send() for _ in range(concurrency)))
+        return latencies, failures, time.perf_counter() - start
+    
+    def _report(self, label, latencies, failures, elapsed):
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        self.stdout.write(self.style.SUCCESS(
+            f'  {label:<14} {len(latencies) / elapsed:8.1f} req/s, '
+            f'median {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms'
+        ))
+        if failures:
+            self.stdout.write(self.style.WARNING(
+                f'  {len(failures)} request(s) failed: ' + ', '.join(sorted({str(code) for code in failures}))
+            ))
@@ -0,0 +1,166 @@
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+
+from accounts.models import User
+from files.models import UploadedFile
+from files.utils import content_sha256
+
+def current_rss():
+    """Resident set size of this process in bytes; the peak so far where /proc is missing"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+class RssSampler(threading.Thread):
+    """Poll the RSS in the background and keep the highest value seen"""
+    
+    def __init__(self, interval=0.005):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self._done = threading.Event()
+    
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+    
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+
+class Command(BaseCommand):
+    help = (
+        'Measure peak RSS and time to first byte of secure downloads at several '
+        'concurrency levels with the current delivery settings'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=50,
+            help='Size of the downloaded file in MB (default: 50)',
+        )
+        parser.add_argument(
+            '--concurrency',
+            default='1,10,50',
+            help='Comma-separated numbers of simultaneous downloads (default: 1,10,50)',
+        )
+    
+    def handle(self, *args, size=50, concurrency='1,10,50', **options):
+        try:
+            levels = [int(level) for level in concurrency.split(',')]
+        except ValueError:
+            raise CommandError('--concurrency takes comma-separated integers.')
+        
+        tag = uuid.uuid4().hex[:8]
+        user = User.objects.create_user(
+            username=f'benchmark-{tag}@example.invalid',
+            email=f'benchmark-{tag}@example.invalid',
+            password=None,
+            user_type='client',
+            is_email_verified=True
+        )
+        file_obj = None
+        try:
+            file_obj = self._create_file(user, size * 1024 * 1024)
+            self.stdout.write(
+                f'{size} MB file, {settings.FILE_DELIVERY_BACKEND}, '
+                f'{settings.FILE_DOWNLOAD_CHUNK_SIZE // 1024} KB blocks'
+            )
+            for level in levels:
+                self._run(user, file_obj, level)
+        finally:
+            if file_obj is not None:
+                file_obj.delete()
+            user.delete()
+    
+    def _create_file(self, owner, size):
+        # Random bytes: nothing for storage compression to shrink
+        with tempfile.TemporaryFile() as temp:
+            for _ in range(0, size, 1024 * 1024):
+                temp.write(os.urandom(min(1024 * 1024, size - temp.tell())))
+            temp.seek(0)
+            content = File(temp, name='benchmark.bin')
+            return UploadedFile.create_from_content(
+                content, content_sha256(content),
+                name='benchmark.bin', file_type='application/octet-stream', file_size=size, uploaded_by=owner
+            )
+    
+    def _run(self, user, file_obj, level):
+        # Any name ALLOWED_HOSTS accepts ('*' and '.example.com' patterns included)
+        host = next((name.lstrip('.') for name in settings.ALLOWED_HOSTS if name != '*'), 'localhost')
+        client = Client(SERVER_NAME=host)
+        client.force_login(user)
+        paths = []
+        for _ in range(level):
+            response = client.post(f'/api/files/download/{file_obj.id}/')
+            if response.status_code != 200:
+                raise CommandError(f'Could not create a download link ({response.status_code}).')
+            paths.append(response.json()['download_link'].split('://', 1)[-1].partition('/')[2])
+        
+        ttfbs, failures = [], []
+        lock = threading.Lock()
+        barrier = threading.Barrier(level)
+        
+        def download(path):
+            downloader = Client(SERVER_NAME=host)
+            downloader.cookies = client.cookies
+            try:
+                barrier.wait()
+                start = time.perf_counter()
+                response = downloader.get('/' + path)
+                chunks = iter(response.streaming_content if response.streaming else [response.content])
+                next(chunks, b'')
+                ttfb = time.perf_counter() - start
+                for _ in chunks:
+                    pass
+                response.close()
+                with lock:
+                    if response.status_code == 200:
+                        ttfbs.append(ttfb)
+                    else:
+                        failures.append(response.status_code)
+            finally:
+                connections.close_all()
+        
+        sampler = RssSampler()
+        baseline = sampler.peak
+        threads = [threading.Thread(target=download, args=(path,)) for path in paths]
+        sampler.start()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        
+        megabytes = file_obj.file_size * len(ttfbs) / (1024 * 1024)
+        if ttfbs:
+            ttfbs.sort()
+            self.stdout.write(self.style.SUCCESS(
+                f'{level:>4} concurrent: peak RSS +{(sampler.peak - baseline) / (1024 * 1024):.1f} MB, '
+                f'TTFB median {statistics.median(ttfbs) * 1000:.1f} ms, '
+                f'max {ttfbs[-1] * 1000:.1f} ms, {megabytes / elapsed:.1f} MB/s'
+            ))
+        if failures:
+            self.stdout.write(self.style.WARNING(
+                f'{len(failures)} download(s) failed: ' + ', '.join(sorted({str(code) for code in failures}))
+            ))
@@ -0,0 +1,60 @@
+import base64
+import json
+import secrets
+import time
+import uuid
+from types import SimpleNamespace
+
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from files.utils import decode_download_token, generate_secure_download_token
+
+def legacy_encrypt(file_obj, user):
+    """Download token as built before the shared crypto service: a new key and Fernet per call, encoded twice"""
+    fernet = Fernet(base64.urlsafe_b64encode(settings.ENCRYPTION_KEY.encode()[:32].ljust(32, b'0')))
+    token_data = {
+        'file_id': str(file_obj.id),
+        'user_id': str(user.id),
+        'timestamp': str(secrets.randbits(64))
+    }
+    return base64.urlsafe_b64encode(fernet.encrypt(json.dumps(token_data).encode())).decode()
+
+def legacy_decrypt(token):
+    fernet = Fernet(base64.urlsafe_b64encode(settings.ENCRYPTION_KEY.encode()[:32].ljust(32, b'0')))
+    return json.loads(fernet.decrypt(base64.urlsafe_b64decode(token.encode())).decode())
+
+class Command(BaseCommand):
+    help = 'Measure download token generation and validation (tokens/sec) before and after the shared crypto service'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seconds',
+            type=float,
+            default=1.0,
+            help='How long to run each measurement (default: 1)',
+        )
+    
+    def handle(self, *args, seconds=1.0, **options):
+        file_obj = SimpleNamespace(id=uuid.uuid4())
+        user = SimpleNamespace(id=uuid.uuid4())
+        legacy_token = legacy_encrypt(file_obj, user)
+        token = generate_secure_download_token(file_obj, user)
+        
+        self.stdout.write(f'Token length: {len(legacy_token)} before, {len(token)} after')
+        self._measure('generate, before', seconds, lambda: legacy_encrypt(file_obj, user))
+        self._measure('generate, after', seconds, lambda: generate_secure_download_token(file_obj, user))
+        self._measure('validate, before', seconds, lambda: legacy_decrypt(legacy_token))
+        self._measure('validate, after', seconds, lambda: decode_download_token(token))
+        if settings.ENCRYPTION_ACCEPT_LEGACY_TOKENS:
+            # Old links during the transition: a failed Fernet check, then the second decoding
+            self._measure('validate old token, after', seconds, lambda: decode_download_token(legacy_token))
+    
+    def _measure(self, label, seconds, operation):
+        count, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            operation()
+            count += 1
+        rate = count / (time.perf_counter() - start)
+        self.stdout.write(f'  {label:<28} {rate:10.0f} tokens/sec')
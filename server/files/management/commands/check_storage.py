@@ -0,0 +1,55 @@
+import hashlib
+import os
+import time
+import urllib.request
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+
+from files.storage import file_storage, iter_range
+
+class Command(BaseCommand):
+    help = 'Write, read back, range-read and delete a test object in the files storage (e.g. a MinIO stand-in)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=20 * 1024 * 1024,
+            help='Bytes to write; above FILE_S3_MULTIPART_THRESHOLD this is a multipart upload (default: 20MB)',
+        )
+    
+    def handle(self, *args, size=0, **options):
+        storage = file_storage()
+        data = os.urandom(size)
+        self.stdout.write(f'{storage.__class__.__module__}.{storage.__class__.__name__}')
+        
+        start = time.perf_counter()
+        name = storage.save(f'storage-check/{hashlib.sha256(data).hexdigest()}', ContentFile(data))
+        self.stdout.write(f'  wrote {name} ({size} bytes) in {time.perf_counter() - start:.2f}s')
+        try:
+            if storage.size(name) != size:
+                raise CommandError(f'Stored size is {storage.size(name)}, expected {size}')
+            
+            start = time.perf_counter()
+            with storage.open(name, 'rb') as f:
+                if f.read() != data:
+                    raise CommandError('Read back different content')
+            self.stdout.write(f'  read back in {time.perf_counter() - start:.2f}s')
+            
+            offset, length = size // 3, min(size - size // 3, 1000)
+            if b''.join(iter_range(storage, name, offset, length, 256)) != data[offset:offset + length]:
+                raise CommandError('Ranged read returned different content')
+            self.stdout.write(f'  ranged read of {length} bytes at {offset} ok')
+            
+            if hasattr(storage, 'presigned_url'):
+                url = storage.presigned_url(name, 'check.bin', 'application/octet-stream')
+                with urllib.request.urlopen(url) as response:
+                    if response.read() != data:
+                        raise CommandError('Presigned URL returned different content')
+                self.stdout.write('  presigned GET ok')
+        finally:
+            storage.delete(name)
+        if storage.exists(name):
+            raise CommandError(f'{name} still exists after delete')
+        self.stdout.write(self.style.SUCCESS('Storage check passed.'))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from files.gc import collect_garbage
+
+class Command(BaseCommand):
+    help = (
+        'Purge expired/used download links and soft-deleted files past their retention '
+        'window, and remove stored content nothing references'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            help='Rows deleted per transaction (default: FILE_GC_BATCH_SIZE)',
+        )
+        parser.add_argument(
+            '--skip-orphans',
+            action='store_true',
+            help='Do not scan storage for unreferenced files',
+        )
+    
+    def handle(self, *args, batch_size=None, skip_orphans=False, **options):
+        report = collect_garbage(batch_size=batch_size, orphans=not skip_orphans)
+        reclaimed = report['bytes_reclaimed']
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {report['download_links']} download link(s), {report['files']} file(s), "
+            f"{report['blobs']} unreferenced blob(s) and {report['orphaned_files']} orphaned file(s); "
+            f"reclaimed {reclaimed} bytes ({reclaimed / (1024 * 1024):.1f} MB)."
+        ))
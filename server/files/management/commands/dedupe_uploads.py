@@ -0,0 +1,61 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from files.models import FileBlob, UploadedFile
+from files.storage import local_path
+from files.utils import SessionFile, content_sha256
+
+class Command(BaseCommand):
+    help = 'Move legacy media/uploads files into the deduplicated, content-addressed blob layout'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report what would be reclaimed without changing anything',
+        )
+    
+    def handle(self, *args, dry_run=False, **options):
+        migrated = duplicates = missing = reclaimed = 0
+        seen = set()
+        
+        for uploaded_file in UploadedFile.objects.filter(blob__isnull=True).iterator():
+            storage, name = uploaded_file.file.storage, uploaded_file.file.name
+            if not storage.exists(name):
+                missing += 1
+                self.stderr.write(f'Missing file for {uploaded_file.id}: {name}')
+                continue
+            
+            with storage.open(name, 'rb') as f:
+                sha256 = content_sha256(f)
+            size = storage.size(name)
+            is_duplicate = sha256 in seen or FileBlob.objects.filter(sha256=sha256).exists()
+            seen.add(sha256)
+            
+            if is_duplicate:
+                duplicates += 1
+                reclaimed += size
+            migrated += 1
+            if dry_run:
+                continue
+            
+            with transaction.atomic():
+                # On local disk a new blob takes over the file by rename unless
+                # it is compressed; otherwise it is copied. A duplicate is dropped.
+                path = local_path(uploaded_file.file)
+                with (open(path, 'rb') if path else storage.open(name, 'rb')) as f:
+                    blob = FileBlob.acquire(
+                        SessionFile(f) if path else File(f), sha256, uploaded_file.file_type
+                    )
+                UploadedFile.objects.filter(pk=uploaded_file.pk).update(
+                    blob=blob, file=blob.file.name
+                )
+            if storage.exists(name):
+                storage.delete(name)
+        
+        prefix = '[dry run] ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Migrated {migrated} file(s), {duplicates} duplicate(s), '
+            f'{missing} missing; reclaimed {reclaimed} bytes ({reclaimed / (1024 * 1024):.1f} MB).'
+        ))
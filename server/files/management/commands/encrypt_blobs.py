@@ -0,0 +1,90 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from files.models import FileBlob, UploadedFile
+from files.previews import get_preview_cache
+from files.storage import encrypt_for_storage
+from secure_file_sharing.crypto import rewrap_file_key
+
+BATCH_SIZE = 500
+
+class Command(BaseCommand):
+    help = (
+        'Encrypt blobs stored before FILE_ENCRYPTION_KEY was set, or re-wrap the data keys of '
+        'encrypted blobs under the current FILE_ENCRYPTION_KEY'
+    )
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rotate-keys',
+            action='store_true',
+            help='Re-wrap data keys (content is not rewritten), so old keys can leave FILE_ENCRYPTION_KEY_FALLBACKS',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Report how many blobs would change without changing anything',
+        )
+    
+    def handle(self, *args, rotate_keys=False, dry_run=False, **options):
+        if not settings.FILE_ENCRYPTION_KEY:
+            raise CommandError('Set FILE_ENCRYPTION_KEY first.')
+        if rotate_keys:
+            self._rotate_keys(dry_run)
+        else:
+            self._encrypt(dry_run)
+    
+    def _rotate_keys(self, dry_run):
+        # Ids first: SQLite cannot update a table while a cursor iterates it
+        ids = list(FileBlob.objects.exclude(encryption='').values_list('pk', flat=True))
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f'[dry run] Would re-wrap {len(ids)} data key(s).'))
+            return
+        for offset in range(0, len(ids), BATCH_SIZE):
+            with transaction.atomic():
+                blobs = list(
+                    FileBlob.objects.select_for_update()
+                    .filter(pk__in=ids[offset:offset + BATCH_SIZE])
+                    .only('pk', 'encryption')
+                )
+                for blob in blobs:
+                    blob.encryption = rewrap_file_key(blob.encryption)
+                FileBlob.objects.bulk_update(blobs, ['encryption'])
+        self.stdout.write(self.style.SUCCESS(f'Re-wrapped {len(ids)} data key(s).'))
+    
+    def _encrypt(self, dry_run):
+        ids = list(FileBlob.objects.filter(encryption='').values_list('pk', flat=True))
+        if dry_run:
+            self.stdout.write(self.style.SUCCESS(f'[dry run] Would encrypt {len(ids)} blob(s).'))
+            return
+        storage = FileBlob._meta.get_field('file').storage
+        preview_cache = get_preview_cache()
+        encrypted = missing = 0
+        for blob in FileBlob.objects.filter(pk__in=ids, encryption='').only('pk', 'sha256', 'file'):
+            old_name = blob.file.name
+            try:
+                with storage.open(old_name, 'rb') as source:
+                    sealed, encryption = encrypt_for_storage(source)
+                    # The plaintext keeps its name until the rows point at the new file
+                    new_name = storage.save(old_name, sealed)
+            except FileNotFoundError:
+                missing += 1
+                self.stderr.write(f'Missing content for blob {blob.sha256}: {old_name}')
+                continue
+            
+            with transaction.atomic():
+                updated = FileBlob.objects.filter(pk=blob.pk, file=old_name, encryption='').update(
+                    file=new_name, encryption=encryption
+                )
+                if updated:
+                    UploadedFile.objects.filter(blob=blob).update(file=new_name)
+                    transaction.on_commit(lambda name=old_name: storage.delete(name))
+                    # Its previews are sealed from now on
+                    transaction.on_commit(lambda key=blob.sha256: preview_cache.discard(key))
+            if updated:
+                encrypted += 1
+            else:
+                # Released or encrypted concurrently
+                storage.delete(new_name)
+        self.stdout.write(self.style.SUCCESS(f'Encrypted {encrypted} blob(s), {missing} missing.'))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+
+from files.indexing import index_documents
+from files.models import UploadedFile
+
+class Command(BaseCommand):
+    help = 'Extract metadata and index the text of uploaded files that have not been indexed yet'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Re-index every active file, not only new and failed ones',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=settings.FILE_INDEX_WORKERS,
+            help='Parser processes (default: FILE_INDEX_WORKERS)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=settings.FILE_INDEX_BATCH_SIZE,
+            help='Files stored per transaction (default: FILE_INDEX_BATCH_SIZE)',
+        )
+    
+    def handle(self, *args, all=False, workers=1, batch_size=50, **options):
+        files = UploadedFile.objects.filter(is_active=True)
+        if not all:
+            files = files.exclude(metadata__status='indexed')
+        file_ids = list(files.values_list('pk', flat=True))
+        
+        indexed = 0
+        for start in range(0, len(file_ids), batch_size):
+            indexed += index_documents(file_ids[start:start + batch_size], workers=workers)
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {indexed} of {len(file_ids)} file(s); see DocumentMetadata.error for failures."
+        ))
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from files.models import UploadSession
+
+class Command(BaseCommand):
+    help = 'Delete expired chunked upload sessions and reclaim their temp files'
+    
+    def handle(self, *args, **options):
+        count = UploadSession.purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'Purged {count} expired upload session(s).'))
@@ -1,18 +1,218 @@
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
+from django.utils import timezone
+from django.utils.functional import cached_property
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import uuid
 import os
 
+from .storage import compress_for_storage, encrypt_for_storage, file_cipher, file_storage
+from .utils import merge_ranges, ranges_length
+
 def upload_to(instance, filename):
     """Generate upload path for files"""
     ext = filename.split('.')[-1]
     filename = f"{uuid.uuid4()}.{ext}"
     return os.path.join('uploads', filename)
 
+def blob_upload_to(instance, filename):
+    """Content-addressed name, blobs/<sha256>; the sharded storages store it as blobs/ab/cd/<sha256>"""
+    return os.path.join('blobs', instance.sha256)
+
+class FileBlob(models.Model):
+    """Stored file content, shared by every UploadedFile with the same SHA-256"""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=blob_upload_to, storage=file_storage)
+    # Size of the content; with an encoding the stored file is smaller
+    size = models.BigIntegerField()
+    # Codec the content is stored compressed with (files.compression), '' when stored as is
+    encoding = models.CharField(max_length=10, blank=True, default='')
+    # Data key wrapped by FILE_ENCRYPTION_KEY (files.encryption), '' when stored in plaintext
+    encryption = models.CharField(max_length=255, blank=True, default='')
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'file_blobs'
+    
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+    
+    @classmethod
+    def acquire(cls, content, sha256, content_type=''):
+        """
+        Take a reference on the blob for `sha256`, storing `content` only when
+        no blob with that hash exists yet (compressed per `content_type`).
+        """
+        with transaction.atomic():
+            if cls.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') + 1):
+                return cls.objects.get(sha256=sha256)
+            
+            blob = cls(sha256=sha256, size=content.size, ref_count=1)
+            blob.store(content, content_type)
+            try:
+                with transaction.atomic():
+                    blob.save()
+            except IntegrityError:
+                # A concurrent upload of the same content won the race
+                blob.file.delete(save=False)
+                cls.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') + 1)
+                return cls.objects.get(sha256=sha256)
+            return blob
+    
+    def store(self, content, content_type=''):
+        """
+        Write `content` to storage, compressed when compress_for_storage finds
+        it worthwhile, then encrypted when FILE_ENCRYPTION_KEY is set
+        """
+        stored, self.encoding = compress_for_storage(content, content_type)
+        try:
+            sealed, self.encryption = encrypt_for_storage(stored)
+            self.file.save(self.sha256, sealed, save=False)
+        finally:
+            if stored is not content:
+                stored.close()
+    
+    @classmethod
+    def store_many(cls, contents, workers=1):
+        """
+        Write the content of (content, sha256, content_type) items that is not
+        stored yet, `workers` threads at a time. Nothing is recorded in the
+        database; pass the result to reference_many(). Returns
+        ({sha256: unsaved blob}, {sha256: exception}) for the content written
+        and the content that could not be.
+        """
+        existing = set(cls.objects.filter(
+            sha256__in={sha256 for _, sha256, _ in contents}
+        ).values_list('sha256', flat=True))
+        new_blobs = {}
+        for content, sha256, content_type in contents:
+            if sha256 not in existing and sha256 not in new_blobs:
+                new_blobs[sha256] = (cls(sha256=sha256, size=content.size, ref_count=0), content, content_type)
+        
+        def store(item):
+            blob, content, content_type = item
+            blob.store(content, content_type)
+            return blob
+        
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {sha256: pool.submit(store, item) for sha256, item in new_blobs.items()}
+        stored, failures = {}, {}
+        for sha256, future in futures.items():
+            if future.exception() is None:
+                stored[sha256] = future.result()
+            else:
+                failures[sha256] = future.exception()
+        return stored, failures
+    
+    @classmethod
+    def reference_many(cls, counts, stored):
+        """
+        Bulk acquire(): take `count` references per sha256 in {sha256: count},
+        inserting rows for the `stored` blobs from store_many() in a handful
+        of statements. Must run inside a transaction; returns {sha256: blob}.
+        """
+        # A concurrent upload may insert the same hash first; its row wins
+        cls.objects.bulk_create([stored[sha256] for sha256 in counts if sha256 in stored], ignore_conflicts=True)
+        by_count = {}
+        for sha256, count in counts.items():
+            by_count.setdefault(count, []).append(sha256)
+        for count, hashes in by_count.items():
+            cls.objects.filter(sha256__in=hashes).update(ref_count=models.F('ref_count') + count)
+        blobs = cls.objects.in_bulk(list(counts), field_name='sha256')
+        
+        storage = cls._meta.get_field('file').storage
+        for sha256 in counts:
+            if sha256 in stored and blobs[sha256].file.name != stored[sha256].file.name:
+                name = stored[sha256].file.name
+                transaction.on_commit(lambda name=name: storage.delete(name))
+        return blobs
+    
+    @classmethod
+    def release_many(cls, counts):
+        """
+        Bulk release(): drop `count` references per blob id in {blob_id: count}.
+        Blobs left unreferenced are deleted; their content is removed from
+        storage after commit. Returns the number of bytes freed.
+        """
+        by_count = {}
+        for blob_id, count in counts.items():
+            by_count.setdefault(count, []).append(blob_id)
+        with transaction.atomic():
+            for count, blob_ids in by_count.items():
+                cls.objects.filter(pk__in=blob_ids).update(ref_count=models.F('ref_count') - count)
+            return cls.delete_with_content(cls.objects.filter(pk__in=list(counts), ref_count__lte=0))
+    
+    @classmethod
+    def delete_with_content(cls, queryset):
+        """Delete the blobs in `queryset` and, after commit, their stored content; returns bytes freed"""
+        dead = list(queryset.values_list('pk', 'file', 'size'))
+        if not dead:
+            return 0
+        cls.objects.filter(pk__in=[pk for pk, _, _ in dead]).delete()
+        storage = cls._meta.get_field('file').storage
+        
+        def delete_content():
+            for _, name, _ in dead:
+                storage.delete(name)
+        
+        transaction.on_commit(delete_content)
+        return sum(size for _, _, size in dead)
+    
+    def release(self):
+        """Drop one reference and delete the stored content once nothing uses it"""
+        with transaction.atomic():
+            FileBlob.objects.filter(pk=self.pk).update(ref_count=models.F('ref_count') - 1)
+            deleted, _ = FileBlob.objects.filter(pk=self.pk, ref_count__lte=0).delete()
+            if deleted:
+                name, storage = self.file.name, self.file.storage
+                transaction.on_commit(lambda: storage.delete(name))
+
+class UploadedFileQuerySet(models.QuerySet):
+    def active(self):
+        return self.filter(is_active=True)
+    
+    def for_listing(self):
+        """Join everything the file serializers read, so rows cost no extra queries"""
+        return self.select_related('uploaded_by')
+    
+    def collection_version(self):
+        """
+        (version, last_modified) of these rows, for conditional requests.
+        
+        Read from the database so every worker process agrees: updated_at moves
+        on every save (soft deletes included) and the row count changes on
+        hard deletes.
+        """
+        return self._version(self.aggregate(**self._version_aggregates()))
+    
+    async def acollection_version(self):
+        return self._version(await self.aaggregate(**self._version_aggregates()))
+    
+    @staticmethod
+    def _version_aggregates():
+        return {'last_modified': models.Max('updated_at'), 'count': models.Count('pk')}
+    
+    @staticmethod
+    def _version(state):
+        last_modified = state['last_modified']
+        stamp = last_modified.timestamp() if last_modified else 0
+        return f"{state['count']}-{stamp}", last_modified
+
 class UploadedFile(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     name = models.CharField(max_length=255)
-    file = models.FileField(upload_to=upload_to)
+    file = models.FileField(upload_to=upload_to, storage=file_storage)
+    blob = models.ForeignKey(
+        FileBlob,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='uploads'
+    )
     file_type = models.CharField(max_length=100)
     file_size = models.BigIntegerField()
     uploaded_by = models.ForeignKey(
@@ -21,21 +221,169 @@ class UploadedFile(models.Model):
         related_name='uploaded_files'
     )
     uploaded_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
     is_active = models.BooleanField(default=True)
+    # Set on soft delete; the row and its content are purged after FILE_DELETED_RETENTION_DAYS
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    
+    objects = UploadedFileQuerySet.as_manager()
     
     class Meta:
         db_table = 'uploaded_files'
         ordering = ['-uploaded_at']
+        indexes = [
+            # list_files: active files, newest first, keyset on (uploaded_at, id)
+            models.Index(
+                fields=['-uploaded_at', '-id'],
+                name='uploaded_files_active_idx',
+                condition=models.Q(is_active=True)
+            ),
+            # delete_file and per-uploader listings
+            models.Index(
+                fields=['uploaded_by', 'is_active', '-uploaded_at'],
+                name='uploaded_files_owner_idx'
+            ),
+            # Collection version (Max(updated_at)) for list ETags
+            models.Index(fields=['updated_at'], name='uploaded_files_updated_idx'),
+            # Garbage collection of soft-deleted files
+            models.Index(
+                fields=['deleted_at'],
+                name='uploaded_files_deleted_idx',
+                condition=models.Q(is_active=False)
+            ),
+        ]
     
     def __str__(self):
         return f"{self.name} - {self.uploaded_by.email}"
     
-    def delete(self, *args, **kwargs):
-        # Delete the actual file when the model instance is deleted
-        if self.file:
-            if os.path.isfile(self.file.path):
-                os.remove(self.file.path)
-        super().delete(*args, **kwargs)
+    def release_content(self):
+        """
+        Drop this row's hold on its content once the row is deleted; sent from
+        post_delete, so queryset deletes and cascades release it too.
+        """
+        if self.blob_id:
+            FileBlob.release_many({self.blob_id: 1})
+        elif self.file:
+            # Legacy rows own their file; remove it only once the delete is committed
+            name, storage = self.file.name, self.file.storage
+            transaction.on_commit(lambda: storage.delete(name))
+    
+    @property
+    def content_encoding(self):
+        """Encoding the content is stored with ('' for as uploaded); legacy rows are never compressed"""
+        return self.blob.encoding if self.blob_id else ''
+    
+    @cached_property
+    def content_cipher(self):
+        """files.encryption.SegmentCipher of encrypted content, else None; legacy rows are never encrypted"""
+        return file_cipher(self.blob.encryption) if self.blob_id else None
+    
+    def soft_delete(self):
+        """Hide the file; the garbage collector purges it after the retention window"""
+        self.is_active = False
+        self.deleted_at = timezone.now()
+        self.save(update_fields=['is_active', 'deleted_at', 'updated_at'])
+    
+    @classmethod
+    def create_from_content(cls, content, sha256, **fields):
+        """Create a row backed by the deduplicated blob for `content`"""
+        with transaction.atomic():
+            blob = FileBlob.acquire(content, sha256, fields.get('file_type', ''))
+            return cls.objects.create(file=blob.file.name, blob=blob, **fields)
+    
+    @classmethod
+    def bulk_create_from_contents(cls, items, workers=1):
+        """
+        Create rows for (content, sha256, fields) items with one bulk INSERT,
+        storing new content in parallel. Model signals are not sent.
+        
+        Returns one entry per item, in order: the new row, or the exception
+        that kept it from being created. Content that fails to store fails
+        only its own items; when the INSERT fails, the items are retried one
+        at a time, each in its own savepoint.
+        """
+        stored, failures = FileBlob.store_many(
+            [(content, sha256, fields.get('file_type', '')) for content, sha256, fields in items],
+            workers=workers
+        )
+        results = [failures.get(sha256) for _, sha256, _ in items]
+        pending = [index for index, result in enumerate(results) if result is None]
+        
+        def create(indexes):
+            with transaction.atomic():
+                blobs = FileBlob.reference_many(Counter(items[index][1] for index in indexes), stored)
+                return cls.objects.bulk_create([
+                    cls(file=blobs[sha256].file.name, blob=blobs[sha256], **fields)
+                    for _, sha256, fields in (items[index] for index in indexes)
+                ])
+        
+        try:
+            try:
+                rows = create(pending) if pending else []
+            except Exception:
+                rows = []
+                for index in pending:
+                    try:
+                        rows.extend(create([index]))
+                    except Exception as e:
+                        rows.append(e)
+            for index, row in zip(pending, rows):
+                results[index] = row
+        finally:
+            # Content written for items that all failed belongs to no blob row
+            used = {sha256 for (_, sha256, _), result in zip(items, results) if isinstance(result, cls)}
+            for sha256, blob in stored.items():
+                if sha256 not in used:
+                    blob.file.storage.delete(blob.file.name)
+        return results
+
+class DocumentMetadata(models.Model):
+    """Properties extracted from an upload; its body text lives in the search index (files.search)"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('indexed', 'Indexed'),
+        ('failed', 'Failed'),
+    ]
+    
+    upload = models.OneToOneField(
+        UploadedFile,
+        on_delete=models.CASCADE,
+        related_name='metadata'
+    )
+    title = models.CharField(max_length=255, blank=True)
+    author = models.CharField(max_length=255, blank=True)
+    # Pages, slides or sheets, depending on the document type
+    page_count = models.PositiveIntegerField(null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.CharField(max_length=255, blank=True)
+    indexed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'document_metadata'
+    
+    def __str__(self):
+        return f"Metadata for {self.upload_id} ({self.status})"
+
+class DownloadLinkQuerySet(models.QuerySet):
+    def get_by_token(self, token, **filters):
+        """
+        The link for `token`. Rows created before token_key existed are found
+        by their token once, and get their key filled in on the way.
+        """
+        try:
+            return self.get(token_key=DownloadLink.lookup_key(token), **filters)
+        except DownloadLink.DoesNotExist:
+            link = self.get(token_key__isnull=True, encrypted_token=token, **filters)
+            link.backfill_token_key()
+            return link
+    
+    async def aget_by_token(self, token, **filters):
+        try:
+            return await self.aget(token_key=DownloadLink.lookup_key(token), **filters)
+        except DownloadLink.DoesNotExist:
+            link = await self.aget(token_key__isnull=True, encrypted_token=token, **filters)
+            await sync_to_async(link.backfill_token_key)()
+            return link
 
 class DownloadLink(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -45,15 +393,197 @@ class DownloadLink(models.Model):
         on_delete=models.CASCADE,
         related_name='download_links'
     )
-    encrypted_token = models.CharField(max_length=500, unique=True)
+    encrypted_token = models.CharField(max_length=500)
+    # Fixed-length digest of encrypted_token; the indexed lookup key. NULL only
+    # on rows created before the column existed, until backfill_token_keys runs
+    token_key = models.CharField(max_length=64, unique=True, null=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
     is_used = models.BooleanField(default=False)
     used_at = models.DateTimeField(null=True, blank=True)
+    bytes_served = models.BigIntegerField(default=0)
+    # Merged inclusive [start, end] byte ranges delivered so far; bytes_served is their length
+    served_ranges = models.JSONField(default=list, blank=True)
+    # Links issued together by the batch endpoint; a ZIP link covers the batch
+    batch_id = models.UUIDField(null=True, blank=True, editable=False, db_index=True)
+    
+    objects = DownloadLinkQuerySet.as_manager()
     
     class Meta:
         db_table = 'download_links'
         ordering = ['-created_at']
+        indexes = [
+            # Garbage collection of expired and consumed links
+            models.Index(fields=['expires_at'], name='download_links_expires_idx'),
+            models.Index(
+                fields=['used_at'],
+                name='download_links_used_idx',
+                condition=models.Q(is_used=True)
+            ),
+        ]
+    
+    def __str__(self):
+        return f"Download link for {self.file.name} - {self.user.email}"
+    
+    @staticmethod
+    def lookup_key(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+    
+    def save(self, *args, **kwargs):
+        if not self.token_key:
+            self.token_key = self.lookup_key(self.encrypted_token)
+        super().save(*args, **kwargs)
+    
+    def backfill_token_key(self):
+        self.token_key = self.lookup_key(self.encrypted_token)
+        DownloadLink.objects.filter(pk=self.pk, token_key__isnull=True).update(token_key=self.token_key)
+    
+    # Set by claim(): this instance's request holds the link
+    claimed = False
+    
+    def completes(self, ranges, file_size):
+        """Whether serving `ranges` (None: the whole file) would deliver the last missing bytes"""
+        requested = ranges or [(0, file_size - 1)]
+        return ranges_length(list(self.served_ranges) + list(requested)) >= file_size
+    
+    def claim(self):
+        """
+        Mark the link used before a transfer that completes it. The conditional
+        UPDATE lets exactly one of several concurrent requests through.
+        """
+        now = timezone.now()
+        if not DownloadLink.objects.filter(pk=self.pk, is_used=False).update(is_used=True, used_at=now):
+            return False
+        self.is_used, self.used_at, self.claimed = True, now, True
+        return True
+    
+    def record_served(self, ranges, file_size):
+        """
+        Merge delivered inclusive (start, end) byte `ranges` into the link and
+        consume it once they cover the file. A claim whose transfer was cut
+        short is given back, so the client can resume with Range.
+        """
+        if not ranges and not self.claimed:
+            return
+        with transaction.atomic():
+            # Write first to lock the row: SQLite cannot upgrade a read lock
+            # while another connection writes, and select_for_update is a no-op there
+            if not DownloadLink.objects.filter(pk=self.pk).update(bytes_served=models.F('bytes_served')):
+                return
+            link = DownloadLink.objects.only('is_used', 'served_ranges').get(pk=self.pk)
+            served = merge_ranges(list(link.served_ranges) + list(ranges))
+            fields = {'served_ranges': served, 'bytes_served': ranges_length(served)}
+            if fields['bytes_served'] >= file_size:
+                if not link.is_used:
+                    fields.update(is_used=True, used_at=timezone.now())
+            elif self.claimed:
+                fields.update(is_used=False, used_at=None)
+            DownloadLink.objects.filter(pk=self.pk).update(**fields)
+        self.claimed = False
+
+class DownloadBatch(models.Model):
+    """
+    The ZIP grant of a batch of download links. It is claimed and consumed as
+    one unit, independently of the batch's per-file links.
+    """
+    # The batch_id of its DownloadLink rows
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='download_batches'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    is_used = models.BooleanField(default=False)
+    used_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        db_table = 'download_batches'
+        ordering = ['-created_at']
+        indexes = [
+            # Garbage collection of expired and consumed grants
+            models.Index(fields=['expires_at'], name='download_batches_expires_idx'),
+        ]
     
     def __str__(self):
-        return f"Download link for {self.file.name} - {self.user.email}"
\ No newline at end of file
+        return f"ZIP download for {self.user.email}"
+    
+    def claim(self):
+        """
+        Mark the grant used before streaming the archive. The conditional
+        UPDATE lets exactly one of several concurrent requests through.
+        """
+        now = timezone.now()
+        if not DownloadBatch.objects.filter(pk=self.pk, is_used=False).update(is_used=True, used_at=now):
+            return False
+        self.is_used, self.used_at = True, now
+        return True
+    
+    def finish(self, complete):
+        """Keep the claim once the whole archive was sent; give it back otherwise"""
+        if not complete:
+            DownloadBatch.objects.filter(pk=self.pk).update(is_used=False, used_at=None)
+            self.is_used, self.used_at = False, None
+
+class UploadSession(models.Model):
+    """Resumable upload: numbered chunks are appended to a temp file on disk"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions'
+    )
+    file_name = models.CharField(max_length=255)
+    file_type = models.CharField(max_length=100)
+    total_size = models.BigIntegerField()
+    chunk_size = models.IntegerField()
+    received_bytes = models.BigIntegerField(default=0)
+    next_chunk = models.IntegerField(default=0)
+    # The PUT writing next_chunk; see upload_chunk
+    chunk_lease = models.CharField(max_length=32, blank=True, default='')
+    chunk_lease_expires_at = models.DateTimeField(null=True, blank=True)
+    # Kept apart from uploaded_file, which is cleared when that file is deleted
+    is_finalized = models.BooleanField(default=False)
+    uploaded_file = models.OneToOneField(
+        UploadedFile,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='upload_session'
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+    
+    class Meta:
+        db_table = 'upload_sessions'
+        ordering = ['-created_at']
+    
+    def __str__(self):
+        return f"Upload session for {self.file_name} ({self.received_bytes}/{self.total_size})"
+    
+    @property
+    def temp_path(self):
+        return os.path.join(settings.FILE_UPLOAD_SESSION_DIR, f"{self.id}.part")
+    
+    @property
+    def is_complete(self):
+        return self.received_bytes == self.total_size
+    
+    def delete(self, *args, **kwargs):
+        # Reclaim the temp space along with the session
+        if os.path.isfile(self.temp_path):
+            os.remove(self.temp_path)
+        super().delete(*args, **kwargs)
+    
+    @classmethod
+    def purge_expired(cls, limit=None):
+        """Delete expired sessions and their temp files, returning the number removed"""
+        expired = cls.objects.filter(expires_at__lt=timezone.now())
+        if limit is not None:
+            expired = expired[:limit]
+        count = 0
+        for session in expired:
+            session.delete()
+            count += 1
+        return count
@@ -0,0 +1,189 @@
+import heapq
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .audit import get_audit_writer
+from .utils import merge_ranges, ranges_length
+
+class InMemoryNonceStore:
+    """
+    Process-local served ranges and used flags keyed by token nonce, evicted
+    after their TTL.
+    
+    Only suitable for a single worker process; use CacheNonceStore with a
+    shared cache when running several workers.
+    """
+    shared = False
+    
+    def __init__(self):
+        self._served = {}
+        self._used = set()
+        self._expiry = []
+        self._lock = threading.Lock()
+    
+    def _evict(self, now):
+        while self._expiry and self._expiry[0][0] <= now:
+            _, nonce = heapq.heappop(self._expiry)
+            self._served.pop(nonce, None)
+            self._used.discard(nonce)
+    
+    def _track(self, nonce, ttl):
+        now = time.monotonic()
+        self._evict(now)
+        if nonce not in self._served:
+            heapq.heappush(self._expiry, (now + ttl, nonce))
+            self._served[nonce] = []
+    
+    def served(self, nonce):
+        with self._lock:
+            self._evict(time.monotonic())
+            return self._served.get(nonce, [])
+    
+    def add(self, nonce, ranges, ttl):
+        with self._lock:
+            self._track(nonce, ttl)
+            self._served[nonce] = merge_ranges(self._served[nonce] + list(ranges))
+            return self._served[nonce]
+    
+    def is_used(self, nonce):
+        with self._lock:
+            self._evict(time.monotonic())
+            return nonce in self._used
+    
+    def claim(self, nonce, ttl):
+        with self._lock:
+            self._track(nonce, ttl)
+            if nonce in self._used:
+                return False
+            self._used.add(nonce)
+            return True
+    
+    def release(self, nonce):
+        with self._lock:
+            self._used.discard(nonce)
+
+class CacheNonceStore:
+    """
+    Served ranges and used flags in a Django cache (Redis or Memcached shared
+    by all workers).
+    
+    The used flag is taken with cache.add, which is atomic. Merging ranges is
+    a read-modify-write: a lost race under-counts, which only keeps the link
+    open until a later request completes it.
+    """
+    key_prefix = 'download-nonce:'
+    used_prefix = 'download-nonce-used:'
+    
+    def __init__(self):
+        self.cache = caches[settings.DOWNLOAD_NONCE_CACHE]
+    
+    @property
+    def shared(self):
+        return not isinstance(self.cache, LocMemCache)
+    
+    def served(self, nonce):
+        return self.cache.get(self.key_prefix + nonce, [])
+    
+    def add(self, nonce, ranges, ttl):
+        key = self.key_prefix + nonce
+        served = merge_ranges(self.cache.get(key, []) + list(ranges))
+        self.cache.set(key, served, timeout=max(int(ttl), 1))
+        return served
+    
+    def is_used(self, nonce):
+        return self.cache.get(self.used_prefix + nonce, False)
+    
+    def claim(self, nonce, ttl):
+        return self.cache.add(self.used_prefix + nonce, True, timeout=max(int(ttl), 1))
+    
+    def release(self, nonce):
+        self.cache.delete(self.used_prefix + nonce)
+
+@lru_cache(maxsize=None)
+def get_nonce_store():
+    """
+    Return the configured nonce store instance.
+    
+    A store private to this process would let each worker serve a one-time
+    link once, so it is refused unless DOWNLOAD_NONCE_SINGLE_PROCESS is set.
+    """
+    store = import_string(settings.DOWNLOAD_NONCE_STORE)()
+    if not getattr(store, 'shared', True) and not settings.DOWNLOAD_NONCE_SINGLE_PROCESS:
+        raise ImproperlyConfigured(
+            'Stateless download links need a nonce store shared by all workers: set '
+            'DOWNLOAD_NONCE_CACHE_BACKEND to a Redis or Memcached cache, or set '
+            'DOWNLOAD_NONCE_SINGLE_PROCESS=True when one process serves downloads.'
+        )
+    return store
+
+@receiver(setting_changed)
+def _reset_nonce_store(setting, **kwargs):
+    if setting in ('DOWNLOAD_NONCE_STORE', 'DOWNLOAD_NONCE_CACHE', 'DOWNLOAD_NONCE_SINGLE_PROCESS', 'CACHES'):
+        get_nonce_store.cache_clear()
+
+class StatelessDownloadLink:
+    """
+    Stand-in for a DownloadLink row when the token itself carries the grant.
+    
+    Delivered byte ranges and the used flag are kept against the token nonce
+    in the nonce store, so one-time use and resumable downloads work without
+    touching the database; consumption is audited asynchronously.
+    """
+    # Set by claim(): this instance's request holds the link
+    claimed = False
+    
+    def __init__(self, token, file, expires_at, nonce, size=None):
+        self.token = token
+        self.file = file
+        self.expires_at = expires_at
+        self.nonce = nonce
+        # ZIP grants cover several files and pass their combined size
+        self.size = file.file_size if size is None else size
+    
+    @property
+    def ttl(self):
+        return max((self.expires_at - timezone.now()).total_seconds(), 1)
+    
+    @property
+    def is_used(self):
+        return get_nonce_store().is_used(self.nonce)
+    
+    @property
+    def served_ranges(self):
+        return get_nonce_store().served(self.nonce)
+    
+    def completes(self, ranges, file_size):
+        requested = ranges or [(0, file_size - 1)]
+        return ranges_length(self.served_ranges + list(requested)) >= file_size
+    
+    def claim(self):
+        self.claimed = get_nonce_store().claim(self.nonce, self.ttl)
+        return self.claimed
+    
+    def finish(self, complete):
+        """Consume a claimed grant once its whole transfer was sent; give the claim back otherwise"""
+        self.record_served([(0, self.size - 1)] if complete else [], self.size)
+    
+    def record_served(self, ranges, file_size):
+        if not ranges and not self.claimed:
+            return
+        from .models import DownloadLink
+        
+        store = get_nonce_store()
+        served = store.add(self.nonce, ranges, self.ttl) if ranges else store.served(self.nonce)
+        if ranges_length(served) >= file_size:
+            if self.claimed or store.claim(self.nonce, self.ttl):
+                get_audit_writer().record_consumed(DownloadLink.lookup_key(self.token))
+        elif self.claimed:
+            store.release(self.nonce)
+        self.claimed = False
@@ -0,0 +1,267 @@
+import re
+import struct
+import zipfile
+import zlib
+
+# Main part content type declared in [Content_Types].xml -> upload MIME type
+OOXML_DOCUMENT_TYPES = {
+    'application/vnd.openxmlformats-officedocument.presentationml.presentation.main+xml':
+        'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml':
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml':
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+CONTENT_TYPES_PART = '[Content_Types].xml'
+
+LOCAL_HEADER = struct.Struct('<4sHHHHHIIIHH')
+LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+ZIP64_EXTRA_ID = 0x0001
+FLAG_ENCRYPTED = 0x1
+FLAG_DESCRIPTOR = 0x8
+FLAG_UTF8 = 0x800
+STORED, DEFLATED = 0, 8
+
+# [Content_Types].xml is a few KB; anything far larger is not an Office document
+MAX_CONTENT_TYPES_SIZE = 1024 * 1024
+# Bound on bytes inflated while skipping entries of unknown size (zip bombs)
+MAX_INFLATE_RATIO = 32
+
+CONTENT_TYPE_ATTR = re.compile(rb'ContentType\s*=\s*"([^"]+)"')
+
+class NotOOXML(ValueError):
+    """The stream is not a PPTX/DOCX/XLSX package"""
+
+class _Entry:
+    def __init__(self, name, method, size, descriptor, zip64, collect):
+        self.name = name
+        self.method = method
+        # Compressed bytes left, or None when only a data descriptor records it
+        self.remaining = size
+        self.descriptor = descriptor
+        self.zip64 = zip64
+        self.collect = collect
+        self.data = bytearray()
+        self.inflater = zlib.decompressobj(-zlib.MAX_WBITS) if method == DEFLATED else None
+
+class OOXMLSniffer:
+    """
+    Identify an OOXML package from the front of its byte stream.
+    
+    Chunks are fed as they arrive. Local ZIP headers are walked (skipping
+    entry data without buffering it) until [Content_Types].xml has been read,
+    and `document_type` is then set to the upload MIME type its main part
+    declares. NotOOXML is raised as soon as the stream cannot be one. When
+    `limit` bytes pass without an answer the sniffer gives up instead: it sets
+    `gave_up`, ignores the rest of the stream, and the complete file is left
+    to read_ooxml_type().
+    """
+    
+    def __init__(self, limit):
+        self.limit = limit
+        self.received = 0
+        self.inflated = 0
+        self.document_type = None
+        self.gave_up = False
+        self._buffer = bytearray()
+        self._entry = None
+        self._descriptor = None
+    
+    def feed(self, data):
+        if self.document_type or self.gave_up:
+            return self.document_type
+        self.received += len(data)
+        self._buffer += data
+        while self.document_type is None and not self.gave_up and self._step():
+            pass
+        if self.document_type is None and self.received >= self.limit:
+            self._give_up()
+        return self.document_type
+    
+    def close(self):
+        """Call at end of stream; raises unless the type was identified or the sniffer gave up (then None)"""
+        if self.document_type is None and not self.gave_up:
+            raise NotOOXML('File ended before its document type could be identified.')
+        return self.document_type
+    
+    def _give_up(self):
+        self.gave_up = True
+        self._buffer.clear()
+        self._entry = self._descriptor = None
+    
+    def _step(self):
+        if self._descriptor is not None:
+            return self._skip_descriptor()
+        if self._entry is None:
+            return self._read_header()
+        return self._read_data()
+    
+    def _read_header(self):
+        if len(self._buffer) < LOCAL_HEADER.size:
+            return False
+        (signature, _, flags, method, _, _, _, compressed_size, _,
+         name_length, extra_length) = LOCAL_HEADER.unpack_from(self._buffer)
+        if signature != LOCAL_HEADER_SIGNATURE:
+            # Past the last entry (central directory) or not a ZIP at all
+            raise NotOOXML(f'Not an Office document: no {CONTENT_TYPES_PART} entry.')
+        header_length = LOCAL_HEADER.size + name_length + extra_length
+        if len(self._buffer) < header_length:
+            return False
+        
+        raw_name = bytes(self._buffer[LOCAL_HEADER.size:LOCAL_HEADER.size + name_length])
+        name = raw_name.decode('utf-8' if flags & FLAG_UTF8 else 'cp437', errors='replace')
+        extra = bytes(self._buffer[LOCAL_HEADER.size + name_length:header_length])
+        if flags & FLAG_ENCRYPTED:
+            raise NotOOXML('Encrypted documents are not accepted.')
+        if method not in (STORED, DEFLATED):
+            raise NotOOXML('Unsupported ZIP compression method.')
+        
+        size_known = not (flags & FLAG_DESCRIPTOR) or compressed_size
+        if not size_known and method == STORED:
+            raise NotOOXML('Unsupported ZIP layout.')
+        self._entry = _Entry(
+            name,
+            method,
+            compressed_size if size_known else None,
+            descriptor=bool(flags & FLAG_DESCRIPTOR),
+            zip64=_has_zip64_extra(extra),
+            collect=name == CONTENT_TYPES_PART
+        )
+        del self._buffer[:header_length]
+        return True
+    
+    def _read_data(self):
+        entry = self._entry
+        if not self._buffer:
+            return False
+        
+        if entry.remaining is not None:
+            take = min(entry.remaining, len(self._buffer))
+            data = bytes(self._buffer[:take])
+            del self._buffer[:take]
+            entry.remaining -= take
+            if entry.collect:
+                self._collect(entry, data)
+                if self.gave_up:
+                    return False
+            finished = entry.remaining == 0
+        else:
+            # Size unknown until the deflate stream ends
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            self._inflate(entry, data)
+            if self.gave_up:
+                return False
+            finished = entry.inflater.eof
+            if finished:
+                self._buffer[:0] = entry.inflater.unused_data
+        
+        if finished:
+            self._entry = None
+            if entry.collect:
+                self._identify(entry)
+            elif entry.descriptor:
+                self._descriptor = entry
+        return True
+    
+    def _collect(self, entry, data):
+        if entry.method == STORED:
+            entry.data += data
+        else:
+            self._inflate(entry, data)
+        if len(entry.data) > MAX_CONTENT_TYPES_SIZE:
+            raise NotOOXML(f'{CONTENT_TYPES_PART} is too large.')
+    
+    def _inflate(self, entry, data):
+        try:
+            out = entry.inflater.decompress(data, MAX_CONTENT_TYPES_SIZE)
+            while True:
+                self.inflated += len(out)
+                if entry.collect:
+                    entry.data += out
+                    if len(entry.data) > MAX_CONTENT_TYPES_SIZE:
+                        raise NotOOXML(f'{CONTENT_TYPES_PART} is too large.')
+                if self.inflated > MAX_INFLATE_RATIO * self.limit:
+                    # Not necessarily a zip bomb; the central directory can still tell
+                    self._give_up()
+                    return
+                if not entry.inflater.unconsumed_tail or entry.inflater.eof:
+                    break
+                out = entry.inflater.decompress(entry.inflater.unconsumed_tail, MAX_CONTENT_TYPES_SIZE)
+        except zlib.error:
+            raise NotOOXML('Corrupt ZIP data.')
+    
+    def _skip_descriptor(self):
+        size_field = 8 if self._descriptor.zip64 else 4
+        if len(self._buffer) < 4:
+            return False
+        length = (4 if self._buffer[:4] == DESCRIPTOR_SIGNATURE else 0) + 4 + 2 * size_field
+        if len(self._buffer) < length:
+            return False
+        del self._buffer[:length]
+        self._descriptor = None
+        return True
+    
+    def _identify(self, entry):
+        self.document_type = _document_type(entry.data)
+
+def _document_type(content_types):
+    """The upload MIME type declared by the bytes of [Content_Types].xml"""
+    declared = {match.decode('ascii', 'replace') for match in CONTENT_TYPE_ATTR.findall(content_types)}
+    found = {OOXML_DOCUMENT_TYPES[content_type] for content_type in declared & OOXML_DOCUMENT_TYPES.keys()}
+    if len(found) != 1:
+        raise NotOOXML('Not a PPTX, DOCX or XLSX document.')
+    return found.pop()
+
+def _has_zip64_extra(extra):
+    offset = 0
+    while offset + 4 <= len(extra):
+        header_id, length = struct.unpack_from('<HH', extra, offset)
+        if header_id == ZIP64_EXTRA_ID:
+            return True
+        offset += 4 + length
+    return False
+
+def read_ooxml_type(fileobj):
+    """
+    Identify a complete, seekable file's OOXML type through its ZIP central
+    directory, wherever [Content_Types].xml is stored; leaves the position at 0
+    """
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            info = archive.getinfo(CONTENT_TYPES_PART)
+            if info.flag_bits & FLAG_ENCRYPTED:
+                raise NotOOXML('Encrypted documents are not accepted.')
+            if info.compress_type not in (STORED, DEFLATED):
+                raise NotOOXML('Unsupported ZIP compression method.')
+            with archive.open(info) as part:
+                # The recorded size may lie; never inflate past the cap
+                content_types = part.read(MAX_CONTENT_TYPES_SIZE + 1)
+    except KeyError:
+        raise NotOOXML(f'Not an Office document: no {CONTENT_TYPES_PART} entry.')
+    except (zipfile.BadZipFile, zlib.error, EOFError):
+        raise NotOOXML('Corrupt ZIP data.')
+    finally:
+        fileobj.seek(0)
+    if len(content_types) > MAX_CONTENT_TYPES_SIZE:
+        raise NotOOXML(f'{CONTENT_TYPES_PART} is too large.')
+    return _document_type(content_types)
+
+def sniff_ooxml(fileobj, limit, block_size=64 * 1024):
+    """
+    Identify a seekable file's OOXML type from its first `limit` bytes, or
+    failing that from its central directory; leaves the position at 0
+    """
+    sniffer = OOXMLSniffer(limit)
+    try:
+        fileobj.seek(0)
+        while not (sniffer.document_type or sniffer.gave_up):
+            block = fileobj.read(block_size)
+            if not block:
+                return sniffer.close()
+            sniffer.feed(block)
+    finally:
+        fileobj.seek(0)
+    return sniffer.document_type or read_ooxml_type(fileobj)
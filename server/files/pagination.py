@@ -0,0 +1,83 @@
+import base64
+import uuid
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import BasePagination
+from rest_framework.utils.urls import replace_query_param
+
+class FileCursorPagination(BasePagination):
+    """
+    Keyset pagination over (uploaded_at, id), newest first.
+    
+    Each page is a single query that seeks past the last row of the previous
+    page instead of counting or offsetting, so deep pages cost the same as the
+    first one.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    max_page_size = 100
+    
+    def paginate_queryset(self, queryset, request, view=None):
+        rows = list(self.page_queryset(queryset, request))
+        return self.set_page(rows)
+    
+    async def apaginate_queryset(self, queryset, request):
+        """paginate_queryset for async views, using async ORM iteration"""
+        rows = [row async for row in self.page_queryset(queryset, request)]
+        return self.set_page(rows)
+    
+    def page_queryset(self, queryset, request):
+        self.request = request
+        params = getattr(request, 'query_params', request.GET)
+        self.page_size = self.get_page_size(params)
+        
+        cursor = params.get(self.cursor_query_param)
+        if cursor:
+            uploaded_at, file_id = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=file_id)
+            )
+        
+        # Fetch one extra row to learn whether another page exists
+        return queryset.order_by('-uploaded_at', '-id')[:self.page_size + 1]
+    
+    def set_page(self, rows):
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+    
+    def get_page_size(self, params):
+        try:
+            page_size = int(params.get(self.page_size_query_param, settings.REST_FRAMEWORK['PAGE_SIZE']))
+        except ValueError:
+            raise ValidationError({self.page_size_query_param: 'Must be an integer.'})
+        return max(1, min(page_size, self.max_page_size))
+    
+    def encode_cursor(self, instance):
+        raw = f"{instance.uploaded_at.isoformat()}|{instance.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+    
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+            uploaded_at, file_id = raw.split('|')
+            uploaded_at = parse_datetime(uploaded_at)
+            if uploaded_at is None:
+                raise ValueError
+            return uploaded_at, uuid.UUID(file_id)
+        except (ValueError, UnicodeDecodeError):
+            raise ValidationError({self.cursor_query_param: 'Invalid cursor.'})
+    
+    def get_next_cursor(self):
+        if not self.has_next:
+            return None
+        return self.encode_cursor(self.page[-1])
+    
+    def get_next_link(self):
+        cursor = self.get_next_cursor()
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
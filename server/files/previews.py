@@ -0,0 +1,201 @@
+"""
+Size-bounded on-disk cache of rendered previews (see files.rendering).
+
+Previews are keyed by content hash, so deduplicated uploads share one copy,
+and by PREVIEW_VERSION, so a renderer change never serves stale images.
+Previews of encrypted content are never written in plaintext: they are
+rendered in a temporary directory and cached sealed (see PreviewCache).
+"""
+import io
+import os
+import tempfile
+import threading
+from functools import lru_cache
+from pathlib import Path
+
+from cryptography.exceptions import InvalidTag
+from cryptography.fernet import InvalidToken
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from secure_file_sharing.crypto import wrap_file_key
+from .encryption import SegmentCipher
+from .rendering import render_preview
+from .storage import file_cipher, local_copy
+
+PREVIEW_VERSION = 1
+PREVIEW_KINDS = ('png', 'html')
+
+# Eviction trims the cache to this share of its bound, so it does not run on every write
+EVICT_TO = 0.9
+
+def preview_key(file_obj):
+    """Content hash of the file; legacy rows without a blob fall back to their id"""
+    return file_obj.blob.sha256 if file_obj.blob_id else f'file-{file_obj.pk.hex}'
+
+class PreviewCache:
+    """
+    LRU cache of preview files under FILE_PREVIEW_CACHE_DIR.
+    
+    Reads bump a file's mtime. Once the directory holds more than
+    FILE_PREVIEW_CACHE_MAX_BYTES, the least recently used files are deleted
+    until it is back under 90% of the bound, leaving files still being written
+    (`*.tmp`) alone. The size is tracked per process
+    and re-measured on every eviction, so several workers can share the cache.
+    
+    Previews of encrypted content are stored as `.sealed` files: a data key
+    of their own, wrapped by FILE_ENCRYPTION_KEY like blob keys, on the first
+    line and the preview encrypted under it (files.encryption) after it. They
+    are decrypted into memory when read.
+    """
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+    
+    def path(self, key, kind, sealed=False):
+        suffix = '.sealed' if sealed else ''
+        return self.directory / key[:2] / f'{key}-v{PREVIEW_VERSION}.{kind}{suffix}'
+    
+    def has(self, key):
+        return all(self.path(key, kind).exists() for kind in PREVIEW_KINDS)
+    
+    def discard(self, key):
+        """Remove the plaintext previews of `key`, e.g. once its content is encrypted"""
+        for kind in PREVIEW_KINDS:
+            try:
+                os.remove(self.path(key, kind))
+            except FileNotFoundError:
+                pass
+    
+    def added(self, nbytes):
+        """Record `nbytes` written to the cache and evict if it is over its bound"""
+        with self._lock:
+            if self._size is None:
+                # The first measurement already includes `nbytes`
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += nbytes
+            if self._size > self.max_bytes:
+                self._size = self._evict()
+    
+    def _entries(self):
+        for directory, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_mtime, stat.st_size
+    
+    def _evict(self):
+        # .tmp files are previews another worker is still writing (see _seal);
+        # they are counted once renamed into place
+        entries = sorted(
+            (entry for entry in self._entries() if not entry[0].endswith('.tmp')),
+            key=lambda entry: entry[1]
+        )
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_bytes * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        return total
+    
+    def fetch(self, file_obj, kind):
+        """
+        Open the `kind` preview of `file_obj`, rendering it on a miss (evicted,
+        or not rendered yet). Returns (binary file, key); raises ExtractionError
+        when the document cannot be previewed.
+        """
+        key = preview_key(file_obj)
+        cipher = file_obj.content_cipher
+        if cipher is not None:
+            return self._fetch_sealed(file_obj, key, kind, cipher), key
+        path = self.path(key, kind)
+        try:
+            # A read counts as a use for LRU
+            os.utime(path)
+            return open(path, 'rb'), key
+        except FileNotFoundError:
+            pass
+        with local_copy(file_obj.file, file_obj.content_encoding, cipher) as source:
+            written = render_preview(
+                source,
+                file_obj.file_type,
+                str(self.path(key, 'png')),
+                str(self.path(key, 'html')),
+                settings.FILE_PREVIEW_SIZE,
+                settings.FILE_INDEX_MAX_XML_BYTES
+            )
+        # Opened before accounting, so an eviction cannot pull it away
+        preview = open(path, 'rb')
+        self.added(written)
+        return preview, key
+    
+    def _fetch_sealed(self, file_obj, key, kind, cipher):
+        path = self.path(key, kind, sealed=True)
+        try:
+            os.utime(path)
+            with open(path, 'rb') as f:
+                return io.BytesIO(self._unseal(f))
+        except FileNotFoundError:
+            pass
+        except (InvalidToken, InvalidTag, ValueError):
+            # Wrapped by a key that has since been dropped, or damaged; render again
+            pass
+        with tempfile.TemporaryDirectory(prefix='preview-') as directory:
+            rendered = {kind: os.path.join(directory, f'preview.{kind}') for kind in PREVIEW_KINDS}
+            with local_copy(file_obj.file, file_obj.content_encoding, cipher) as source:
+                render_preview(
+                    source,
+                    file_obj.file_type,
+                    rendered['png'],
+                    rendered['html'],
+                    settings.FILE_PREVIEW_SIZE,
+                    settings.FILE_INDEX_MAX_XML_BYTES
+                )
+            written = sum(self._seal(rendered[name], self.path(key, name, sealed=True)) for name in PREVIEW_KINDS)
+            with open(rendered[kind], 'rb') as f:
+                preview = io.BytesIO(f.read())
+        self.added(written)
+        return preview
+    
+    @staticmethod
+    def _seal(source, target):
+        """Encrypt the file at `source` into `target` under a new data key; returns bytes written"""
+        cipher = SegmentCipher.generate(settings.FILE_ENCRYPTION_SEGMENT_SIZE)
+        os.makedirs(target.parent, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=target.parent, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as out, open(source, 'rb') as f:
+                out.write(wrap_file_key(cipher.to_bytes()).encode('ascii') + b'\n')
+                for segment in cipher.encrypt_chunks(iter(lambda: f.read(cipher.segment_size), b'')):
+                    out.write(segment)
+            os.replace(temp_path, target)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return os.path.getsize(target)
+    
+    @staticmethod
+    def _unseal(f):
+        cipher = file_cipher(f.readline().rstrip(b'\n').decode('ascii'))
+        return b''.join(cipher.decrypt_chunks(iter(lambda: f.read(cipher.sealed_size), b'')))
+
+@lru_cache(maxsize=None)
+def get_preview_cache():
+    return PreviewCache(settings.FILE_PREVIEW_CACHE_DIR, settings.FILE_PREVIEW_CACHE_MAX_BYTES)
+
+@receiver(setting_changed)
+def _reset_preview_cache(setting, **kwargs):
+    if setting in ('FILE_PREVIEW_CACHE_DIR', 'FILE_PREVIEW_CACHE_MAX_BYTES'):
+        get_preview_cache.cache_clear()
@@ -0,0 +1,204 @@
+"""
+Thumbnail and HTML previews of the first page, slide or sheet of a document.
+
+Like files.extraction this needs no Django setup, so previews are rendered
+in the indexing worker processes. Rasterizing the actual page layout would
+need an office suite; the thumbnail is the preview picture Office embeds in
+the package (docProps/thumbnail.*) or, failing that, a card showing the
+document type, title and opening text.
+"""
+import html
+import os
+import re
+import tempfile
+import textwrap
+import warnings
+import zipfile
+from xml.etree.ElementTree import ParseError
+
+from PIL import Image, ImageDraw, ImageFont
+
+from .extraction import (
+    CORE_PROPERTIES, DC, KIND_BY_TYPE, SHEET, TEXT_TAGS, WORKSHEET_PART, Budget, ExtractionError,
+    iter_elements, text_parts
+)
+
+EMBEDDED_THUMBNAILS = ('docProps/thumbnail.png', 'docProps/thumbnail.jpeg', 'docProps/thumbnail.jpg')
+MAX_EMBEDDED_THUMBNAIL = 5 * 1024 * 1024
+
+PREVIEW_CHARS = 2000
+SHEET_ROWS, SHEET_COLUMNS = 20, 10
+CELL_COLUMN = re.compile(r'[A-Z]+')
+
+# Card header colour and label per document kind
+CARD_STYLES = {
+    'docx': ((43, 87, 154), 'DOCX'),
+    'pptx': ((196, 80, 40), 'PPTX'),
+    'xlsx': ((33, 115, 70), 'XLSX'),
+}
+
+def _paragraphs(archive, kind, names, budget):
+    """Text blocks of the first page (docx: up to PREVIEW_CHARS) or first slide"""
+    text_tag, block_tag = TEXT_TAGS[kind]
+    parts = text_parts(kind, names)[:1]
+    paragraphs, current, length = [], [], 0
+    for name in parts:
+        if name not in names:
+            continue
+        for element in iter_elements(archive, name, (text_tag, block_tag), budget):
+            if element.tag == text_tag:
+                current.append(element.text or '')
+                continue
+            text = ''.join(current).strip()
+            current = []
+            element.clear()
+            if text:
+                paragraphs.append(text)
+                length += len(text)
+                if length >= PREVIEW_CHARS:
+                    break
+    return paragraphs
+
+def _column_index(reference):
+    match = CELL_COLUMN.match(reference or '')
+    if not match:
+        return None
+    index = 0
+    for letter in match.group():
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+def _first_sheet_rows(archive, names, budget):
+    """Top-left SHEET_ROWS x SHEET_COLUMNS cells of the first worksheet, as text"""
+    sheets = sorted(
+        (name for name in names if WORKSHEET_PART.fullmatch(name)),
+        key=lambda name: int(WORKSHEET_PART.fullmatch(name).group(1))
+    )
+    if not sheets:
+        return []
+    
+    rows, shared = [], {}
+    cell, value, row = SHEET + 'c', SHEET + 'v', SHEET + 'row'
+    current = {}
+    for element in iter_elements(archive, sheets[0], (cell, row), budget):
+        if element.tag == cell:
+            column = _column_index(element.get('r'))
+            if column is not None and column < SHEET_COLUMNS:
+                if element.get('t') == 'inlineStr':
+                    current[column] = ''.join(t.text or '' for t in element.iter(SHEET + 't'))
+                else:
+                    raw = element.findtext(value) or ''
+                    if element.get('t') == 's' and raw.isdigit():
+                        shared.setdefault(int(raw), []).append((len(rows), column))
+                    current[column] = raw
+            element.clear()
+            continue
+        rows.append(current)
+        current = {}
+        element.clear()
+        if len(rows) >= SHEET_ROWS:
+            break
+    
+    # Resolve shared-string cells, reading the table only as far as needed
+    if shared and 'xl/sharedStrings.xml' in names:
+        last = max(shared)
+        for index, item in enumerate(iter_elements(archive, 'xl/sharedStrings.xml', (SHEET + 'si',), budget)):
+            for row_index, column in shared.get(index, ()):
+                rows[row_index][column] = ''.join(t.text or '' for t in item.iter(SHEET + 't'))
+            item.clear()
+            if index >= last:
+                break
+    
+    width = max((max(row) + 1 for row in rows if row), default=0)
+    return [[row.get(column, '') for column in range(width)] for row in rows]
+
+def _read_title(archive, names, budget):
+    if CORE_PROPERTIES not in names:
+        return ''
+    for element in iter_elements(archive, CORE_PROPERTIES, (DC + 'title',), budget):
+        return (element.text or '').strip()
+    return ''
+
+def _html(kind, paragraphs, rows):
+    if kind == 'xlsx':
+        body = ''.join(
+            '<tr>' + ''.join(f'<td>{html.escape(cell)}</td>' for cell in row) + '</tr>'
+            for row in rows
+        )
+        body = f'<table>{body}</table>'
+    else:
+        body = ''.join(f'<p>{html.escape(paragraph)}</p>' for paragraph in paragraphs)
+    return f'<div class="file-preview file-preview-{kind}">{body}</div>'
+
+def _embedded_thumbnail(archive, names, size):
+    for name in EMBEDDED_THUMBNAILS:
+        if name in names and archive.getinfo(name).file_size <= MAX_EMBEDDED_THUMBNAIL:
+            with archive.open(name) as data, warnings.catch_warnings():
+                # Oversized dimensions are refused rather than decoded
+                warnings.simplefilter('error', Image.DecompressionBombWarning)
+                image = Image.open(data)
+                image.thumbnail((size, size))
+                return image.convert('RGB')
+    return None
+
+def _card(kind, title, lines, size):
+    colour, label = CARD_STYLES[kind]
+    width, height = size, size * 3 // 4
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.rectangle((0, 0, width, 28), fill=colour)
+    draw.text((10, 8), label, fill='white', font=font)
+    
+    y, columns = 40, max(10, (width - 20) // 6)
+    for text, fill in [(title, 'black')] + [(line, (90, 90, 90)) for line in lines]:
+        if not isinstance(font, ImageFont.FreeTypeFont):
+            # The bitmap fallback font only covers Latin-1
+            text = text.encode('latin-1', 'replace').decode('latin-1')
+        for wrapped in textwrap.wrap(text, columns)[:3]:
+            if y > height - 16:
+                return image
+            draw.text((10, y), wrapped, fill=fill, font=font)
+            y += 14
+        y += 4
+    return image
+
+def _write_atomic(path, write):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return os.path.getsize(path)
+
+def render_preview(path, file_type, thumbnail_path, html_path, size, max_xml_bytes):
+    """
+    Write a PNG thumbnail (longest edge `size`) and an HTML fragment for the
+    document at `path`; returns the bytes written. Raises ExtractionError for
+    unreadable files.
+    """
+    kind = KIND_BY_TYPE.get(file_type)
+    if kind is None:
+        raise ExtractionError(f'Unsupported file type: {file_type}')
+    budget = Budget(max_xml_bytes)
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = set(archive.namelist())
+            paragraphs = _paragraphs(archive, kind, names, budget) if kind != 'xlsx' else []
+            rows = _first_sheet_rows(archive, names, budget) if kind == 'xlsx' else []
+            thumbnail = _embedded_thumbnail(archive, names, size)
+            if thumbnail is None:
+                lines = paragraphs or [' | '.join(cell for cell in row if cell) for row in rows]
+                thumbnail = _card(kind, _read_title(archive, names, budget), lines, size)
+    except (zipfile.BadZipFile, ParseError, NotImplementedError, RuntimeError, EOFError, OSError,
+            Image.DecompressionBombError, Image.DecompressionBombWarning) as e:
+        raise ExtractionError(f'Could not render preview: {e}') from e
+    
+    written = _write_atomic(thumbnail_path, lambda f: thumbnail.save(f, format='PNG', optimize=True))
+    fragment = _html(kind, paragraphs, rows).encode('utf-8')
+    written += _write_atomic(html_path, lambda f: f.write(fragment))
+    return written
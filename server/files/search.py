@@ -0,0 +1,152 @@
+"""
+Full-text index over uploaded documents.
+
+The index is a side table next to document_metadata, keyed by its id:
+an FTS5 virtual table on SQLite, a tsvector column with a GIN index on
+PostgreSQL. Tables are created after migrate (see FilesConfig.ready); other
+databases have no index and search is unavailable.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections
+
+TOKEN = re.compile(r'\w+')
+MIN_PREFIX_LENGTH = 3
+
+class SQLiteSearchIndex:
+    """FTS5 table ranked with BM25; the last query term also matches as a prefix (3+ characters)"""
+    
+    def __init__(self, connection):
+        self.connection = connection
+    
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS file_search "
+                "USING fts5(name, title, author, body, "
+                "tokenize='porter unicode61 remove_diacritics 2', prefix='3')"
+            )
+    
+    def index(self, rows):
+        """Add or replace (metadata_id, name, title, author, body) rows"""
+        with self.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM file_search WHERE rowid = %s', [(row[0],) for row in rows])
+            cursor.executemany(
+                'INSERT INTO file_search (rowid, name, title, author, body) VALUES (%s, %s, %s, %s, %s)',
+                rows
+            )
+    
+    def remove(self, metadata_ids):
+        with self.connection.cursor() as cursor:
+            cursor.executemany('DELETE FROM file_search WHERE rowid = %s', [(pk,) for pk in metadata_ids])
+    
+    def match_expression(self, query):
+        terms = TOKEN.findall(query)
+        if not terms:
+            return None
+        # Quoted terms cannot be read as FTS5 operators or column filters
+        expression = ' '.join(f'"{term}"' for term in terms)
+        # Shorter prefixes expand to most of the vocabulary and rank every document
+        return expression + '*' if len(terms[-1]) >= MIN_PREFIX_LENGTH else expression
+    
+    def search(self, query, limit, offset):
+        """[(upload_id, rank)] for active files, best match first"""
+        expression = self.match_expression(query)
+        if expression is None:
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT m.upload_id, -bm25(file_search, 10.0, 10.0, 5.0, 1.0) AS rank
+                FROM file_search
+                JOIN document_metadata m ON m.id = file_search.rowid
+                JOIN uploaded_files u ON u.id = m.upload_id
+                WHERE file_search MATCH %s AND u.is_active
+                ORDER BY bm25(file_search, 10.0, 10.0, 5.0, 1.0)
+                LIMIT %s OFFSET %s
+                """,
+                [expression, limit, offset]
+            )
+            return cursor.fetchall()
+
+class PostgresSearchIndex:
+    """
+    Weighted tsvector (name and title A, author B, body D) with a GIN index,
+    ranked with ts_rank_cd; queries use websearch syntax ("quoted phrases", -excluded).
+    """
+    
+    def __init__(self, connection):
+        self.connection = connection
+    
+    def install(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS file_search (
+                    metadata_id bigint PRIMARY KEY REFERENCES document_metadata (id) ON DELETE CASCADE,
+                    document tsvector NOT NULL
+                )
+                """
+            )
+            cursor.execute('CREATE INDEX IF NOT EXISTS file_search_document_idx ON file_search USING GIN (document)')
+    
+    def index(self, rows):
+        config = settings.FILE_SEARCH_CONFIG
+        with self.connection.cursor() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO file_search (metadata_id, document) VALUES (
+                    %s,
+                    setweight(to_tsvector(%s::regconfig, %s), 'A')
+                    || setweight(to_tsvector(%s::regconfig, %s), 'A')
+                    || setweight(to_tsvector(%s::regconfig, %s), 'B')
+                    || setweight(to_tsvector(%s::regconfig, %s), 'D')
+                )
+                ON CONFLICT (metadata_id) DO UPDATE SET document = EXCLUDED.document
+                """,
+                [
+                    (pk, config, name, config, title, config, author, config, body)
+                    for pk, name, title, author, body in rows
+                ]
+            )
+    
+    def remove(self, metadata_ids):
+        # Rows go with their document_metadata row (ON DELETE CASCADE)
+        pass
+    
+    def search(self, query, limit, offset):
+        if not TOKEN.search(query):
+            return []
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT m.upload_id, ts_rank_cd(s.document, q) AS rank
+                FROM file_search s
+                CROSS JOIN websearch_to_tsquery(%s::regconfig, %s) q
+                JOIN document_metadata m ON m.id = s.metadata_id
+                JOIN uploaded_files u ON u.id = m.upload_id
+                WHERE s.document @@ q AND u.is_active
+                ORDER BY rank DESC
+                LIMIT %s OFFSET %s
+                """,
+                [settings.FILE_SEARCH_CONFIG, query, limit, offset]
+            )
+            return cursor.fetchall()
+
+SEARCH_INDEXES = {
+    'sqlite': SQLiteSearchIndex,
+    'postgresql': PostgresSearchIndex,
+}
+
+def get_search_index(using='default'):
+    """The index for the `using` database, or None when its vendor has none"""
+    connection = connections[using]
+    index_class = SEARCH_INDEXES.get(connection.vendor)
+    return index_class(connection) if index_class else None
+
+def install_search_index(sender, using='default', **kwargs):
+    """post_migrate receiver: create the index table if it does not exist"""
+    search_index = get_search_index(using)
+    if search_index is not None:
+        search_index.install()
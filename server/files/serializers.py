@@ -1,6 +1,9 @@
 from rest_framework import serializers
-from .models import UploadedFile, DownloadLink
+from .models import UploadedFile, DownloadLink, UploadSession, DocumentMetadata
+from .utils import content_sha256
 from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
 
 class UploadedFileSerializer(serializers.ModelSerializer):
     uploaded_by_email = serializers.CharField(source='uploaded_by.email', read_only=True)
@@ -12,6 +15,26 @@ class UploadedFileSerializer(serializers.ModelSerializer):
             'uploaded_by_email', 'uploaded_at', 'is_active'
         ]
         read_only_fields = ['id', 'uploaded_at', 'uploaded_by_email']
+    
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        
+        # Optional field selection to trim list payloads
+        if fields:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+class DocumentMetadataSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DocumentMetadata
+        fields = ['title', 'author', 'page_count', 'indexed_at']
+
+class SearchResultSerializer(UploadedFileSerializer):
+    metadata = DocumentMetadataSerializer(read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    
+    class Meta(UploadedFileSerializer.Meta):
+        fields = UploadedFileSerializer.Meta.fields + ['metadata', 'rank']
 
 class FileUploadSerializer(serializers.ModelSerializer):
     file = serializers.FileField()
@@ -28,7 +51,7 @@ class FileUploadSerializer(serializers.ModelSerializer):
             )
         
         # Check file size (50MB limit)
-        if value.size > 50 * 1024 * 1024:
+        if value.size > settings.FILE_UPLOAD_MAX_SIZE:
             raise serializers.ValidationError(
                 "File size cannot exceed 50MB."
             )
@@ -38,9 +61,13 @@ class FileUploadSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         file = validated_data['file']
         
-        uploaded_file = UploadedFile.objects.create(
+        # The upload handler hashes the file while it streams in
+        sha256 = getattr(file, 'sha256', None) or content_sha256(file)
+        
+        uploaded_file = UploadedFile.create_from_content(
+            file,
+            sha256,
             name=file.name,
-            file=file,
             file_type=file.content_type,
             file_size=file.size,
             uploaded_by=self.context['request'].user
@@ -59,4 +86,57 @@ class DownloadLinkSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         if request:
             return request.build_absolute_uri(f'/api/files/secure-download/{obj.encrypted_token}/')
-        return f'/api/files/secure-download/{obj.encrypted_token}/'
\ No newline at end of file
+        return f'/api/files/secure-download/{obj.encrypted_token}/'
+
+class FileIdsSerializer(serializers.Serializer):
+    file_ids = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+    max_files_setting = 'FILE_BULK_MAX_FILES'
+    
+    def validate_file_ids(self, value):
+        # Keep the requested order, drop repeats
+        value = list(dict.fromkeys(value))
+        max_files = getattr(settings, self.max_files_setting)
+        if len(value) > max_files:
+            raise serializers.ValidationError(
+                f"At most {max_files} files can be requested at once."
+            )
+        return value
+
+class BatchDownloadSerializer(FileIdsSerializer):
+    zip = serializers.BooleanField(default=False)
+    max_files_setting = 'DOWNLOAD_BATCH_MAX_FILES'
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'file_name', 'file_type', 'total_size', 'chunk_size',
+            'received_bytes', 'next_chunk', 'expires_at', 'is_finalized', 'uploaded_file'
+        ]
+        read_only_fields = [
+            'id', 'chunk_size', 'received_bytes', 'next_chunk', 'expires_at', 'is_finalized', 'uploaded_file'
+        ]
+    
+    def validate_file_type(self, value):
+        if value not in settings.ALLOWED_FILE_TYPES:
+            raise serializers.ValidationError(
+                "Only PPTX, DOCX, and XLSX files are allowed."
+            )
+        return value
+    
+    def validate_total_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("File cannot be empty.")
+        if value > settings.FILE_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError(
+                "File size cannot exceed 50MB."
+            )
+        return value
+    
+    def create(self, validated_data):
+        return UploadSession.objects.create(
+            user=self.context['request'].user,
+            chunk_size=settings.FILE_UPLOAD_CHUNK_SIZE,
+            expires_at=timezone.now() + timedelta(hours=settings.FILE_UPLOAD_SESSION_TTL_HOURS),
+            **validated_data
+        )
@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .cache import get_file_cache
+from .indexing import schedule_indexing
+from .models import DocumentMetadata, UploadedFile
+from .search import get_search_index
+
+def invalidate_file_cache():
+    """
+    Drop cached file payloads once the current transaction commits; bumping
+    earlier would let a concurrent reader re-cache the old rows under the new
+    version. Call this after queryset.update()/bulk operations, which send no
+    model signals.
+    """
+    transaction.on_commit(lambda: get_file_cache().bump())
+
+@receiver(post_save, sender=UploadedFile)
+@receiver(post_delete, sender=UploadedFile)
+def _uploaded_file_changed(sender, **kwargs):
+    # Covers uploads, soft deletes (is_active=False) and hard deletes
+    invalidate_file_cache()
+
+@receiver(post_delete, sender=UploadedFile)
+def _uploaded_file_deleted(sender, instance, **kwargs):
+    # Also sent for queryset deletes and cascades (e.g. deleting the uploader)
+    instance.release_content()
+
+@receiver(post_save, sender=UploadedFile)
+def _uploaded_file_created(sender, instance, created=False, **kwargs):
+    # Bulk uploads send no post_save and schedule indexing themselves
+    if created:
+        schedule_indexing([instance.pk])
+
+@receiver(post_delete, sender=DocumentMetadata)
+def _document_metadata_deleted(sender, instance, **kwargs):
+    # Also sent for rows removed by the cascade from UploadedFile
+    search_index = get_search_index(kwargs.get('using', 'default'))
+    if search_index is not None:
+        search_index.remove([instance.pk])
+
+@receiver(pre_save, sender=settings.AUTH_USER_MODEL)
+def _remember_uploader_email(sender, instance, update_fields=None, **kwargs):
+    # Skip saves that cannot change the email (e.g. the last_login update on every login)
+    if not instance._state.adding and (update_fields is None or 'email' in update_fields):
+        instance._email_before_save = sender._default_manager.filter(pk=instance.pk).values_list(
+            'email', flat=True
+        ).first()
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def _uploader_changed(sender, instance, created=False, **kwargs):
+    # Payloads embed the uploader's email; only a changed one invalidates them
+    previous = instance.__dict__.pop('_email_before_save', None)
+    if created or previous is None or previous == instance.email:
+        return
+    # Move updated_at so detail ETags change too
+    UploadedFile.objects.filter(uploaded_by=instance).update(updated_at=timezone.now())
+    invalidate_file_cache()
@@ -0,0 +1,185 @@
+"""
+Where file content lives: the `files` entry of STORAGES.
+
+Models and views only go through the Storage API (open, size, delete, url)
+and the helpers below, so content can sit on local disk or in an
+S3-compatible bucket (files.s3). Nothing outside this module assumes a local
+path except the proxy delivery backends, which need one by design.
+
+Content may be stored compressed (FileBlob.encoding, see
+compress_for_storage) and then encrypted (FileBlob.encryption, see
+encrypt_for_storage); iter_content and local_copy return it as uploaded.
+"""
+import hashlib
+import io
+import os
+import posixpath
+import re
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, storages
+
+from secure_file_sharing.crypto import unwrap_file_key, wrap_file_key
+
+from .compression import PROBE_SIZE, compress_chunks, decompress_chunks, get_codec, slice_chunks, worth_compressing
+from .encryption import EncryptingReader, SegmentCipher
+from .utils import iter_file_range
+
+SHA256_HEX = re.compile(r'[0-9a-f]{64}')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+def file_storage():
+    """Storage of FileBlob/UploadedFile content (callable, so fields pick up STORAGES)"""
+    return storages['files']
+
+class ShardedLayoutMixin:
+    """
+    Spread new files over two levels of directories: `blobs/<sha256>` is stored
+    as `blobs/ab/cd/<sha256>` and other names under the hash of their file
+    name, so no directory (or key prefix) grows past a few thousand entries.
+    """
+    
+    def generate_filename(self, filename):
+        name = super().generate_filename(filename).replace(os.sep, '/')
+        directory, base = posixpath.split(name)
+        key = base if SHA256_HEX.fullmatch(base) else hashlib.sha256(base.encode()).hexdigest()
+        return posixpath.join(directory, key[:2], key[2:4], base)
+
+class ShardedFileSystemStorage(ShardedLayoutMixin, FileSystemStorage):
+    """Local storage under MEDIA_ROOT with the sharded layout"""
+
+def iter_range(storage, name, start, length, chunk_size):
+    """
+    Yield `length` bytes of stored file `name` from offset `start`. Storages
+    with a native ranged read (files.s3.S3Storage.iter_range) fetch only
+    those bytes; others are opened and seeked.
+    """
+    reader = getattr(storage, 'iter_range', None)
+    if reader is not None:
+        yield from reader(name, start, length, chunk_size)
+        return
+    with storage.open(name, 'rb') as f:
+        yield from iter_file_range(f, start, length, chunk_size)
+
+def iter_encoded(field_file, cipher, start, length, chunk_size, size=None):
+    """
+    Yield `length` bytes from offset `start` of `field_file` as stored, once
+    decrypted with `cipher` (None when it is not encrypted). Only the
+    segments that overlap the range are read and decrypted. `size` is the
+    decrypted size, when the caller knows it, which saves a stat.
+    """
+    storage, name = field_file.storage, field_file.name
+    if cipher is None:
+        yield from iter_range(storage, name, start, length, chunk_size)
+        return
+    if length <= 0:
+        return
+    stored_size = storage.size(name) if size is None else cipher.stored_size(size)
+    first, offset, stored_length = cipher.segment_span(start, length, stored_size)
+    sealed = iter_range(storage, name, offset, stored_length, chunk_size)
+    segments = cipher.decrypt_chunks(sealed, first, cipher.segment_count(stored_size) - 1)
+    yield from slice_chunks(segments, start - first * cipher.segment_size, length)
+
+def encoded_size(field_file, cipher):
+    """Size of `field_file` as stored, once decrypted with `cipher`"""
+    stored_size = field_file.storage.size(field_file.name)
+    return cipher.plaintext_size(stored_size) if cipher else stored_size
+
+def iter_content(field_file, encoding, start, length, chunk_size, cipher=None, size=None):
+    """
+    Yield `length` bytes of the content of `field_file` from offset `start`.
+    Encrypted content is decrypted with `cipher`. Content stored with
+    `encoding` is decompressed from the beginning and the bytes before
+    `start` are skipped; otherwise see iter_encoded, `size` included.
+    """
+    if not encoding:
+        yield from iter_encoded(field_file, cipher, start, length, chunk_size, size)
+        return
+    total = encoded_size(field_file, cipher)
+    encoded = iter_encoded(field_file, cipher, 0, total, chunk_size, total)
+    yield from slice_chunks(decompress_chunks(encoding, encoded), start, length)
+
+def compress_for_storage(content, content_type):
+    """
+    (file to store, encoding) for `content` of `content_type`. With
+    FILE_COMPRESSION_ENABLED, types in FILE_COMPRESSION_TYPES are compressed
+    into a temporary file, which the caller closes, unless that saves less
+    than FILE_COMPRESSION_MIN_SAVING; otherwise `content` is returned as is
+    with encoding ''.
+    """
+    if not settings.FILE_COMPRESSION_ENABLED or content.size < settings.FILE_COMPRESSION_MIN_SIZE:
+        return content, ''
+    codec = get_codec(settings.FILE_COMPRESSION_TYPES.get(content_type))
+    if codec is None:
+        return content, ''
+    min_saving = settings.FILE_COMPRESSION_MIN_SAVING
+    
+    # Already-compressed data gives up after one block instead of a full pass
+    content.seek(0)
+    sample = content.read(PROBE_SIZE)
+    if not worth_compressing(codec, sample, min_saving):
+        content.seek(0)
+        return content, ''
+    
+    compressed = tempfile.NamedTemporaryFile(prefix='compressed-', suffix='.tmp')
+    for data in compress_chunks(codec, content.chunks(COPY_CHUNK_SIZE)):
+        compressed.write(data)
+    content.seek(0)
+    if compressed.tell() > content.size * (1 - min_saving):
+        compressed.close()
+        return content, ''
+    compressed.flush()
+    compressed.seek(0)
+    return File(compressed), codec.name
+
+def encrypt_for_storage(content):
+    """
+    (file to store, wrapped key) for `content`. With FILE_ENCRYPTION_KEY set,
+    the file to store encrypts `content` segment by segment while the
+    storage reads it, so no encrypted copy is buffered; otherwise `content`
+    is returned as is with ''.
+    """
+    if not settings.FILE_ENCRYPTION_KEY:
+        return content, ''
+    cipher = SegmentCipher.generate(settings.FILE_ENCRYPTION_SEGMENT_SIZE)
+    content.seek(0)
+    # Buffered, so S3 multipart uploads get full parts from read(n)
+    sealed = File(io.BufferedReader(EncryptingReader(content, cipher), COPY_CHUNK_SIZE))
+    sealed.size = cipher.stored_size(content.size)
+    return sealed, wrap_file_key(cipher.to_bytes())
+
+def file_cipher(encryption):
+    """Cipher for a FileBlob.encryption value, or None when the content is not encrypted"""
+    if not encryption:
+        return None
+    return SegmentCipher.from_bytes(unwrap_file_key(encryption))
+
+def local_path(field_file):
+    """Path of `field_file` on this machine, or None when its storage is remote"""
+    try:
+        return field_file.path
+    except NotImplementedError:
+        return None
+
+@contextmanager
+def local_copy(field_file, encoding='', cipher=None):
+    """
+    Path to the content of `field_file` for code that needs a real file
+    (zipfile, worker processes). Remote content, and content stored
+    compressed or encrypted, is copied as uploaded to a temporary file that
+    is removed on exit.
+    """
+    path = local_path(field_file)
+    if path is not None and not encoding and cipher is None:
+        yield path
+        return
+    with tempfile.NamedTemporaryFile(prefix='file-', suffix='.tmp') as copy:
+        size = encoded_size(field_file, cipher)
+        chunks = iter_encoded(field_file, cipher, 0, size, COPY_CHUNK_SIZE, size)
+        for data in decompress_chunks(encoding, chunks) if encoding else chunks:
+            copy.write(data)
+        copy.flush()
+        yield copy.name
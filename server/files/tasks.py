@@ -0,0 +1,15 @@
+from celery import shared_task
+
+from . import gc
+
+@shared_task
+def collect_garbage():
+    """Periodic garbage collection, scheduled by CELERY_BEAT_SCHEDULE"""
+    return gc.collect_garbage()
+
+@shared_task
+def index_documents(file_ids):
+    """Extract metadata and index the text of uploaded files"""
+    from .indexing import index_documents
+    
+    return index_documents(file_ids)
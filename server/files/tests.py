@@ -0,0 +1,1367 @@
+import base64
+import gzip
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import sync_to_async
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+from cryptography.fernet import Fernet
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.test import AsyncClient, Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from .audit import DownloadAuditWriter
+from .cache import FileCache
+from .compression import CODECS, PROBE_SIZE, decompress_chunks
+from .extraction import ExtractionError, extract_document
+from .gc import (
+    collect_garbage, purge_deleted_files, purge_download_links, purge_unreferenced_blobs, remove_orphaned_files,
+)
+from .indexing import index_documents
+from .models import DownloadBatch, DownloadLink, FileBlob, UploadedFile, UploadSession
+from .nonces import InMemoryNonceStore, get_nonce_store
+from .ooxml import sniff_ooxml
+from .previews import EVICT_TO, PreviewCache, get_preview_cache
+from .rendering import render_preview
+from .s3 import S3Storage
+from .storage import ShardedFileSystemStorage, compress_for_storage, iter_range
+from .utils import content_sha256, decode_download_token, generate_secure_download_token
+
+DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+PPTX = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+
+XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+def docx(padding=b'', content_types_last=False):
+    """A minimal document that passes the OOXML content checks"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        if content_types_last:
+            archive.writestr('padding.bin', padding)
+        archive.writestr('[Content_Types].xml', (
+            '<?xml version="1.0"?><Types><Override PartName="/word/document.xml" ContentType="'
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/></Types>'
+        ))
+        archive.writestr('word/document.xml', (
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            '<w:body><w:p><w:r><w:t>Quarterly report</w:t></w:r></w:p></w:body></w:document>'
+        ))
+        if not content_types_last:
+            archive.writestr('padding.bin', padding)
+    return buffer.getvalue()
+
+def office_document(parts, title='', author=''):
+    """An OOXML package of `parts` ({name: xml}) with core properties"""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('[Content_Types].xml', '<?xml version="1.0"?><Types/>')
+        archive.writestr('docProps/core.xml', (
+            '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties"'
+            f' xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:title>{title}</dc:title>'
+            f'<dc:creator>{author}</dc:creator></cp:coreProperties>'
+        ))
+        for name, xml in parts.items():
+            archive.writestr(name, xml)
+    return buffer.getvalue()
+
+def word_document(paragraphs, **properties):
+    body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+    return office_document({'word/document.xml': (
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f'<w:body>{body}</w:body></w:document>'
+    )}, **properties)
+
+def presentation(slides, **properties):
+    return office_document({
+        f'ppt/slides/slide{number}.xml': (
+            '<p:sld xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"'
+            ' xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main">'
+            f'<a:p><a:r><a:t>{text}</a:t></a:r></a:p></p:sld>'
+        )
+        for number, text in enumerate(slides, 1)
+    }, **properties)
+
+def workbook(cells, sheets=1, **properties):
+    strings = ''.join(f'<si><t>{text}</t></si>' for text in cells)
+    parts = {'xl/sharedStrings.xml': (
+        f'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">{strings}</sst>'
+    )}
+    for number in range(1, sheets + 1):
+        parts[f'xl/worksheets/sheet{number}.xml'] = (
+            '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"/>'
+        )
+    return office_document(parts, **properties)
+
+class FilesTestCase(TestCase):
+    """An operations user, a client user and a throwaway MEDIA_ROOT"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        media_root = tempfile.mkdtemp()
+        cls.addClassCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        cls.enterClassContext(override_settings(
+            MEDIA_ROOT=media_root,
+            FILE_UPLOAD_SESSION_DIR=os.path.join(media_root, 'upload_sessions'),
+            FILE_PREVIEW_CACHE_DIR=os.path.join(media_root, 'previews'),
+        ))
+    
+    @classmethod
+    def setUpTestData(cls):
+        cls.ops_user = User.objects.create_user(
+            username='ops@example.com', email='ops@example.com', password='pass-12345',
+            user_type='operations', is_email_verified=True
+        )
+        cls.client_user = User.objects.create_user(
+            username='client@example.com', email='client@example.com', password='pass-12345',
+            user_type='client', is_email_verified=True
+        )
+    
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        self.ops = APIClient()
+        self.ops.force_authenticate(self.ops_user)
+        self.client_api = APIClient()
+        self.client_api.force_authenticate(self.client_user)
+    
+    def create_file(self, content, name='report.docx', file_type='application/octet-stream'):
+        content = ContentFile(content, name=name)
+        return UploadedFile.create_from_content(
+            content, content_sha256(content),
+            name=name, file_type=file_type, file_size=content.size, uploaded_by=self.ops_user
+        )
+    
+    @contextmanager
+    def assertMaxQueries(self, limit):
+        """Fail when the block runs more than `limit` queries, listing them"""
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        queries = '\n'.join(query['sql'] for query in context.captured_queries)
+        self.assertLessEqual(len(context), limit, f'{len(context)} queries:\n{queries}')
+    
+    def download_path(self, file_obj):
+        response = self.client_api.post(f'/api/files/download/{file_obj.id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['download_link'].replace('http://testserver', '')
+
+class DownloadLinkConsumptionTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = os.urandom(300 * 1024)
+        self.path = self.download_path(self.create_file(self.content))
+    
+    def get(self, **headers):
+        response = self.client_api.get(self.path, **headers)
+        if response.streaming:
+            response.body = b''.join(response.streaming_content)
+            response.close()
+        return response
+    
+    def test_repeated_ranges_do_not_consume_the_link(self):
+        for _ in range(4):
+            response = self.get(HTTP_RANGE='bytes=0-99999')
+            self.assertEqual(response.status_code, 206)
+        link = DownloadLink.objects.get()
+        self.assertFalse(link.is_used)
+        self.assertEqual(link.bytes_served, 100000)
+        
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.content)
+        self.assertEqual(self.get().status_code, 410)
+    
+    def test_ranges_covering_the_file_consume_the_link(self):
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-199999').status_code, 206)
+        self.assertEqual(self.get(HTTP_RANGE='bytes=100000-').status_code, 206)
+        self.assertTrue(DownloadLink.objects.get().is_used)
+        self.assertEqual(self.get(HTTP_RANGE='bytes=0-9').status_code, 410)
+    
+    def test_concurrent_full_downloads_get_one_copy(self):
+        first = self.client_api.get(self.path)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.get().status_code, 410)
+        self.assertEqual(b''.join(first.streaming_content), self.content)
+        first.close()
+        self.assertTrue(DownloadLink.objects.get().is_used)
+    
+    def test_interrupted_download_can_resume(self):
+        first = self.client_api.get(self.path)
+        received = next(iter(first.streaming_content))
+        first.close()
+        link = DownloadLink.objects.get()
+        self.assertFalse(link.is_used)
+        self.assertEqual(link.served_ranges, [[0, len(received) - 1]])
+        
+        response = self.get(HTTP_RANGE=f'bytes={len(received)}-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(received + response.body, self.content)
+        self.assertTrue(DownloadLink.objects.get().is_used)
+    
+    def test_response_closed_unread_gives_the_claim_back(self):
+        self.client_api.get(self.path).close()
+        self.assertFalse(DownloadLink.objects.get().is_used)
+        self.assertEqual(self.get().body, self.content)
+
+@override_settings(
+    FILE_DELIVERY_BACKEND='files.delivery.XAccelRedirectDelivery',
+    MIDDLEWARE=['files.delivery.ProxyEmulationMiddleware'] + settings.MIDDLEWARE
+)
+class ProxyEmulationTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = os.urandom(10000)
+        self.file_obj = self.create_file(self.content)
+    
+    def get(self, **headers):
+        response = self.client_api.get(self.download_path(self.file_obj), **headers)
+        response.body = b''.join(response.streaming_content) if response.streaming else response.content
+        return response
+    
+    def test_full_file(self):
+        response = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.content)
+    
+    def test_single_range(self):
+        response = self.get(HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 100-199/10000')
+        self.assertEqual(response.body, self.content[100:200])
+    
+    def test_multiple_ranges(self):
+        response = self.get(HTTP_RANGE='bytes=0-9,-10')
+        self.assertEqual(response.status_code, 206)
+        self.assertTrue(response['Content-Type'].startswith('multipart/byteranges'))
+        self.assertEqual(int(response['Content-Length']), len(response.body))
+        self.assertIn(self.content[:10], response.body)
+        self.assertIn(self.content[-10:], response.body)
+    
+    def test_unsatisfiable_range(self):
+        response = self.get(HTTP_RANGE='bytes=20000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */10000')
+    
+    def test_stale_if_range_gets_the_full_file(self):
+        response = self.get(HTTP_RANGE='bytes=100-199', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.content)
+
+class UploadSessionTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.content = docx()
+        response = self.ops.post('/api/files/upload-sessions/', {
+            'file_name': 'report.docx', 'file_type': DOCX, 'total_size': len(self.content)
+        })
+        self.assertEqual(response.status_code, 201)
+        self.session_id = response.json()['session']['id']
+    
+    def put_chunk(self, index=0):
+        return self.ops.put(
+            f'/api/files/upload-sessions/{self.session_id}/chunks/{index}/',
+            self.content, content_type='application/octet-stream',
+            HTTP_X_CHUNK_SHA256=hashlib.sha256(self.content).hexdigest()
+        )
+    
+    def test_chunk_claimed_by_another_request_is_rejected(self):
+        UploadSession.objects.filter(pk=self.session_id).update(
+            chunk_lease='other', chunk_lease_expires_at=timezone.now() + timedelta(minutes=1)
+        )
+        self.assertEqual(self.put_chunk().status_code, 409)
+        self.assertEqual(UploadSession.objects.get(pk=self.session_id).received_bytes, 0)
+        
+        # An expired claim belongs to a request that is gone
+        UploadSession.objects.filter(pk=self.session_id).update(chunk_lease_expires_at=timezone.now())
+        self.assertEqual(self.put_chunk().status_code, 200)
+        session = UploadSession.objects.get(pk=self.session_id)
+        self.assertEqual((session.next_chunk, session.chunk_lease), (1, ''))
+    
+    def test_finalized_session_stays_closed_after_its_file_is_deleted(self):
+        self.assertEqual(self.put_chunk().status_code, 200)
+        response = self.ops.post(f'/api/files/upload-sessions/{self.session_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        
+        UploadedFile.objects.get(pk=response.json()['file']['id']).delete()
+        session = UploadSession.objects.get(pk=self.session_id)
+        self.assertIsNone(session.uploaded_file)
+        self.assertTrue(session.is_finalized)
+        self.assertEqual(self.ops.post(f'/api/files/upload-sessions/{self.session_id}/finalize/').status_code, 404)
+        self.assertEqual(self.put_chunk(1).status_code, 404)
+
+class BlobReferenceTests(FilesTestCase):
+    def test_queryset_delete_releases_blobs(self):
+        first = self.create_file(b'shared content', name='a.docx')
+        self.create_file(b'shared content', name='b.docx')
+        blob = first.blob
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 2)
+        
+        UploadedFile.objects.filter(pk=first.pk).delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.ref_count, 1)
+        
+        UploadedFile.objects.all().delete()
+        self.assertFalse(FileBlob.objects.filter(pk=blob.pk).exists())
+    
+    def test_deleting_the_uploader_releases_blobs(self):
+        uploader = User.objects.create_user(
+            username='other@example.com', email='other@example.com', password='pass-12345', user_type='operations'
+        )
+        file_obj = self.create_file(b'owned content')
+        UploadedFile.objects.filter(pk=file_obj.pk).update(uploaded_by=uploader)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            uploader.delete()
+        self.assertFalse(FileBlob.objects.filter(pk=file_obj.blob_id).exists())
+        self.assertFalse(file_obj.blob.file.storage.exists(file_obj.blob.file.name))
+
+class QueryBudgetTests(FilesTestCase):
+    """List, detail and link generation cost the same few queries at any table size"""
+    budgets = {'list': 2, 'detail': 2, 'link': 2}
+    
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.uploaders = [cls.ops_user] + [
+            User.objects.create_user(
+                username=f'ops{i}@example.com', email=f'ops{i}@example.com', password=None, user_type='operations'
+            )
+            for i in range(4)
+        ]
+    
+    def grow_to(self, rows):
+        missing = rows - UploadedFile.objects.count()
+        UploadedFile.objects.bulk_create([
+            UploadedFile(
+                name=f'file-{i}.docx', file=f'uploads/file-{i}.docx', file_type=DOCX, file_size=1,
+                uploaded_by=self.uploaders[i % len(self.uploaders)]
+            )
+            for i in range(missing)
+        ], batch_size=1000)
+    
+    def test_budgets(self):
+        for rows in (10, 1000, 10000):
+            self.grow_to(rows)
+            file_obj = UploadedFile.objects.first()
+            with self.subTest(rows=rows):
+                caches['files'].clear()
+                with self.assertMaxQueries(self.budgets['list']):
+                    response = self.client_api.get('/api/files/list/', {'limit': 100})
+                self.assertEqual(response.status_code, 200)
+                
+                with self.assertMaxQueries(self.budgets['detail']):
+                    response = self.client_api.get(f'/api/files/detail/{file_obj.id}/')
+                self.assertEqual(response.status_code, 200)
+                
+                with self.assertMaxQueries(self.budgets['link']):
+                    response = self.client_api.post(f'/api/files/download/{file_obj.id}/')
+                self.assertEqual(response.status_code, 200)
+
+class TokenKeyBackfillTests(FilesTestCase):
+    """Links created before token_key existed keep resolving, and the command keys them"""
+    
+    def setUp(self):
+        super().setUp()
+        self.path = self.download_path(self.create_file(os.urandom(1024)))
+        DownloadLink.objects.update(token_key=None)
+    
+    def test_legacy_link_resolves_and_is_keyed(self):
+        response = self.client_api.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        response.close()
+        link = DownloadLink.objects.get()
+        self.assertEqual(link.token_key, DownloadLink.lookup_key(link.encrypted_token))
+    
+    def test_backfill_command(self):
+        out = io.StringIO()
+        call_command('backfill_token_keys', stdout=out)
+        self.assertIn('Backfilled 1 token key(s).', out.getvalue())
+        link = DownloadLink.objects.get()
+        self.assertEqual(link.token_key, DownloadLink.lookup_key(link.encrypted_token))
+
+class IndexUsageTests(FilesTestCase):
+    """The hot lookups are answered from an index, not a scan of the table"""
+    
+    def setUp(self):
+        super().setUp()
+        self.file_obj = self.create_file(b'indexed')
+        self.download_path(self.file_obj)
+        self.link = DownloadLink.objects.get()
+    
+    def queries(self):
+        return {
+            'token': DownloadLink.objects.filter(
+                token_key=self.link.token_key, user=self.client_user, file__id=self.file_obj.id
+            ),
+            'list': UploadedFile.objects.active().for_listing().order_by('-uploaded_at', '-id')[:21],
+            'delete': UploadedFile.objects.filter(
+                id=self.file_obj.id, uploaded_by=self.ops_user, is_active=True
+            ),
+        }
+    
+    @skipUnless(connection.vendor == 'sqlite', 'SQLite only')
+    def test_sqlite_plans(self):
+        for name, queryset in self.queries().items():
+            with self.subTest(name):
+                plan = queryset.explain()
+                for line in plan.splitlines():
+                    if ' SCAN ' in f' {line} ':
+                        self.assertIn('USING', line, plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+                if name == 'list':
+                    self.assertIn('uploaded_files_active_idx', plan)
+    
+    @skipUnless(connection.vendor == 'postgresql', 'PostgreSQL is not configured (set DATABASE_URL)')
+    def test_postgresql_plans(self):
+        with connection.cursor() as cursor:
+            # Tiny test tables are cheaper to scan; ask whether an index can serve the query at all
+            cursor.execute('SET enable_seqscan = off')
+        try:
+            for name, queryset in self.queries().items():
+                with self.subTest(name):
+                    plan = queryset.explain()
+                    self.assertNotIn('Seq Scan', plan)
+                    self.assertNotIn('Sort', plan)
+                    if name == 'list':
+                        self.assertIn('uploaded_files_active_idx', plan)
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute('RESET enable_seqscan')
+
+class StatelessLinkTests(FilesTestCase):
+    @override_settings(DOWNLOAD_LINK_MODE='stateless', DOWNLOAD_NONCE_STORE='files.nonces.InMemoryNonceStore')
+    def test_process_local_nonce_store_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_nonce_store()
+        with self.settings(DOWNLOAD_NONCE_SINGLE_PROCESS=True):
+            self.assertIsInstance(get_nonce_store(), InMemoryNonceStore)
+    
+    @override_settings(CACHES={**settings.CACHES, 'nonces': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_local_memory_nonce_cache_is_refused(self):
+        with self.assertRaises(ImproperlyConfigured):
+            get_nonce_store()
+    
+    def test_audit_consumptions_keep_their_own_times(self):
+        for name in ('a.docx', 'b.docx', 'c.docx'):
+            self.download_path(self.create_file(name.encode(), name))
+        links = list(DownloadLink.objects.order_by('file__name'))
+        earlier = timezone.now().replace(microsecond=0) - timedelta(minutes=5)
+        later = earlier + timedelta(minutes=1)
+        
+        writer = DownloadAuditWriter(batch_size=200, flush_interval=1)
+        with self.assertNumQueries(2):
+            writer._write([
+                ('consumed', (links[0].token_key, earlier)),
+                ('consumed', (links[1].token_key, earlier)),
+                ('consumed', (links[2].token_key, later)),
+            ])
+        used_at = dict(DownloadLink.objects.filter(is_used=True).values_list('pk', 'used_at'))
+        self.assertEqual(used_at, {links[0].pk: earlier, links[1].pk: earlier, links[2].pk: later})
+
+@override_settings(ROOT_URLCONF='secure_file_sharing.asgi_urls')
+class AsyncEndpointTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.file_obj = self.create_file(os.urandom(64 * 1024))
+    
+    @override_settings(ROOT_URLCONF='secure_file_sharing.urls')
+    def test_not_mounted_under_wsgi(self):
+        self.assertEqual(self.client_api.get('/api/async/files/list/').status_code, 404)
+    
+    def test_session_requests_need_the_csrf_token(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.client_user)
+        self.assertEqual(client.post(f'/api/async/files/download/{self.file_obj.id}/').status_code, 403)
+        
+        csrf_token = get_random_string(32)
+        client.cookies[settings.CSRF_COOKIE_NAME] = csrf_token
+        response = client.post(f'/api/async/files/download/{self.file_obj.id}/', HTTP_X_CSRFTOKEN=csrf_token)
+        self.assertEqual(response.status_code, 200)
+    
+    def test_token_requests_skip_csrf(self):
+        token = Token.objects.create(user=self.client_user)
+        response = Client(enforce_csrf_checks=True).post(
+            f'/api/async/files/download/{self.file_obj.id}/', HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+        self.assertEqual(response.status_code, 200)
+    
+    async def test_download_closed_unread_gives_the_claim_back(self):
+        client = AsyncClient()
+        await sync_to_async(client.force_login)(self.client_user)
+        path = await sync_to_async(self.download_path)(self.file_obj)
+        path = path.replace('/api/files/', '/api/async/files/')
+        
+        response = await client.get(path)
+        self.assertEqual(response.status_code, 200)
+        await sync_to_async(response.close)()
+        link = await DownloadLink.objects.aget()
+        self.assertFalse(link.is_used)
+        
+        response = await client.get(path)
+        body = b''.join([chunk async for chunk in response.streaming_content])
+        await sync_to_async(response.close)()
+        self.assertEqual(body, self.file_obj.file.open('rb').read())
+        link = await DownloadLink.objects.aget()
+        self.assertTrue(link.is_used)
+
+class ListVersionTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.create_file(b'listed')
+    
+    def list_etag(self):
+        response = self.client_api.get('/api/files/list/')
+        self.assertEqual(response.status_code, 200)
+        return response['ETag']
+    
+    def test_unchanged_list_is_not_modified_with_one_query(self):
+        etag = self.list_etag()
+        with self.assertNumQueries(1):
+            response = self.client_api.get('/api/files/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    @mock.patch.object(FileCache, 'shared', new_callable=mock.PropertyMock, return_value=True)
+    def test_shared_cache_answers_without_queries(self, shared):
+        etag = self.list_etag()
+        with self.assertNumQueries(0):
+            response = self.client_api.get('/api/files/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+    
+    def test_workers_agree_on_the_etag(self):
+        etag = self.list_etag()
+        # Another worker starts with an empty per-process cache
+        caches['files'].clear()
+        self.assertEqual(self.list_etag(), etag)
+    
+    def test_change_missed_by_this_worker_is_not_served_stale(self):
+        etag = self.list_etag()
+        # Saved by another worker: this process's cache never saw a bump
+        UploadedFile.objects.update(is_active=False, updated_at=timezone.now() + timedelta(seconds=1))
+        response = self.client_api.get('/api/files/list/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['files'], [])
+    
+    def test_upload_changes_the_etag(self):
+        etag = self.list_etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_file(b'another', 'another.docx')
+        self.assertNotEqual(self.list_etag(), etag)
+    
+    def test_uploader_email_change_changes_the_etag(self):
+        etag = self.list_etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ops_user.email = 'ops-renamed@example.com'
+            self.ops_user.save()
+        self.assertNotEqual(self.list_etag(), etag)
+    
+    def test_other_uploader_saves_keep_the_etag(self):
+        etag = self.list_etag()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ops_user.first_name = 'Ops'
+            self.ops_user.save()
+        self.assertEqual(self.list_etag(), etag)
+
+class BatchZipTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.files = [self.create_file(os.urandom(32 * 1024), name) for name in ('a.docx', 'b.docx')]
+        response = self.client_api.post(
+            '/api/files/download/batch/', {'file_ids': [str(f.id) for f in self.files], 'zip': True}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.zip_path = response.json()['zip_link'].replace('http://testserver', '')
+    
+    def fetch(self):
+        response = self.client_api.get(self.zip_path)
+        if response.streaming:
+            response.body = b''.join(response.streaming_content)
+            response.close()
+        return response
+    
+    def test_archive_is_consumed_as_a_unit(self):
+        response = self.fetch()
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.body)) as archive:
+            self.assertEqual(archive.namelist(), ['a.docx', 'b.docx'])
+        self.assertEqual(self.fetch().status_code, 410)
+        # The per-file links are left alone
+        self.assertFalse(DownloadLink.objects.filter(is_used=True).exists())
+    
+    def test_concurrent_requests_get_one_archive(self):
+        first = self.client_api.get(self.zip_path)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(self.fetch().status_code, 410)
+        b''.join(first.streaming_content)
+        first.close()
+        self.assertTrue(DownloadBatch.objects.get().is_used)
+    
+    def test_interrupted_archive_can_be_fetched_again(self):
+        response = self.client_api.get(self.zip_path)
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertFalse(DownloadBatch.objects.get().is_used)
+        self.assertEqual(self.fetch().status_code, 200)
+        self.assertEqual(self.fetch().status_code, 410)
+    
+    def test_used_file_links_do_not_block_the_archive(self):
+        for link in DownloadLink.objects.all():
+            link.claim()
+        self.assertEqual(self.fetch().status_code, 200)
+    
+    @override_settings(DOWNLOAD_LINK_MODE='stateless', DOWNLOAD_NONCE_SINGLE_PROCESS=True)
+    @mock.patch('files.nonces.get_audit_writer')
+    @mock.patch('files.views.get_audit_writer')
+    def test_stateless_interrupted_archive_can_be_fetched_again(self, *audit_writers):
+        self.setUp()
+        response = self.client_api.get(self.zip_path)
+        next(iter(response.streaming_content))
+        response.close()
+        self.assertEqual(self.fetch().status_code, 200)
+        self.assertEqual(self.fetch().status_code, 410)
+
+class BulkUploadTests(FilesTestCase):
+    def upload(self, *names):
+        return self.ops.post('/api/files/upload/bulk/', {
+            'files': [SimpleUploadedFile(name, docx(name.encode()), content_type=DOCX) for name in names]
+        }, format='multipart')
+    
+    def stored_files(self):
+        return sum(len(files) for _, _, files in os.walk(settings.MEDIA_ROOT))
+    
+    def test_failed_file_does_not_sink_the_batch(self):
+        store = FileBlob.store
+        
+        def failing_store(blob, content, content_type=''):
+            if content.name == 'bad.docx':
+                raise OSError('No space left on device')
+            return store(blob, content, content_type)
+        
+        before = self.stored_files()
+        with mock.patch.object(FileBlob, 'store', failing_store), self.assertLogs('files.views', 'ERROR'):
+            response = self.upload('a.docx', 'bad.docx', 'b.docx')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['success'] for result in response.json()['results']], [True, False, True])
+        self.assertEqual(UploadedFile.objects.count(), 2)
+        self.assertEqual(self.stored_files(), before + 2)
+    
+    def test_failed_insert_falls_back_to_one_file_at_a_time(self):
+        manager = UploadedFile.objects
+        bulk_create = manager.bulk_create
+        
+        def failing_bulk_create(objs, *args, **kwargs):
+            if any(obj.name == 'bad.docx' for obj in objs):
+                raise IntegrityError('rejected')
+            return bulk_create(objs, *args, **kwargs)
+        
+        before = self.stored_files()
+        with mock.patch.object(manager, 'bulk_create', failing_bulk_create), self.assertLogs('files.views', 'ERROR'):
+            response = self.upload('a.docx', 'bad.docx', 'b.docx')
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['success'] for result in response.json()['results']], [True, False, True])
+        self.assertEqual(set(UploadedFile.objects.values_list('name', flat=True)), {'a.docx', 'b.docx'})
+        self.assertEqual(set(FileBlob.objects.values_list('ref_count', flat=True)), {1})
+        # The failed file's content was written once and removed again
+        self.assertEqual(self.stored_files(), before + 2)
+    
+    @override_settings(FILE_BULK_MAX_TOTAL_SIZE=1024)
+    def test_oversized_request_is_refused(self):
+        response = self.upload('a.docx', 'b.docx')
+        self.assertEqual(response.status_code, 413)
+        self.assertFalse(response.json()['success'])
+        self.assertFalse(UploadedFile.objects.exists())
+
+class ContentCheckTests(FilesTestCase):
+    """Upload contents are checked against their declared type, however the package is laid out"""
+    
+    def upload(self, content, content_type=DOCX):
+        return self.ops.post('/api/files/upload/', {
+            'file': SimpleUploadedFile('report.docx', content, content_type=content_type)
+        }, format='multipart')
+    
+    def test_content_types_past_the_sniff_window(self):
+        content = docx(os.urandom(1536 * 1024), content_types_last=True)
+        self.assertEqual(self.upload(content).status_code, 201)
+        self.assertEqual(sniff_ooxml(io.BytesIO(content), settings.FILE_UPLOAD_SNIFF_BYTES), DOCX)
+        
+        response = self.upload(content, content_type=XLSX)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['file'], ['File contents do not match its declared type.'])
+    
+    def test_zip_without_content_types_is_rejected(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as archive:
+            archive.writestr('padding.bin', os.urandom(1536 * 1024))
+            archive.writestr('word/document.xml', '<w:document/>')
+        self.assertEqual(self.upload(buffer.getvalue()).status_code, 400)
+        self.assertFalse(UploadedFile.objects.exists())
+    
+    def test_checked_before_session_authentication_reads_the_body(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.ops_user)
+        csrf_token = get_random_string(32)
+        client.cookies[settings.CSRF_COOKIE_NAME] = csrf_token
+        response = client.post('/api/files/upload/', {
+            'file': SimpleUploadedFile('report.docx', docx(), content_type=XLSX)
+        }, HTTP_X_CSRFTOKEN=csrf_token)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors']['file'], ['File contents do not match its declared type.'])
+
+class EncryptedPreviewTests(FilesTestCase):
+    """Previews of encrypted content reach the preview cache sealed, never in plaintext"""
+    
+    def setUp(self):
+        super().setUp()
+        overrides = override_settings(FILE_ENCRYPTION_KEY=Fernet.generate_key().decode())
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+    
+    def upload(self):
+        content = ContentFile(docx(b'secret padding'), name='report.docx')
+        return UploadedFile.create_from_content(
+            content, content_sha256(content),
+            name='report.docx', file_type=DOCX, file_size=content.size, uploaded_by=self.ops_user
+        )
+    
+    def cached_files(self):
+        return [
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(settings.FILE_PREVIEW_CACHE_DIR) for name in names
+        ]
+    
+    def test_previews_are_cached_sealed(self):
+        file_obj = self.upload()
+        self.assertTrue(file_obj.blob.encryption)
+        response = self.client_api.get(f'/api/files/preview/{file_obj.id}/thumbnail/')
+        self.assertEqual(response.status_code, 200)
+        thumbnail = b''.join(response.streaming_content)
+        self.assertTrue(thumbnail.startswith(b'\x89PNG'))
+        
+        cached = [path for path in self.cached_files() if file_obj.blob.sha256 in path]
+        self.assertEqual(len(cached), 2)
+        for path in cached:
+            self.assertTrue(path.endswith('.sealed'))
+            with open(path, 'rb') as f:
+                sealed = f.read()
+            self.assertNotIn(b'\x89PNG\r\n', sealed)
+            self.assertNotIn(b'Quarterly report', sealed)
+        
+        with mock.patch('files.previews.render_preview') as render:
+            response = self.client_api.get(f'/api/files/preview/{file_obj.id}/thumbnail/')
+            self.assertEqual(b''.join(response.streaming_content), thumbnail)
+            self.assertEqual(self.client_api.get(f'/api/files/preview/{file_obj.id}/').status_code, 200)
+        render.assert_not_called()
+    
+    def test_encrypting_a_blob_drops_its_plaintext_previews(self):
+        with override_settings(FILE_ENCRYPTION_KEY=''):
+            file_obj = self.upload()
+            self.assertEqual(self.client_api.get(f'/api/files/preview/{file_obj.id}/').status_code, 200)
+        self.assertTrue(get_preview_cache().has(file_obj.blob.sha256))
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('encrypt_blobs', stdout=io.StringIO())
+        self.assertFalse(get_preview_cache().has(file_obj.blob.sha256))
+
+class ListPaginationTests(FilesTestCase):
+    """Keyset pages, filters and field selection of the file list"""
+    
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.files = []
+        for i, name in enumerate(['alpha.docx', 'beta.docx', 'alpine.docx', 'gamma.docx', 'delta.docx']):
+            file_obj = self.create_file(f'content {i}'.encode(), name=name)
+            # Two files share a timestamp, so the id has to break the tie
+            uploaded_at = now - timedelta(days=min(i, 3))
+            UploadedFile.objects.filter(pk=file_obj.pk).update(uploaded_at=uploaded_at)
+            file_obj.uploaded_at = uploaded_at
+            self.files.append(file_obj)
+        self.newest_first = sorted(self.files, key=lambda f: (f.uploaded_at, f.id), reverse=True)
+    
+    def list(self, **params):
+        return self.client_api.get('/api/files/list/', params)
+    
+    def ids(self, response):
+        return [item['id'] for item in response.json()['files']]
+    
+    def test_cursor_walks_every_file_once(self):
+        seen, cursor, pages = [], None, 0
+        while True:
+            response = self.list(limit=2, **({'cursor': cursor} if cursor else {}))
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual(body['page_count'], len(body['files']))
+            seen += self.ids(response)
+            pages += 1
+            cursor = body['next_cursor']
+            if cursor is None:
+                self.assertIsNone(body['next'])
+                break
+            self.assertIn(f'cursor={cursor}', body['next'])
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [str(f.id) for f in self.newest_first])
+    
+    def test_filters(self):
+        UploadedFile.objects.filter(pk=self.files[1].pk).update(uploaded_by=self.client_user, file_type=DOCX)
+        cutoff = (self.files[1].uploaded_at - timedelta(hours=1)).isoformat()
+        
+        self.assertEqual(self.ids(self.list(file_type=DOCX)), [str(self.files[1].id)])
+        self.assertEqual(self.ids(self.list(uploader='CLIENT@example.com')), [str(self.files[1].id)])
+        self.assertEqual(set(self.ids(self.list(name='ALP'))), {str(self.files[0].id), str(self.files[2].id)})
+        self.assertEqual(set(self.ids(self.list(uploaded_after=cutoff))), {str(self.files[0].id), str(self.files[1].id)})
+        self.assertEqual(len(self.ids(self.list(uploaded_before=cutoff))), 3)
+        before_date = self.files[3].uploaded_at.date().isoformat()
+        self.assertEqual(self.list(uploaded_before=before_date).status_code, 200)
+    
+    def test_fields_trim_the_payload(self):
+        response = self.list(fields='id,name')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({frozenset(item) for item in response.json()['files']}, {frozenset({'id', 'name'})})
+    
+    def test_bad_parameters_are_rejected(self):
+        for params in (
+            {'cursor': 'not-a-cursor'},
+            {'uploaded_after': 'yesterday'},
+            {'uploaded_before': '2024-13-40'},
+            {'limit': 'ten'},
+            {'fields': 'id,secret'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.list(**params).status_code, 400)
+
+class TokenKeyRingTests(FilesTestCase):
+    """Download tokens keep decrypting while their key stays in ENCRYPTION_KEY_FALLBACKS"""
+    
+    def test_token_from_the_previous_key(self):
+        file_obj = self.create_file(b'rotated')
+        with override_settings(ENCRYPTION_KEY='previous-key', ENCRYPTION_KEY_FALLBACKS=[]):
+            token = generate_secure_download_token(file_obj, self.client_user)
+            # The double-base64 format of tokens minted before the key ring
+            legacy = base64.urlsafe_b64encode(token.encode()).decode()
+        
+        with override_settings(ENCRYPTION_KEY='current-key', ENCRYPTION_KEY_FALLBACKS=['previous-key']):
+            for minted in (token, legacy):
+                self.assertEqual(decode_download_token(minted)['file_id'], str(file_obj.id))
+            fresh = generate_secure_download_token(file_obj, self.client_user)
+        
+        # Once the old key is dropped only tokens minted under the current one decrypt
+        with override_settings(ENCRYPTION_KEY='current-key', ENCRYPTION_KEY_FALLBACKS=[]):
+            self.assertEqual(decode_download_token(fresh)['file_id'], str(file_obj.id))
+            with self.assertRaises(ValueError), mock.patch('builtins.print'):
+                decode_download_token(token)
+
+class FileCacheTests(FilesTestCase):
+    """List and detail payloads are cached per URL and dropped by every kind of change"""
+    
+    def setUp(self):
+        super().setUp()
+        # Keep indexing jobs out of the background queue
+        patcher = mock.patch('files.indexing.get_index_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.files = [self.create_file(f'cached {i}'.encode(), name=f'cached-{i}.docx') for i in range(3)]
+    
+    def list(self):
+        response = self.client_api.get('/api/files/list/')
+        self.assertEqual(response.status_code, 200)
+        return response['X-Cache'], {item['id'] for item in response.json()['files']}
+    
+    def assertInvalidated(self, expected_ids):
+        self.assertEqual(self.list(), ('MISS', {str(pk) for pk in expected_ids}))
+        self.assertEqual(self.list()[0], 'HIT')
+    
+    def test_hit_after_miss(self):
+        self.assertEqual(self.list()[0], 'MISS')
+        self.assertEqual(self.list()[0], 'HIT')
+        path = f'/api/files/detail/{self.files[0].id}/'
+        self.assertEqual(self.client_api.get(path)['X-Cache'], 'MISS')
+        self.assertEqual(self.client_api.get(path)['X-Cache'], 'HIT')
+        # Entries are per user
+        self.assertEqual(self.ops.get('/api/files/list/')['X-Cache'], 'MISS')
+    
+    def test_upload_invalidates(self):
+        self.list()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.ops.post('/api/files/upload/', {
+                'file': SimpleUploadedFile('new.docx', docx(b'new'), content_type=DOCX)
+            }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        self.assertInvalidated([f.id for f in self.files] + [response.json()['file']['id']])
+    
+    def test_soft_delete_invalidates(self):
+        self.list()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.ops.delete(f'/api/files/delete/{self.files[0].id}/').status_code, 200)
+        self.assertInvalidated([f.id for f in self.files[1:]])
+        self.assertEqual(self.client_api.get(f'/api/files/detail/{self.files[0].id}/').status_code, 404)
+    
+    def test_bulk_delete_invalidates(self):
+        # A queryset update() sends no post_save; the view must bump the cache itself
+        self.list()
+        detail = f'/api/files/detail/{self.files[1].id}/'
+        self.client_api.get(detail)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.ops.post('/api/files/delete/bulk/', {
+                'file_ids': [str(self.files[0].id), str(self.files[1].id)]
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertInvalidated([self.files[2].id])
+        self.assertEqual(self.client_api.get(detail).status_code, 404)
+
+class GarbageCollectionTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        # The orphan sweep walks the whole storage, so every test gets its own
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        patcher = mock.patch('files.indexing.get_index_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = FileBlob._meta.get_field('file').storage
+        self.now = timezone.now()
+    
+    def soft_deleted(self, content, days, name='report.docx'):
+        file_obj = self.create_file(content, name)
+        UploadedFile.objects.filter(pk=file_obj.pk).update(
+            is_active=False, deleted_at=self.now - timedelta(days=days)
+        )
+        return file_obj
+    
+    def legacy_file(self, content):
+        """A row from before blobs, owning its file outright"""
+        return UploadedFile.objects.create(
+            name='legacy.docx', file=ContentFile(content, name='legacy.docx'), file_type=DOCX,
+            file_size=len(content), uploaded_by=self.ops_user
+        )
+    
+    def age(self, name, hours):
+        stamp = (self.now - timedelta(hours=hours)).timestamp()
+        os.utime(self.storage.path(name), (stamp, stamp))
+    
+    def link(self, file_obj, **fields):
+        return DownloadLink.objects.create(
+            file=file_obj, user=self.client_user, encrypted_token=get_random_string(32), **fields
+        )
+    
+    def test_download_links_past_their_retention_are_purged(self):
+        file_obj = self.create_file(b'linked')
+        day = timedelta(days=1)
+        expired = self.link(file_obj, expires_at=self.now - 8 * day)
+        used = self.link(file_obj, expires_at=self.now + day, is_used=True, used_at=self.now - 8 * day)
+        self.link(file_obj, expires_at=self.now - day)
+        self.link(file_obj, expires_at=self.now + day, is_used=True, used_at=self.now - day)
+        
+        with override_settings(DOWNLOAD_LINK_RETENTION_DAYS=7):
+            self.assertEqual(purge_download_links(self.now, batch_size=1), 2)
+        self.assertEqual(DownloadLink.objects.count(), 2)
+        self.assertFalse(DownloadLink.objects.filter(pk__in=[expired.pk, used.pk]).exists())
+    
+    def test_deleted_files_past_their_retention_are_purged(self):
+        kept = self.create_file(b'kept')
+        recent = self.soft_deleted(b'recent', days=1)
+        expired = self.soft_deleted(b'expired' * 10, days=31)
+        self.link(expired, expires_at=self.now)
+        # Soft-deleted before deleted_at existed
+        legacy = self.legacy_file(b'legacy' * 10)
+        UploadedFile.objects.filter(pk=legacy.pk).update(is_active=False, updated_at=self.now - timedelta(days=31))
+        # Shares its blob with a live row, so no bytes are freed
+        self.create_file(b'shared', 'live.docx')
+        self.soft_deleted(b'shared', days=31, name='old.docx')
+        
+        with override_settings(FILE_DELETED_RETENTION_DAYS=30), self.captureOnCommitCallbacks(execute=True):
+            rows, reclaimed = purge_deleted_files(self.now, batch_size=2)
+        
+        self.assertEqual((rows, reclaimed), (3, 70 + 60))
+        self.assertEqual(set(UploadedFile.objects.values_list('name', flat=True)), {kept.name, recent.name, 'live.docx'})
+        self.assertFalse(DownloadLink.objects.exists())
+        self.assertFalse(FileBlob.objects.filter(sha256=expired.blob.sha256).exists())
+        self.assertFalse(self.storage.exists(expired.file.name))
+        self.assertFalse(self.storage.exists(legacy.file.name))
+        self.assertTrue(FileBlob.objects.filter(sha256=content_sha256(ContentFile(b'shared'))).exists())
+    
+    def test_unreferenced_blobs_past_the_grace_period_are_deleted(self):
+        stale = FileBlob.acquire(ContentFile(b'stale' * 10), content_sha256(ContentFile(b'stale' * 10)))
+        fresh = FileBlob.acquire(ContentFile(b'fresh'), content_sha256(ContentFile(b'fresh')))
+        used = self.create_file(b'used').blob
+        FileBlob.objects.filter(pk__in=[stale.pk, used.pk]).update(created_at=self.now - timedelta(hours=25))
+        
+        with override_settings(FILE_GC_ORPHAN_GRACE_HOURS=24), self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(purge_unreferenced_blobs(self.now, batch_size=1), (1, 50))
+        self.assertEqual(set(FileBlob.objects.values_list('pk', flat=True)), {fresh.pk, used.pk})
+        self.assertFalse(self.storage.exists(stale.file.name))
+    
+    def test_orphan_sweep_keeps_referenced_and_in_flight_files(self):
+        blob_name = self.create_file(b'referenced').file.name
+        legacy_name = self.legacy_file(b'legacy').file.name
+        orphans = [
+            self.storage.save('blobs/' + 'a' * 64, ContentFile(b'orphaned blob')),
+            self.storage.save('uploads/orphan.docx', ContentFile(b'orphaned upload')),
+        ]
+        # Written by an upload whose row is not committed yet
+        in_flight = self.storage.save('blobs/' + 'b' * 64, ContentFile(b'in flight'))
+        for name in [blob_name, legacy_name, *orphans]:
+            self.age(name, hours=25)
+        
+        with override_settings(FILE_GC_ORPHAN_GRACE_HOURS=24):
+            self.assertEqual(remove_orphaned_files(self.now, batch_size=1), (2, 13 + 15))
+        for name in orphans:
+            self.assertFalse(self.storage.exists(name))
+        for name in (blob_name, legacy_name, in_flight):
+            self.assertTrue(self.storage.exists(name))
+    
+    def test_report_totals_rows_and_bytes(self):
+        expired = self.soft_deleted(b'x' * 100, days=31)
+        self.link(expired, expires_at=self.now - timedelta(days=8))
+        stale = FileBlob.acquire(ContentFile(b'y' * 200), content_sha256(ContentFile(b'y' * 200)))
+        FileBlob.objects.filter(pk=stale.pk).update(created_at=self.now - timedelta(days=2))
+        orphan = self.storage.save('uploads/orphan.docx', ContentFile(b'z' * 300))
+        self.age(orphan, hours=48)
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            report = collect_garbage()
+        self.assertEqual(report, {
+            'download_links': 1, 'files': 1, 'blobs': 1, 'orphaned_files': 1, 'bytes_reclaimed': 600,
+        })
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            report = collect_garbage(orphans=False)
+        self.assertEqual(report['bytes_reclaimed'], 0)
+
+class SearchTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('files.indexing.get_index_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.report = self.create_file(
+            word_document(['Revenue grew in every region.', 'Forecast attached.'], title='Quarterly budget', author='Ada'),
+            'report.docx', DOCX
+        )
+        self.slides = self.create_file(
+            presentation(['Kickoff', 'The budget is on track']), 'kickoff.pptx', PPTX
+        )
+        self.sheet = self.create_file(workbook(['Region', 'Headcount'], sheets=2), 'headcount.xlsx', XLSX)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(index_documents([self.report.pk, self.slides.pk, self.sheet.pk]), 3)
+    
+    def search(self, query):
+        response = self.client_api.get('/api/files/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [result['name'] for result in response.json()['files']]
+    
+    def test_extraction_reads_properties_counts_and_text(self):
+        def extract(file_obj):
+            return extract_document(file_obj.file.path, file_obj.file_type, max_chars=1000, max_xml_bytes=10 ** 6)
+        
+        self.assertEqual(extract(self.report), {
+            'title': 'Quarterly budget', 'author': 'Ada', 'page_count': None,
+            'text': 'Revenue grew in every region.\nForecast attached.\n',
+        })
+        self.assertEqual(extract(self.slides)['page_count'], 2)
+        self.assertEqual(extract(self.slides)['text'], 'Kickoff\nThe budget is on track\n')
+        self.assertEqual(extract(self.sheet)['page_count'], 2)
+        self.assertEqual(extract(self.sheet)['text'], 'Region\nHeadcount\n')
+        with self.assertRaises(ExtractionError):
+            extract_document(self.report.file.path, DOCX, max_chars=1000, max_xml_bytes=100)
+    
+    def test_indexing_stores_metadata(self):
+        metadata = UploadedFile.objects.select_related('metadata').get(pk=self.report.pk).metadata
+        self.assertEqual((metadata.status, metadata.title, metadata.author), ('indexed', 'Quarterly budget', 'Ada'))
+    
+    def test_documents_of_every_kind_are_found(self):
+        self.assertEqual(self.search('forecast'), ['report.docx'])
+        self.assertEqual(self.search('kickoff'), ['kickoff.pptx'])
+        self.assertEqual(self.search('headcount'), ['headcount.xlsx'])
+        # The last term also matches as a prefix
+        self.assertEqual(self.search('headc'), ['headcount.xlsx'])
+    
+    def test_title_matches_rank_above_body_matches(self):
+        response = self.client_api.get('/api/files/search/', {'q': 'budget'})
+        results = response.json()['files']
+        self.assertEqual([result['name'] for result in results], ['report.docx', 'kickoff.pptx'])
+        self.assertGreater(results[0]['rank'], results[1]['rank'])
+    
+    def test_soft_deleted_files_drop_out_of_results(self):
+        self.report.soft_delete()
+        self.assertEqual(self.search('budget'), ['kickoff.pptx'])
+        self.assertEqual(self.search('forecast'), [])
+
+class PreviewCacheTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('files.indexing.get_index_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Previews are keyed by content, so each test starts with an empty cache
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.enterContext(override_settings(FILE_PREVIEW_CACHE_DIR=directory))
+        self.file = self.create_file(docx(), 'report.docx', DOCX)
+        self.cache = get_preview_cache()
+    
+    def fetch(self, kind='png'):
+        preview, key = self.cache.fetch(self.file, kind)
+        with preview:
+            return preview.read()
+    
+    def test_miss_renders_and_hit_reads_the_cached_file(self):
+        key = self.file.blob.sha256
+        self.assertFalse(self.cache.has(key))
+        self.assertTrue(self.fetch().startswith(b'\x89PNG'))
+        self.assertTrue(self.cache.has(key))
+        
+        with mock.patch('files.previews.render_preview') as render:
+            self.assertIn(b'Quarterly report', self.fetch('html'))
+        render.assert_not_called()
+    
+    def test_version_bump_renders_again(self):
+        self.fetch()
+        with mock.patch('files.previews.PREVIEW_VERSION', 2):
+            with mock.patch('files.previews.render_preview', wraps=render_preview) as render:
+                self.assertTrue(self.fetch().startswith(b'\x89PNG'))
+            render.assert_called_once()
+            self.assertTrue(self.cache.path(self.file.blob.sha256, 'png').name.endswith('-v2.png'))
+            self.assertTrue(self.cache.has(self.file.blob.sha256))
+    
+    def test_eviction_drops_least_recently_used_files(self):
+        directory = settings.FILE_PREVIEW_CACHE_DIR
+        cache = PreviewCache(directory, max_bytes=1000)
+        now = timezone.now().timestamp()
+        
+        def write(name, age):
+            path = os.path.join(directory, name)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 300)
+            os.utime(path, (now - age, now - age))
+            return path
+        
+        # Another worker is still sealing this one
+        in_flight = write('tmpabc.tmp', age=50)
+        oldest, older, newer = write('a.png', age=40), write('b.png', age=30), write('c.png', age=20)
+        cache.added(300)
+        self.assertTrue(all(os.path.exists(path) for path in (in_flight, oldest, older, newer)))
+        
+        newest = write('d.png', age=10)
+        cache.added(300)
+        # 1200 bytes of previews trimmed to EVICT_TO of the bound
+        self.assertLessEqual(cache._size, 1000 * EVICT_TO)
+        self.assertFalse(os.path.exists(oldest))
+        self.assertTrue(all(os.path.exists(path) for path in (in_flight, older, newer, newest)))
+
+@contextmanager
+def files_storage(storage):
+    """Store FileBlob and UploadedFile content in `storage` (the fields resolve STORAGES once)"""
+    with mock.patch.object(FileBlob._meta.get_field('file'), 'storage', storage), \
+            mock.patch.object(UploadedFile._meta.get_field('file'), 'storage', storage):
+        yield storage
+
+def sharded_name(sha256):
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+class ShardedStorageTests(FilesTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('files.indexing.get_index_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.enterContext(files_storage(ShardedFileSystemStorage()))
+    
+    def test_blob_names_round_trip_through_the_database(self):
+        file_obj = self.create_file(b'sharded content')
+        sha256 = file_obj.blob.sha256
+        
+        stored = UploadedFile.objects.select_related('blob').get(pk=file_obj.pk)
+        self.assertEqual(stored.blob.file.name, sharded_name(sha256))
+        self.assertEqual(stored.file.name, sharded_name(sha256))
+        self.assertTrue(os.path.exists(os.path.join(settings.MEDIA_ROOT, *sharded_name(sha256).split('/'))))
+        with stored.file.open('rb') as f:
+            self.assertEqual(f.read(), b'sharded content')
+        # Duplicate content reuses the stored name
+        self.assertEqual(self.create_file(b'sharded content', 'copy.docx').file.name, sharded_name(sha256))
+    
+    def test_other_names_are_sharded_by_their_hash(self):
+        legacy = UploadedFile.objects.create(
+            name='legacy.docx', file=ContentFile(b'legacy', name='legacy.docx'), file_type=DOCX,
+            file_size=6, uploaded_by=self.ops_user
+        )
+        name = UploadedFile.objects.get(pk=legacy.pk).file.name
+        directory, base = name.rsplit('/', 1)
+        key = hashlib.sha256(base.encode()).hexdigest()
+        self.assertEqual(directory, f'uploads/{key[:2]}/{key[2:4]}')
+
+@override_settings(
+    FILE_S3_MULTIPART_THRESHOLD=5 * 1024 * 1024,
+    FILE_S3_MULTIPART_CHUNK_SIZE=5 * 1024 * 1024,
+    # Parts in order, as the stubbed responses are queued
+    FILE_S3_MAX_CONCURRENCY=1,
+)
+class S3StorageTests(FilesTestCase):
+    """files.s3.S3Storage against a stubbed S3 client; `check_storage` covers a real bucket"""
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('files.indexing.get_index_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.storage = S3Storage(bucket_name='files', access_key='test', secret_key='test', region_name='us-east-1')
+        self.stubber = Stubber(self.storage.connection.meta.client)
+        self.enterContext(self.stubber)
+        self.enterContext(files_storage(self.storage))
+    
+    def test_ranged_read_fetches_only_the_range(self):
+        data = os.urandom(1000)
+        self.stubber.add_response(
+            'get_object', {'Body': StreamingBody(io.BytesIO(data[100:300]), 200)},
+            {'Bucket': 'files', 'Key': 'blobs/ab/cd/abcd', 'Range': 'bytes=100-299'}
+        )
+        self.assertEqual(b''.join(iter_range(self.storage, 'blobs/ab/cd/abcd', 100, 200, 64)), data[100:300])
+        self.assertEqual(list(self.storage.iter_range('blobs/ab/cd/abcd', 0, 0, 64)), [])
+        self.stubber.assert_no_pending_responses()
+    
+    def test_large_content_is_uploaded_in_parts_under_a_sharded_key(self):
+        content = ContentFile(os.urandom(6 * 1024 * 1024))
+        sha256 = content_sha256(content)
+        key = sharded_name(sha256)
+        self.stubber.add_client_error('head_object', service_error_code='404', http_status_code=404)
+        self.stubber.add_response(
+            'create_multipart_upload', {'UploadId': 'upload-1'}, {'Bucket': 'files', 'Key': key, 'ContentType': ANY}
+        )
+        for number in (1, 2):
+            self.stubber.add_response('upload_part', {'ETag': f'"part-{number}"'}, {
+                'Bucket': 'files', 'Key': key, 'UploadId': 'upload-1', 'PartNumber': number, 'Body': ANY,
+            })
+        self.stubber.add_response('complete_multipart_upload', {}, {
+            'Bucket': 'files', 'Key': key, 'UploadId': 'upload-1', 'MultipartUpload': {'Parts': [
+                {'ETag': '"part-1"', 'PartNumber': 1}, {'ETag': '"part-2"', 'PartNumber': 2},
+            ]},
+        })
+        
+        blob = FileBlob.acquire(content, sha256)
+        self.stubber.assert_no_pending_responses()
+        self.assertEqual(FileBlob.objects.get(pk=blob.pk).file.name, key)
+    
+    def test_downloads_redirect_to_a_presigned_url(self):
+        sha256 = 'ab' * 32
+        blob = FileBlob.objects.create(sha256=sha256, file=sharded_name(sha256), size=1000, ref_count=1)
+        file_obj = UploadedFile.objects.create(
+            name='report.docx', file=blob.file.name, blob=blob, file_type=DOCX, file_size=1000,
+            uploaded_by=self.ops_user
+        )
+        # One HEAD for the size; the bytes come from the bucket, not through us
+        self.stubber.add_response(
+            'head_object', {'ContentLength': 1000}, {'Bucket': 'files', 'Key': sharded_name(sha256)}
+        )
+        with override_settings(FILE_DELIVERY_BACKEND='files.delivery.RedirectDelivery'):
+            response = self.client_api.get(self.download_path(file_obj))
+        
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response['Cache-Control'], 'private, no-store')
+        url = urlsplit(response['Location'])
+        query = parse_qs(url.query)
+        self.assertEqual(url.path, '/' + sharded_name(sha256))
+        self.assertEqual(query['response-content-disposition'], ['attachment; filename="report.docx"'])
+        self.assertEqual(query['response-content-type'], [DOCX])
+        self.assertIn('Signature', query)
+        self.assertLessEqual(int(query['Expires'][0]), time.time() + settings.AWS_QUERYSTRING_EXPIRE + 1)
+        self.stubber.assert_no_pending_responses()
+        self.assertTrue(DownloadLink.objects.get().is_used)
+
+@override_settings(
+    FILE_COMPRESSION_ENABLED=True,
+    FILE_COMPRESSION_TYPES={'text/csv': 'gzip', 'text/plain': 'zstd'},
+    FILE_COMPRESSION_MIN_SIZE=1024,
+    FILE_COMPRESSION_MIN_SAVING=0.1,
+)
+class CompressionTests(FilesTestCase):
+    csv = b''.join(f'{i},region-{i % 7},{i * 31 % 1000}\n'.encode() for i in range(20000))
+    
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('files.indexing.get_index_queue')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+    
+    def encoding_for(self, content, file_type):
+        return self.create_file(content, 'data.bin', file_type).blob.encoding
+    
+    def download(self, file_obj, **headers):
+        response = self.client_api.get(self.download_path(file_obj), **headers)
+        response.body = b''.join(response.streaming_content)
+        response.close()
+        return response
+    
+    def test_codec_follows_the_content_type(self):
+        self.assertEqual(self.encoding_for(self.csv, 'text/csv'), 'gzip')
+        # zstd falls back to gzip without the zstandard package
+        self.assertEqual(self.encoding_for(b'plain ' * 1000, 'text/plain'), 'zstd' if 'zstd' in CODECS else 'gzip')
+        self.assertEqual(self.encoding_for(b'<a/>' * 1000, 'application/xml'), '')
+        self.assertEqual(self.encoding_for(b'1,2\n' * 100, 'text/csv'), '')
+        with override_settings(FILE_COMPRESSION_ENABLED=False):
+            self.assertEqual(self.encoding_for(self.csv + b'\n', 'text/csv'), '')
+    
+    def test_content_that_compresses_poorly_is_stored_as_is(self):
+        self.assertEqual(self.encoding_for(os.urandom(256 * 1024), 'text/csv'), '')
+        # The probe compresses well, the rest does not
+        self.assertEqual(self.encoding_for(b'0' * PROBE_SIZE + os.urandom(1024 * 1024), 'text/csv'), '')
+    
+    def test_compress_for_storage_returns_a_smaller_file(self):
+        content = ContentFile(self.csv)
+        stored, encoding = compress_for_storage(content, 'text/csv')
+        with stored:
+            compressed = stored.read()
+        self.assertEqual(encoding, 'gzip')
+        self.assertLess(len(compressed), len(self.csv) * 0.9)
+        self.assertEqual(b''.join(decompress_chunks('gzip', [compressed])), self.csv)
+        self.assertEqual(content.tell(), 0)
+    
+    def test_clients_accepting_the_codec_get_the_stored_bytes(self):
+        file_obj = self.create_file(self.csv, 'data.csv', 'text/csv')
+        response = self.download(file_obj, HTTP_ACCEPT_ENCODING='br, gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(int(response['Content-Length']), file_obj.file.size)
+        self.assertLess(len(response.body), len(self.csv))
+        self.assertEqual(gzip.decompress(response.body), self.csv)
+    
+    def test_other_clients_get_the_content_decompressed(self):
+        file_obj = self.create_file(self.csv, 'data.csv', 'text/csv')
+        for accept in ({}, {'HTTP_ACCEPT_ENCODING': 'br'}, {'HTTP_ACCEPT_ENCODING': 'gzip;q=0'}):
+            response = self.download(file_obj, **accept)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(response.body, self.csv)
+    
+    def test_ranges_address_the_decompressed_content(self):
+        file_obj = self.create_file(self.csv, 'data.csv', 'text/csv')
+        response = self.download(file_obj, HTTP_RANGE='bytes=1000-1999', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 206)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Content-Range'], f'bytes 1000-1999/{len(self.csv)}')
+        self.assertEqual(response.body, self.csv[1000:2000])
@@ -0,0 +1,114 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+from django.http import JsonResponse
+
+from .ooxml import NotOOXML, OOXMLSniffer, read_ooxml_type
+
+class HashingFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Spool uploads to a temp file and compute their SHA-256 as chunks arrive,
+    so deduplication never needs a second pass over the data.
+    
+    The same pass checks the bytes against the declared type: the OOXML
+    package is identified from its leading ZIP entries, and a file is skipped
+    (its remaining bytes are neither written nor hashed) as soon as the type
+    is wrong or the size limit is crossed. A package whose type isn't settled
+    within FILE_UPLOAD_SNIFF_BYTES is checked through its central directory
+    once complete. Rejected files are listed on `request.upload_rejections`
+    with their position among the request's files.
+    
+    Attach it with @hashing_uploads rather than FILE_UPLOAD_HANDLERS, so
+    only the upload views pay for it.
+    """
+    
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.files_seen = 0
+        if request is not None:
+            request.upload_rejections = []
+    
+    def new_file(self, field_name, file_name, content_type, *args, **kwargs):
+        super().new_file(field_name, file_name, content_type, *args, **kwargs)
+        self.files_seen += 1
+        self.sha256 = hashlib.sha256()
+        self.sniffer = OOXMLSniffer(settings.FILE_UPLOAD_SNIFF_BYTES)
+        if content_type not in settings.ALLOWED_FILE_TYPES:
+            self.reject("Only PPTX, DOCX, and XLSX files are allowed.")
+    
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.FILE_UPLOAD_MAX_SIZE:
+            self.reject("File size cannot exceed 50MB.")
+        if not self.sniffer.document_type:
+            try:
+                document_type = self.sniffer.feed(raw_data)
+            except NotOOXML as e:
+                self.reject(str(e))
+            if document_type and document_type != self.content_type:
+                self.reject("File contents do not match its declared type.")
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+    
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        try:
+            document_type = self.sniffer.close() or read_ooxml_type(file)
+        except NotOOXML as e:
+            message = str(e)
+        else:
+            message = None if document_type == self.content_type else 'File contents do not match its declared type.'
+        if message:
+            # Too late for SkipFile; returning None leaves the file out
+            self.record_rejection(message)
+            file.close()
+            return None
+        file.sha256 = self.sha256.hexdigest()
+        return file
+    
+    def record_rejection(self, message):
+        self.request.upload_rejections.append({
+            'index': self.files_seen - 1,
+            'name': self.file_name,
+            'message': message
+        })
+    
+    def reject(self, message):
+        self.record_rejection(message)
+        raise SkipFile()
+
+def hashing_uploads(view):
+    """
+    Parse the view's uploads with HashingFileUploadHandler. Apply outside
+    @api_view: handlers can't change once the body is read, and
+    authentication may read it.
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        request.upload_handlers = [HashingFileUploadHandler(request)]
+        return view(request, *args, **kwargs)
+    return wrapper
+
+def limit_request_size(setting):
+    """
+    Answer 413 to requests whose body is larger than settings.<setting>,
+    before any of it is read. Apply outside @api_view, since authentication
+    may already parse the body.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            limit = getattr(settings, setting)
+            try:
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            if length > limit:
+                return JsonResponse({
+                    'success': False,
+                    'message': f'Request cannot exceed {limit // (1024 * 1024)}MB in total.'
+                }, status=413)
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -3,9 +3,21 @@ from . import views
 
 urlpatterns = [
     path('upload/', views.upload_file, name='upload_file'),
+    path('upload/bulk/', views.bulk_upload_files, name='bulk_upload_files'),
+    path('upload-sessions/', views.create_upload_session, name='create_upload_session'),
+    path('upload-sessions/<uuid:session_id>/', views.upload_session_detail, name='upload_session_detail'),
+    path('upload-sessions/<uuid:session_id>/chunks/<int:index>/', views.upload_chunk, name='upload_chunk'),
+    path('upload-sessions/<uuid:session_id>/finalize/', views.finalize_upload_session, name='finalize_upload_session'),
     path('list/', views.list_files, name='list_files'),
+    path('search/', views.search_files, name='search_files'),
     path('download/<uuid:file_id>/', views.generate_download_link, name='generate_download_link'),
+    path('download/batch/', views.generate_batch_download_links, name='generate_batch_download_links'),
     path('secure-download/<str:token>/', views.secure_download, name='secure_download'),
+    path('secure-zip/<str:token>/', views.secure_download_zip, name='secure_download_zip'),
     path('delete/<uuid:file_id>/', views.delete_file, name='delete_file'),
+    path('delete/bulk/', views.bulk_delete_files, name='bulk_delete_files'),
     path('detail/<uuid:file_id>/', views.file_detail, name='file_detail'),
+    path('preview/<uuid:file_id>/', views.file_preview, name='file_preview'),
+    path('preview/<uuid:file_id>/thumbnail/', views.file_thumbnail, name='file_thumbnail'),
+    path('cache-stats/', views.cache_stats, name='cache_stats'),
 ]
\ No newline at end of file
@@ -1,52 +1,257 @@
-import secrets
-import base64
+import hashlib
 import json
-from cryptography.fernet import Fernet
-from django.conf import settings
+import os
+import secrets
+from django.core.files import File
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from secure_file_sharing import crypto
 
 def generate_secure_download_token(file_obj, user):
     """Generate encrypted download token"""
     try:
-        # Create Fernet instance with the encryption key
-        key = base64.urlsafe_b64encode(settings.ENCRYPTION_KEY.encode()[:32].ljust(32, b'0'))
-        fernet = Fernet(key)
-        
-        # Create token data
+        # Create token data (Fernet adds a random IV, so every token is unique)
         token_data = {
             'file_id': str(file_obj.id),
             'user_id': str(user.id),
-            'timestamp': str(secrets.randbits(64))  # Add randomness
         }
         
-        # Convert to JSON and encrypt
-        json_data = json.dumps(token_data)
-        encrypted_token = fernet.encrypt(json_data.encode())
-        
-        # Encode to base64 for URL safety
-        url_safe_token = base64.urlsafe_b64encode(encrypted_token).decode()
-        
-        return url_safe_token
+        # Convert to compact JSON and encrypt
+        json_data = json.dumps(token_data, separators=(',', ':'))
+        return crypto.encrypt(json_data.encode())
     except Exception as e:
         print(f"Token generation error: {e}")
         return None
 
-def decrypt_download_token(encrypted_token):
-    """Decrypt download token and return file_id and user_id"""
+def generate_stateless_download_token(file_obj, user, expires_at):
+    """
+    Generate a self-contained download token. The grant (file, user, expiry and
+    a one-time nonce) travels inside the encrypted token instead of a DownloadLink row.
+    """
+    token_data = {
+        'file_id': str(file_obj.id),
+        'user_id': str(user.id),
+        'exp': int(expires_at.timestamp()),
+        'nonce': secrets.token_urlsafe(12),
+    }
+    json_data = json.dumps(token_data, separators=(',', ':'))
+    return crypto.encrypt(json_data.encode())
+
+def generate_zip_download_token(user, expires_at, batch_id=None, files=None):
+    """
+    Generate a token for one ZIP of several files. Stateful links point at the
+    batch of DownloadLink rows; stateless ones carry the file ids and a nonce.
+    """
+    token_data = {
+        'zip': 1,
+        'user_id': str(user.id),
+        'exp': int(expires_at.timestamp()),
+    }
+    if batch_id:
+        token_data['batch_id'] = batch_id.hex
+    else:
+        token_data['file_ids'] = [file_obj.id.hex for file_obj in files]
+        token_data['nonce'] = secrets.token_urlsafe(12)
+    json_data = json.dumps(token_data, separators=(',', ':'))
+    return crypto.encrypt(json_data.encode())
+
+def decode_download_token(encrypted_token):
+    """Decrypt download token and return its payload"""
     try:
-        # Create Fernet instance with the encryption key
-        key = base64.urlsafe_b64encode(settings.ENCRYPTION_KEY.encode()[:32].ljust(32, b'0'))
-        fernet = Fernet(key)
-        
-        # Decode from base64
-        encrypted_data = base64.urlsafe_b64decode(encrypted_token.encode())
-        
         # Decrypt the token
-        decrypted_data = fernet.decrypt(encrypted_data).decode()
+        decrypted_data = crypto.decrypt(encrypted_token).decode()
         
         # Parse JSON
         token_data = json.loads(decrypted_data)
+        if 'user_id' not in token_data or not ('file_id' in token_data or 'zip' in token_data):
+            raise ValueError("Missing token fields")
         
-        return token_data['file_id'], token_data['user_id']
+        return token_data
     except Exception as e:
         print(f"Token decryption error: {e}")
-        raise ValueError("Invalid token")
\ No newline at end of file
+        raise ValueError("Invalid token")
+
+def decrypt_download_token(encrypted_token):
+    """Decrypt download token and return file_id and user_id"""
+    token_data = decode_download_token(encrypted_token)
+    return token_data['file_id'], token_data['user_id']
+
+MAX_RANGES = 16
+
+def file_etag(file_obj, encoding=''):
+    """Strong ETag for a stored file: its content hash when deduplicated, tagged with any Content-Encoding"""
+    if file_obj.blob_id:
+        return f'"{file_obj.blob.sha256}-{encoding}"' if encoding else f'"{file_obj.blob.sha256}"'
+    # Legacy uploads are immutable once written
+    return f'"{file_obj.id.hex}-{file_obj.file_size}"'
+
+def collection_etag(version, request):
+    """Strong ETag for a list/detail payload: data version plus the exact URL"""
+    digest = hashlib.sha256(f'{version}|{request.build_absolute_uri()}'.encode()).hexdigest()
+    return f'"{digest[:32]}"'
+
+def conditional_response(request, etag, last_modified):
+    """
+    304 (or 412) when the request's If-None-Match / If-Modified-Since
+    validators still match, otherwise None.
+    """
+    response = get_conditional_response(
+        request,
+        etag=etag,
+        last_modified=int(last_modified.timestamp()) if last_modified else None
+    )
+    if response is not None:
+        set_validators(response, etag, last_modified)
+    return response
+
+def set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+def accepts_encoding(header, encoding):
+    """Whether an Accept-Encoding header allows `encoding`, by name or through `*`, with q > 0"""
+    qualities = {}
+    for item in (header or '').split(','):
+        coding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    return qualities.get(encoding, qualities.get('*', 0.0)) > 0
+
+def parse_range_header(header, size):
+    """
+    Parse an HTTP Range header into a list of inclusive (start, end) tuples.
+    
+    Returns None when the header is absent, malformed or not worth honouring
+    (the full file should be served), and an empty list when none of the
+    requested ranges can be satisfied (416).
+    """
+    if not header:
+        return None
+    
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+    
+    ranges = []
+    for part in spec.split(','):
+        part = part.strip()
+        if '-' not in part:
+            return None
+        first, _, last = part.partition('-')
+        try:
+            if first == '':
+                # Suffix range: the last N bytes
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if last and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    
+    if len(ranges) > MAX_RANGES:
+        return None
+    return ranges
+
+def if_range_matches(if_range, etag, last_modified):
+    """Check whether a Range request's If-Range precondition still holds"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Only strong comparison is allowed for If-Range
+        return if_range == etag
+    parsed = parse_http_date_safe(if_range)
+    return parsed is not None and parsed == int(last_modified.timestamp())
+
+def merge_ranges(ranges):
+    """Sorted, non-overlapping union of inclusive (start, end) byte ranges"""
+    merged = []
+    for start, end in sorted(tuple(r) for r in ranges):
+        if end < start:
+            continue
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+def ranges_length(ranges):
+    """Number of distinct bytes in inclusive (start, end) byte ranges"""
+    return sum(end - start + 1 for start, end in merge_ranges(ranges))
+
+def iter_file_range(file_handle, start, length, chunk_size):
+    """Yield `length` bytes of an open file starting at `start`"""
+    file_handle.seek(start)
+    remaining = length
+    while remaining > 0:
+        chunk = file_handle.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+class SessionFile(File):
+    """Finished upload session file that the storage can move into place instead of copying"""
+    def temporary_file_path(self):
+        return self.file.name
+
+def append_chunk(path, offset, stream, max_bytes, block_size=64 * 1024):
+    """
+    Write a request body into the session file at `offset`, hashing it on the
+    way through. At most `max_bytes + 1` bytes are read so an oversized chunk
+    is detected without consuming the rest of it.
+    
+    Returns (bytes_written, sha256 hexdigest).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    digest = hashlib.sha256()
+    written = 0
+    with open(path, 'r+b' if os.path.exists(path) else 'wb') as f:
+        f.seek(offset)
+        f.truncate()
+        while written <= max_bytes:
+            block = stream.read(min(block_size, max_bytes + 1 - written)) if stream else b''
+            if not block:
+                break
+            written += len(block)
+            digest.update(block)
+            f.write(block)
+    return written, digest.hexdigest()
+
+def truncate_file(path, size):
+    """Roll a session file back to `size` bytes after a rejected chunk"""
+    if os.path.exists(path):
+        with open(path, 'r+b') as f:
+            f.truncate(size)
+
+def file_sha256(path, block_size=64 * 1024):
+    """SHA-256 of a file on disk, read in fixed-size blocks"""
+    with open(path, 'rb') as f:
+        return content_sha256(File(f), block_size)
+
+def content_sha256(content, block_size=64 * 1024):
+    """SHA-256 of a Django File, read in chunks"""
+    digest = hashlib.sha256()
+    for block in content.chunks(block_size):
+        digest.update(block)
+    content.seek(0)
+    return digest.hexdigest()
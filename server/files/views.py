@@ -3,18 +3,48 @@ from rest_framework.decorators import api_view, permission_classes, parser_class
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+from django.http import FileResponse, Http404
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse, Http404
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
-from datetime import timedelta
-import mimetypes
-import os
+from datetime import datetime, timedelta, timezone as dt_timezone
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import secrets
+import uuid
 
-from .models import UploadedFile, DownloadLink
-from .serializers import UploadedFileSerializer, FileUploadSerializer, DownloadLinkSerializer
-from .utils import generate_secure_download_token, decrypt_download_token
+from .models import UploadedFile, DownloadBatch, DownloadLink, UploadSession
+from .serializers import (
+    UploadedFileSerializer, FileUploadSerializer, DownloadLinkSerializer, UploadSessionSerializer,
+    BatchDownloadSerializer, FileIdsSerializer, SearchResultSerializer
+)
+from .utils import (
+    generate_secure_download_token, generate_stateless_download_token, generate_zip_download_token,
+    decode_download_token, SessionFile, append_chunk, truncate_file, file_sha256, content_sha256,
+    collection_etag, conditional_response, set_validators
+)
+from .archives import zip_response
+from .audit import get_audit_writer
+from .cache import get_file_cache
+from .delivery import get_delivery_backend
+from .extraction import ExtractionError
+from .filters import filter_files
+from .indexing import schedule_indexing
+from .nonces import StatelessDownloadLink
+from .ooxml import NotOOXML, sniff_ooxml
+from .pagination import FileCursorPagination
+from .previews import PREVIEW_VERSION, get_preview_cache
+from .search import get_search_index
+from .signals import invalidate_file_cache
+from .upload_handlers import hashing_uploads, limit_request_size
 from accounts.models import User
 
+logger = logging.getLogger(__name__)
+
+@hashing_uploads
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 @parser_classes([MultiPartParser, FormParser])
@@ -29,7 +59,17 @@ def upload_file(request):
             'message': 'Only operations users can upload files.'
         }, status=status.HTTP_403_FORBIDDEN)
     
-    serializer = FileUploadSerializer(data=request.data, context={'request': request})
+    data = request.data
+    rejections = getattr(request, 'upload_rejections', None)
+    if rejections:
+        # The upload handler stopped storing the file, or left it out once complete
+        return Response({
+            'success': False,
+            'message': 'File upload failed.',
+            'errors': {'file': [rejections[0]['message']]}
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = FileUploadSerializer(data=data, context={'request': request})
     if serializer.is_valid():
         uploaded_file = serializer.save()
         
@@ -45,19 +85,402 @@ def upload_file(request):
         'errors': serializer.errors
     }, status=status.HTTP_400_BAD_REQUEST)
 
+@limit_request_size('FILE_BULK_MAX_TOTAL_SIZE')
+@hashing_uploads
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([MultiPartParser, FormParser])
+def bulk_upload_files(request):
+    """
+    Upload many files in one request (repeated `files` fields) - Only for operations users
+    
+    Every file is validated on its own and reported per item; valid files are
+    stored in parallel and inserted with one bulk INSERT, falling back to one
+    file at a time when the batch fails.
+    """
+    if request.user.user_type != 'operations':
+        return Response({
+            'success': False,
+            'message': 'Only operations users can upload files.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    uploads = request.FILES.getlist('files')
+    # Files the upload handler skipped never reach request.FILES
+    rejections = getattr(request, 'upload_rejections', [])
+    if not uploads and not rejections:
+        return Response({
+            'success': False,
+            'message': 'No files were provided.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    if len(uploads) + len(rejections) > settings.FILE_BULK_MAX_FILES:
+        return Response({
+            'success': False,
+            'message': f'At most {settings.FILE_BULK_MAX_FILES} files can be uploaded at once.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    results = [None] * (len(uploads) + len(rejections))
+    for rejection in rejections:
+        results[rejection['index']] = {'name': rejection['name'], 'success': False, 'errors': [rejection['message']]}
+    valid = []
+    positions = (index for index, result in enumerate(results) if result is None)
+    for index, upload in zip(positions, uploads):
+        serializer = FileUploadSerializer(data={'file': upload}, context={'request': request})
+        if serializer.is_valid():
+            valid.append((index, serializer.validated_data['file']))
+        else:
+            results[index] = {'name': upload.name, 'success': False, 'errors': serializer.errors['file']}
+    
+    if valid:
+        with ThreadPoolExecutor(max_workers=settings.FILE_BULK_UPLOAD_WORKERS) as pool:
+            # The upload handler has usually hashed the file already
+            hashes = list(pool.map(
+                lambda upload: getattr(upload, 'sha256', None) or content_sha256(upload),
+                [upload for _, upload in valid]
+            ))
+        created = UploadedFile.bulk_create_from_contents([
+            (upload, sha256, {
+                'name': upload.name,
+                'file_type': upload.content_type,
+                'file_size': upload.size,
+                'uploaded_by': request.user
+            })
+            for (_, upload), sha256 in zip(valid, hashes)
+        ], workers=settings.FILE_BULK_UPLOAD_WORKERS)
+        uploaded_files = []
+        for (index, upload), result in zip(valid, created):
+            if isinstance(result, Exception):
+                logger.error('Bulk upload of %s failed', upload.name, exc_info=result)
+                results[index] = {'name': upload.name, 'success': False, 'errors': ['File could not be stored.']}
+            else:
+                uploaded_files.append(result)
+                results[index] = {'name': upload.name, 'success': True, 'file': UploadedFileSerializer(result).data}
+        if uploaded_files:
+            # bulk_create sends no post_save
+            invalidate_file_cache()
+            schedule_indexing(uploaded_file.pk for uploaded_file in uploaded_files)
+    
+    return _bulk_response(results, 'uploaded', status.HTTP_201_CREATED)
+
+def _bulk_response(results, action, success_status):
+    """201/200 when every item succeeded, 207 on partial failure, 400 when all failed"""
+    succeeded = sum(1 for result in results if result['success'])
+    if succeeded == len(results):
+        response_status = success_status
+    elif succeeded:
+        response_status = status.HTTP_207_MULTI_STATUS
+    else:
+        response_status = status.HTTP_400_BAD_REQUEST
+    
+    return Response({
+        'success': succeeded == len(results),
+        'message': f'{succeeded} of {len(results)} files {action}.',
+        'results': results
+    }, status=response_status)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def create_upload_session(request):
+    """
+    Start a chunked, resumable upload - Only for operations users
+    """
+    if request.user.user_type != 'operations':
+        return Response({
+            'success': False,
+            'message': 'Only operations users can upload files.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    # Reclaim temp space from abandoned sessions as new ones are opened
+    UploadSession.purge_expired(limit=20)
+    
+    serializer = UploadSessionSerializer(data=request.data, context={'request': request})
+    if serializer.is_valid():
+        session = serializer.save()
+        
+        return Response({
+            'success': True,
+            'message': 'Upload session created.',
+            'session': UploadSessionSerializer(session).data
+        }, status=status.HTTP_201_CREATED)
+    
+    return Response({
+        'success': False,
+        'message': 'Upload session could not be created.',
+        'errors': serializer.errors
+    }, status=status.HTTP_400_BAD_REQUEST)
+
+def _get_upload_session(request, session_id):
+    return get_object_or_404(
+        UploadSession,
+        id=session_id,
+        user=request.user,
+        is_finalized=False,
+        expires_at__gt=timezone.now()
+    )
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def upload_session_detail(request, session_id):
+    """
+    Get upload session progress so an interrupted upload can resume
+    """
+    session = _get_upload_session(request, session_id)
+    
+    return Response({
+        'success': True,
+        'session': UploadSessionSerializer(session).data
+    }, status=status.HTTP_200_OK)
+
+@api_view(['PUT'])
+@permission_classes([IsAuthenticated])
+def upload_chunk(request, session_id, index):
+    """
+    Append chunk `index` to an upload session.
+    
+    The raw request body is the chunk and the X-Chunk-SHA256 header carries its
+    hex digest. Chunks must arrive in order; re-sending an accepted chunk is a no-op.
+    A PUT claims the session before writing, so concurrent PUTs of the same
+    chunk cannot interleave their bytes in the session file.
+    """
+    session = _get_upload_session(request, session_id)
+    
+    if index < session.next_chunk:
+        return Response({
+            'success': True,
+            'message': 'Chunk already received.',
+            'session': UploadSessionSerializer(session).data
+        }, status=status.HTTP_200_OK)
+    
+    if index > session.next_chunk:
+        return Response({
+            'success': False,
+            'message': f'Expected chunk {session.next_chunk}.',
+            'session': UploadSessionSerializer(session).data
+        }, status=status.HTTP_409_CONFLICT)
+    
+    expected_checksum = request.META.get('HTTP_X_CHUNK_SHA256', '').strip().lower()
+    if not expected_checksum:
+        return Response({
+            'success': False,
+            'message': 'X-Chunk-SHA256 header is required.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    lease, now = secrets.token_hex(16), timezone.now()
+    claimed = UploadSession.objects.filter(
+        Q(chunk_lease_expires_at__isnull=True) | Q(chunk_lease_expires_at__lt=now),
+        pk=session.pk,
+        next_chunk=index,
+        is_finalized=False
+    ).update(
+        chunk_lease=lease,
+        chunk_lease_expires_at=now + timedelta(seconds=settings.FILE_UPLOAD_CHUNK_LEASE_SECONDS)
+    )
+    if not claimed:
+        return Response({
+            'success': False,
+            'message': 'Chunk is being uploaded concurrently.'
+        }, status=status.HTTP_409_CONFLICT)
+    
+    try:
+        # Every chunk but the last is exactly chunk_size bytes
+        expected_size = min(session.chunk_size, session.total_size - session.received_bytes)
+        written, checksum = append_chunk(session.temp_path, session.received_bytes, request.stream, expected_size)
+        
+        if written != expected_size or checksum != expected_checksum:
+            truncate_file(session.temp_path, session.received_bytes)
+            return Response({
+                'success': False,
+                'message': 'Chunk rejected: size or checksum mismatch.',
+                'session': UploadSessionSerializer(session).data
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        updated = UploadSession.objects.filter(pk=session.pk, chunk_lease=lease).update(
+            next_chunk=index + 1,
+            received_bytes=session.received_bytes + written,
+            chunk_lease='',
+            chunk_lease_expires_at=None,
+            expires_at=timezone.now() + timedelta(hours=settings.FILE_UPLOAD_SESSION_TTL_HOURS)
+        )
+        if not updated:
+            return Response({
+                'success': False,
+                'message': 'Chunk was uploaded concurrently.'
+            }, status=status.HTTP_409_CONFLICT)
+    finally:
+        UploadSession.objects.filter(pk=session.pk, chunk_lease=lease).update(
+            chunk_lease='', chunk_lease_expires_at=None
+        )
+    
+    session.refresh_from_db()
+    return Response({
+        'success': True,
+        'message': 'Chunk received.',
+        'session': UploadSessionSerializer(session).data
+    }, status=status.HTTP_200_OK)
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def finalize_upload_session(request, session_id):
+    """
+    Turn a fully received upload session into an UploadedFile.
+    
+    An optional `sha256` of the whole file is verified before the file is moved
+    into deduplicated storage; the file is never loaded into memory.
+    """
+    session = _get_upload_session(request, session_id)
+    
+    if not session.is_complete:
+        return Response({
+            'success': False,
+            'message': 'Upload is not complete.',
+            'session': UploadSessionSerializer(session).data
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Chunks arrive as raw bodies, so the contents are checked once assembled
+    try:
+        with open(session.temp_path, 'rb') as f:
+            document_type = sniff_ooxml(f, settings.FILE_UPLOAD_SNIFF_BYTES)
+    except NotOOXML as e:
+        document_type, message = None, str(e)
+    else:
+        message = 'File contents do not match its declared type.'
+    if document_type != session.file_type:
+        session.delete()
+        return Response({
+            'success': False,
+            'message': message
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    sha256 = file_sha256(session.temp_path)
+    expected_checksum = str(request.data.get('sha256', '')).strip().lower()
+    if expected_checksum and sha256 != expected_checksum:
+        return Response({
+            'success': False,
+            'message': 'File checksum mismatch.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    with transaction.atomic():
+        session = get_object_or_404(
+            UploadSession.objects.select_for_update(),
+            pk=session.pk,
+            is_finalized=False
+        )
+        
+        with open(session.temp_path, 'rb') as f:
+            uploaded_file = UploadedFile.create_from_content(
+                SessionFile(f),
+                sha256,
+                name=session.file_name,
+                file_type=session.file_type,
+                file_size=session.total_size,
+                uploaded_by=request.user
+            )
+        
+        session.uploaded_file, session.is_finalized = uploaded_file, True
+        session.save(update_fields=['uploaded_file', 'is_finalized'])
+    
+    return Response({
+        'success': True,
+        'message': 'File uploaded successfully.',
+        'file': UploadedFileSerializer(uploaded_file).data
+    }, status=status.HTTP_201_CREATED)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def list_files(request):
     """
-    List all uploaded files - Available to all authenticated users
+    List uploaded files - Available to all authenticated users
+    
+    Cursor-paginated newest first (`cursor`, `limit`), filterable by `file_type`,
+    `uploader`, `uploaded_after`, `uploaded_before` and `name` prefix, with an
+    optional comma-separated `fields` selection.
     """
-    files = UploadedFile.objects.filter(is_active=True)
-    serializer = UploadedFileSerializer(files, many=True)
+    fields = [f for f in request.query_params.get('fields', '').split(',') if f]
+    unknown = set(fields) - set(UploadedFileSerializer.Meta.fields)
+    if unknown:
+        return Response({
+            'success': False,
+            'message': f"Unknown fields: {', '.join(sorted(unknown))}."
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # Answer unchanged polls with headers only
+    version, last_modified = get_file_cache().collection_version()
+    etag = collection_etag(version, request)
+    not_modified = conditional_response(request, etag, last_modified)
+    if not_modified is not None:
+        return not_modified
+    
+    def build():
+        files = filter_files(UploadedFile.objects.active().for_listing(), request.query_params)
+        paginator = FileCursorPagination()
+        page = paginator.paginate_queryset(files, request)
+        serializer = UploadedFileSerializer(page, many=True, fields=fields)
+        return {
+            'success': True,
+            'files': serializer.data,
+            'page_count': len(page),
+            'next_cursor': paginator.get_next_cursor(),
+            'next': paginator.get_next_link()
+        }
+    
+    # Dashboards poll this; rows only change on upload/delete
+    # The version is in the key, so a worker that missed a bump never serves old rows
+    payload, hit = get_file_cache().get_or_build('list', request, build, revision=version)
+    response = Response(payload, status=status.HTTP_200_OK)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    response['Cache-Control'] = 'private, no-cache'
+    return set_validators(response, etag, last_modified)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_files(request):
+    """
+    Full-text search over file names, document titles, authors and body text -
+    Available to all authenticated users
+    
+    Best matches first, paged with `page` and `limit`. Text is indexed in the
+    background after upload, so brand-new files may take a moment to appear.
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({
+            'success': False,
+            'message': 'A search query (q) is required.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    search_index = get_search_index()
+    if search_index is None:
+        return Response({
+            'success': False,
+            'message': 'Full-text search is not available on this database.'
+        }, status=status.HTTP_501_NOT_IMPLEMENTED)
+    
+    paginator = FileCursorPagination()
+    limit = paginator.get_page_size(request.query_params)
+    try:
+        page = max(1, int(request.query_params.get('page', 1)))
+    except ValueError:
+        return Response({
+            'success': False,
+            'message': 'page must be an integer.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    # One extra hit tells whether another page exists
+    hits = search_index.search(query, limit + 1, (page - 1) * limit)
+    has_next = len(hits) > limit
+    pk_field = UploadedFile._meta.pk
+    ranks = {pk_field.to_python(upload_id): rank for upload_id, rank in hits[:limit]}
+    files = UploadedFile.objects.for_listing().select_related('metadata').in_bulk(list(ranks))
+    results = []
+    for file_id, rank in ranks.items():
+        if file_id in files:
+            files[file_id].rank = rank
+            results.append(files[file_id])
     
     return Response({
         'success': True,
-        'files': serializer.data,
-        'count': files.count()
+        'files': SearchResultSerializer(results, many=True).data,
+        'count': len(results),
+        'next': replace_query_param(request.build_absolute_uri(), 'page', page + 1) if has_next else None
     }, status=status.HTTP_200_OK)
 
 @api_view(['POST'])
@@ -76,18 +499,30 @@ def generate_download_link(request, file_id):
     # Get the file
     file_obj = get_object_or_404(UploadedFile, id=file_id, is_active=True)
     
-    # Generate secure token
-    encrypted_token = generate_secure_download_token(file_obj, request.user)
-    
-    # Create download link record
-    expires_at = timezone.now() + timedelta(hours=24)  # Link expires in 24 hours
+    expires_at = timezone.now() + timedelta(hours=settings.DOWNLOAD_LINK_TTL_HOURS)
     
-    download_link = DownloadLink.objects.create(
-        file=file_obj,
-        user=request.user,
-        encrypted_token=encrypted_token,
-        expires_at=expires_at
-    )
+    if settings.DOWNLOAD_LINK_MODE == 'stateless':
+        # The token carries the grant; the audit row is written in the background
+        encrypted_token = generate_stateless_download_token(file_obj, request.user, expires_at)
+        download_link = DownloadLink(
+            file=file_obj,
+            user=request.user,
+            encrypted_token=encrypted_token,
+            token_key=DownloadLink.lookup_key(encrypted_token),
+            expires_at=expires_at
+        )
+        get_audit_writer().record_issued(download_link)
+    else:
+        # Generate secure token
+        encrypted_token = generate_secure_download_token(file_obj, request.user)
+        
+        # Create download link record
+        download_link = DownloadLink.objects.create(
+            file=file_obj,
+            user=request.user,
+            encrypted_token=encrypted_token,
+            expires_at=expires_at
+        )
     
     serializer = DownloadLinkSerializer(download_link, context={'request': request})
     
@@ -97,6 +532,161 @@ def generate_download_link(request, file_id):
         'download_link': serializer.data['download_link']
     }, status=status.HTTP_200_OK)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def generate_batch_download_links(request):
+    """
+    Generate download links for several files at once - Only for client users
+    
+    Takes `file_ids` (and optionally `zip: true` for one extra link that
+    streams all of them as a single ZIP archive).
+    """
+    if request.user.user_type != 'client':
+        return Response({
+            'success': False,
+            'message': 'Only client users can download files.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = BatchDownloadSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({
+            'success': False,
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    file_ids = serializer.validated_data['file_ids']
+    want_zip = serializer.validated_data['zip']
+    files = UploadedFile.objects.active().in_bulk(file_ids)
+    missing = [str(file_id) for file_id in file_ids if file_id not in files]
+    if missing:
+        return Response({
+            'success': False,
+            'message': 'Some files were not found.',
+            'missing': missing
+        }, status=status.HTTP_404_NOT_FOUND)
+    files = [files[file_id] for file_id in file_ids]
+    
+    expires_at = timezone.now() + timedelta(hours=settings.DOWNLOAD_LINK_TTL_HOURS)
+    stateless = settings.DOWNLOAD_LINK_MODE == 'stateless'
+    batch_id = uuid.uuid4()
+    
+    download_links = []
+    for file_obj in files:
+        if stateless:
+            encrypted_token = generate_stateless_download_token(file_obj, request.user, expires_at)
+        else:
+            encrypted_token = generate_secure_download_token(file_obj, request.user)
+        download_links.append(DownloadLink(
+            file=file_obj,
+            user=request.user,
+            encrypted_token=encrypted_token,
+            # bulk_create skips save(), so the lookup key is set here
+            token_key=DownloadLink.lookup_key(encrypted_token),
+            expires_at=expires_at,
+            batch_id=batch_id
+        ))
+    
+    if stateless:
+        audit = get_audit_writer()
+        for download_link in download_links:
+            audit.record_issued(download_link)
+    else:
+        DownloadLink.objects.bulk_create(download_links)
+    
+    links = DownloadLinkSerializer(download_links, many=True, context={'request': request}).data
+    data = {
+        'success': True,
+        'message': 'Download links generated successfully.',
+        'download_links': [
+            {'file_id': str(download_link.file_id), 'download_link': link['download_link']}
+            for download_link, link in zip(download_links, links)
+        ]
+    }
+    
+    if want_zip:
+        if stateless:
+            zip_token = generate_zip_download_token(request.user, expires_at, files=files)
+        else:
+            DownloadBatch.objects.create(id=batch_id, user=request.user, expires_at=expires_at)
+            zip_token = generate_zip_download_token(request.user, expires_at, batch_id=batch_id)
+        data['zip_link'] = request.build_absolute_uri(f'/api/files/secure-zip/{zip_token}/')
+    
+    return Response(data, status=status.HTTP_200_OK)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def secure_download_zip(request, token):
+    """
+    Stream the files of a batch as one ZIP archive - Only accessible by client users
+    
+    The archive is built on the fly. It is one grant, separate from the
+    batch's per-file links: consumed once the whole archive has been sent,
+    and given back when the transfer is cut short.
+    """
+    if request.user.user_type != 'client':
+        return Response({
+            'success': False,
+            'message': 'Access denied. Only client users can access download links.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    try:
+        token_data = decode_download_token(token)
+        if not token_data.get('zip'):
+            raise ValueError("Not a ZIP token")
+    except ValueError:
+        return Response({
+            'success': False,
+            'message': 'Invalid or expired download token.'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    if str(request.user.id) != token_data['user_id']:
+        return Response({
+            'success': False,
+            'message': 'Access denied. Invalid user for this download link.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    expires_at = datetime.fromtimestamp(token_data['exp'], tz=dt_timezone.utc)
+    if timezone.now() > expires_at:
+        return Response({
+            'success': False,
+            'message': 'Download link has expired.'
+        }, status=status.HTTP_410_GONE)
+    
+    if 'batch_id' in token_data:
+        files = [
+            download_link.file for download_link in
+            DownloadLink.objects.select_related('file', 'file__blob')
+            .filter(batch_id=token_data['batch_id'], user=request.user, file__is_active=True)
+            .order_by('file__name')
+        ]
+        # Batches issued before grants had rows of their own get one on first use
+        grant = DownloadBatch.objects.get_or_create(
+            id=token_data['batch_id'], defaults={'user': request.user, 'expires_at': expires_at}
+        )[0] if files else None
+    else:
+        # Stateless: one nonce covers the whole archive
+        file_ids = [uuid.UUID(file_id) for file_id in token_data['file_ids']]
+        files = UploadedFile.objects.select_related('blob').active().in_bulk(file_ids)
+        files = sorted((files[file_id] for file_id in file_ids if file_id in files), key=lambda f: f.name)
+        total = sum(file_obj.file_size for file_obj in files)
+        grant = StatelessDownloadLink(token, file=None, expires_at=expires_at, nonce=token_data['nonce'], size=total)
+    
+    if not files:
+        return Response({
+            'success': False,
+            'message': 'Files not found.'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    # The archive is one grant, apart from the batch's per-file links: one
+    # request at a time holds it, and an interrupted archive gives it back
+    if not grant.claim():
+        return Response({
+            'success': False,
+            'message': 'Download link has already been used.'
+        }, status=status.HTTP_410_GONE)
+    
+    return zip_response(files, grant.finish)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def secure_download(request, token):
@@ -112,7 +702,8 @@ def secure_download(request, token):
     
     try:
         # Decrypt and validate token
-        file_id, user_id = decrypt_download_token(token)
+        token_data = decode_download_token(token)
+        file_id, user_id = token_data['file_id'], token_data['user_id']
         
         # Verify the user matches the token
         if str(request.user.id) != user_id:
@@ -121,13 +712,21 @@ def secure_download(request, token):
                 'message': 'Access denied. Invalid user for this download link.'
             }, status=status.HTTP_403_FORBIDDEN)
         
-        # Get download link record
-        download_link = get_object_or_404(
-            DownloadLink, 
-            encrypted_token=token,
-            user=request.user,
-            file__id=file_id
-        )
+        if 'nonce' in token_data:
+            # Stateless token: no DownloadLink lookup on the hot path
+            download_link = StatelessDownloadLink(
+                token,
+                file=get_object_or_404(UploadedFile.objects.select_related('blob'), id=file_id, is_active=True),
+                expires_at=datetime.fromtimestamp(token_data['exp'], tz=dt_timezone.utc),
+                nonce=token_data['nonce']
+            )
+        else:
+            # Get download link record
+            download_link = DownloadLink.objects.select_related('file', 'file__blob').get_by_token(
+                token,
+                user=request.user,
+                file__id=file_id
+            )
         
         # Check if link has expired
         if timezone.now() > download_link.expires_at:
@@ -136,7 +735,7 @@ def secure_download(request, token):
                 'message': 'Download link has expired.'
             }, status=status.HTTP_410_GONE)
         
-        # Check if link has already been used (optional - remove if multiple downloads allowed)
+        # Check if a full copy has already been delivered through this link
         if download_link.is_used:
             return Response({
                 'success': False,
@@ -146,29 +745,9 @@ def secure_download(request, token):
         # Get the file
         file_obj = download_link.file
         
-        # Mark link as used
-        download_link.is_used = True
-        download_link.used_at = timezone.now()
-        download_link.save()
-        
-        # Serve the file
-        if os.path.exists(file_obj.file.path):
-            with open(file_obj.file.path, 'rb') as f:
-                file_data = f.read()
-            
-            # Determine content type
-            content_type, _ = mimetypes.guess_type(file_obj.file.path)
-            if not content_type:
-                content_type = 'application/octet-stream'
-            
-            response = HttpResponse(file_data, content_type=content_type)
-            response['Content-Disposition'] = f'attachment; filename="{file_obj.name}"'
-            response['Content-Length'] = len(file_data)
-            
-            return response
-        else:
-            raise Http404("File not found")
-            
+        # Hand the transfer to the configured delivery backend
+        return get_delivery_backend().serve(request, download_link, file_obj)
+    
     except Exception as e:
         return Response({
             'success': False,
@@ -196,25 +775,155 @@ def delete_file(request, file_id):
         is_active=True
     )
     
-    # Soft delete (mark as inactive)
-    file_obj.is_active = False
-    file_obj.save()
+    # Soft delete (mark as inactive); purged later by collect_garbage
+    file_obj.soft_delete()
     
     return Response({
         'success': True,
         'message': 'File deleted successfully.'
     }, status=status.HTTP_200_OK)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def bulk_delete_files(request):
+    """
+    Soft-delete many files at once - Only for operations users who uploaded them
+    
+    Takes `file_ids`; files that are missing, already deleted or owned by
+    someone else are reported per item instead of failing the batch.
+    """
+    if request.user.user_type != 'operations':
+        return Response({
+            'success': False,
+            'message': 'Only operations users can delete files.'
+        }, status=status.HTTP_403_FORBIDDEN)
+    
+    serializer = FileIdsSerializer(data=request.data)
+    if not serializer.is_valid():
+        return Response({
+            'success': False,
+            'errors': serializer.errors
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    file_ids = serializer.validated_data['file_ids']
+    owned = UploadedFile.objects.filter(id__in=file_ids, uploaded_by=request.user, is_active=True)
+    with transaction.atomic():
+        deletable = set(owned.select_for_update().values_list('id', flat=True))
+        # One UPDATE for the whole batch; updated_at moves the detail ETags
+        now = timezone.now()
+        UploadedFile.objects.filter(id__in=deletable, uploaded_by=request.user).update(
+            is_active=False, deleted_at=now, updated_at=now
+        )
+        invalidate_file_cache()
+    
+    results = [
+        {'id': str(file_id), 'success': True} if file_id in deletable
+        else {'id': str(file_id), 'success': False, 'errors': ['Not found.']}
+        for file_id in file_ids
+    ]
+    return _bulk_response(results, 'deleted', status.HTTP_200_OK)
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def file_detail(request, file_id):
     """
     Get file details
     """
-    file_obj = get_object_or_404(UploadedFile, id=file_id, is_active=True)
-    serializer = UploadedFileSerializer(file_obj)
+    updated_at = get_object_or_404(
+        UploadedFile.objects.values_list('updated_at', flat=True), id=file_id, is_active=True
+    )
+    etag = collection_etag(updated_at.timestamp(), request)
+    not_modified = conditional_response(request, etag, updated_at)
+    if not_modified is not None:
+        return not_modified
+    
+    def build():
+        file_obj = get_object_or_404(UploadedFile.objects.for_listing(), id=file_id, is_active=True)
+        serializer = UploadedFileSerializer(file_obj)
+        return {
+            'success': True,
+            'file': serializer.data
+        }
+    
+    payload, hit = get_file_cache().get_or_build('detail', request, build, revision=updated_at.timestamp())
+    response = Response(payload, status=status.HTTP_200_OK)
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    response['Cache-Control'] = 'private, no-cache'
+    return set_validators(response, etag, updated_at)
+
+def _open_preview(file_id, kind):
+    """
+    (binary file, etag) of a preview of an active file, rendering it on a
+    cache miss. Raises Http404 when the file is gone or cannot be previewed.
+    """
+    file_obj = get_object_or_404(
+        UploadedFile.objects.select_related('blob').only(
+            'id', 'file', 'file_type', 'blob__sha256', 'blob__encoding', 'blob__encryption'
+        ),
+        id=file_id,
+        is_active=True
+    )
+    try:
+        preview, key = get_preview_cache().fetch(file_obj, kind)
+    except ExtractionError:
+        raise Http404('No preview is available for this file.')
+    return preview, f'"preview-{key[:32]}-v{PREVIEW_VERSION}"'
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def file_preview(request, file_id):
+    """
+    HTML preview of the first page, slide or sheet - Available to all authenticated users
+    
+    Served from the preview cache, so browsing never reads more than the
+    first part of the document.
+    """
+    preview, etag = _open_preview(file_id, 'html')
+    with preview:
+        not_modified = conditional_response(request, etag, None)
+        if not_modified is not None:
+            return not_modified
+        fragment = preview.read().decode('utf-8')
+    
+    response = Response({
+        'success': True,
+        'preview': {
+            'html': fragment,
+            'thumbnail': request.build_absolute_uri(f'/api/files/preview/{file_id}/thumbnail/')
+        }
+    }, status=status.HTTP_200_OK)
+    response['Cache-Control'] = f'private, max-age={settings.FILE_PREVIEW_MAX_AGE}'
+    return set_validators(response, etag, None)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def file_thumbnail(request, file_id):
+    """
+    PNG thumbnail of the first page, slide or sheet - Available to all authenticated users
+    """
+    preview, etag = _open_preview(file_id, 'png')
+    not_modified = conditional_response(request, etag, None)
+    if not_modified is not None:
+        preview.close()
+        return not_modified
+    
+    response = FileResponse(preview, content_type='image/png')
+    response['Cache-Control'] = f'private, max-age={settings.FILE_PREVIEW_MAX_AGE}'
+    return set_validators(response, etag, None)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cache_stats(request):
+    """
+    File list/detail cache hit and miss counters for this worker - Only for operations users
+    """
+    if request.user.user_type != 'operations':
+        return Response({
+            'success': False,
+            'message': 'Only operations users can view cache statistics.'
+        }, status=status.HTTP_403_FORBIDDEN)
     
     return Response({
         'success': True,
-        'file': serializer.data
+        'cache': get_file_cache().stats()
     }, status=status.HTTP_200_OK)
\ No newline at end of file
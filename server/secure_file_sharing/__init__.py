@@ -1 +1,9 @@
-# This file makes Python treat the directory as a package
\ No newline at end of file
+# This file makes Python treat the directory as a package
+
+# Load the Celery app (when installed) so @shared_task binds to it
+try:
+    from .celery import app as celery_app
+except ImportError:
+    celery_app = None
+
+__all__ = ('celery_app',)
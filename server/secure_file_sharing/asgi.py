@@ -2,5 +2,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'secure_file_sharing.settings')
+# The async endpoints are only mounted here; under WSGI each would need its own event loop
+os.environ.setdefault('ROOT_URLCONF', 'secure_file_sharing.asgi_urls')
 
 application = get_asgi_application()
\ No newline at end of file
@@ -0,0 +1,8 @@
+"""URLs served under ASGI: everything in urls.py plus the async endpoints"""
+from django.urls import path, include
+
+from .urls import urlpatterns as base_urlpatterns
+
+urlpatterns = base_urlpatterns + [
+    path('api/async/files/', include('files.async_urls')),
+]
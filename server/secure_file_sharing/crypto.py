@@ -0,0 +1,85 @@
+import base64
+import binascii
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+def derive_key(secret):
+    """Fernet key from a configured secret (the original derivation, so existing tokens stay valid)"""
+    return base64.urlsafe_b64encode(secret.encode()[:32].ljust(32, b'0'))
+
+@lru_cache(maxsize=None)
+def get_fernet():
+    """
+    Shared MultiFernet, built once per process.
+    
+    ENCRYPTION_KEY encrypts new tokens; ENCRYPTION_KEY_FALLBACKS are still
+    accepted for decryption so keys can be rotated without breaking links.
+    """
+    secrets = [settings.ENCRYPTION_KEY, *settings.ENCRYPTION_KEY_FALLBACKS]
+    return MultiFernet([Fernet(derive_key(secret)) for secret in secrets])
+
+@lru_cache(maxsize=None)
+def get_file_key_fernet():
+    """
+    MultiFernet wrapping the data keys of encrypted files (files.encryption).
+    
+    FILE_ENCRYPTION_KEY wraps new keys; FILE_ENCRYPTION_KEY_FALLBACKS still
+    unwrap existing ones until `encrypt_blobs --rotate-keys` re-wraps them.
+    Unlike ENCRYPTION_KEY these are Fernet keys, used as they are.
+    """
+    keys = [key for key in [settings.FILE_ENCRYPTION_KEY, *settings.FILE_ENCRYPTION_KEY_FALLBACKS] if key]
+    if not keys:
+        raise ImproperlyConfigured('Encrypted files need FILE_ENCRYPTION_KEY.')
+    try:
+        return MultiFernet([Fernet(key) for key in keys])
+    except ValueError as e:
+        raise ImproperlyConfigured(f'Invalid FILE_ENCRYPTION_KEY: {e}')
+
+@receiver(setting_changed)
+def _reset_fernet(setting, **kwargs):
+    if setting in ('ENCRYPTION_KEY', 'ENCRYPTION_KEY_FALLBACKS'):
+        get_fernet.cache_clear()
+    if setting in ('FILE_ENCRYPTION_KEY', 'FILE_ENCRYPTION_KEY_FALLBACKS'):
+        get_file_key_fernet.cache_clear()
+
+def encrypt(data):
+    """Encrypt bytes into a URL-safe token string"""
+    # Fernet output is already URL-safe base64; no second encoding needed
+    return get_fernet().encrypt(data).decode()
+
+def decrypt(token, ttl=None):
+    """
+    Decrypt a token produced by `encrypt`.
+    
+    While ENCRYPTION_ACCEPT_LEGACY_TOKENS is enabled, tokens in the old
+    double-base64 format are accepted too. Raises InvalidToken on failure.
+    """
+    fernet = get_fernet()
+    try:
+        return fernet.decrypt(token.encode(), ttl=ttl)
+    except InvalidToken:
+        if not settings.ENCRYPTION_ACCEPT_LEGACY_TOKENS:
+            raise
+    
+    try:
+        legacy = base64.urlsafe_b64decode(token.encode())
+    except (binascii.Error, ValueError):
+        raise InvalidToken
+    return fernet.decrypt(legacy, ttl=ttl)
+
+def wrap_file_key(data):
+    """Encrypt a file's key material under FILE_ENCRYPTION_KEY"""
+    return get_file_key_fernet().encrypt(data).decode()
+
+def unwrap_file_key(wrapped):
+    """Key material wrapped by `wrap_file_key` with the current or a fallback key; raises InvalidToken"""
+    return get_file_key_fernet().decrypt(wrapped.encode())
+
+def rewrap_file_key(wrapped):
+    """`wrapped` re-encrypted under FILE_ENCRYPTION_KEY"""
+    return get_file_key_fernet().rotate(wrapped.encode()).decode()